@@ -8,6 +8,8 @@ from dotenv import load_dotenv
 from genai_session.session import GenAISession
 from genai_session.utils.context import GenAIContext
 
+from excel_export import write_excel
+
 load_dotenv()
 
 AGENT_JWT = os.getenv("GENAI_JWT_TOKEN")
@@ -30,13 +32,11 @@ async def export_result_agent(
         if not data:
             return {"error": "No data to export"}
 
-        df = pd.DataFrame(data)
-
         with tempfile.NamedTemporaryFile(delete=False, suffix=f".{format.lower()}") as tmpfile:
             if format.lower() == "csv":
-                df.to_csv(tmpfile.name, index=False)
+                pd.DataFrame(data).to_csv(tmpfile.name, index=False)
             elif format.lower() in ("xlsx", "excel"):
-                df.to_excel(tmpfile.name, index=False)
+                write_excel(tmpfile.name, data)
             else:
                 return {"error": f"Unsupported format: {format}"}
 
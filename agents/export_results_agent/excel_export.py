@@ -0,0 +1,161 @@
+import datetime
+import decimal
+import json
+import os
+import pickle
+from typing import IO, Any, Callable, Iterable, List, Mapping, Optional, Sequence, Union
+
+import xlsxwriter
+
+
+# Rows per worksheet, header included
+EXCEL_MAX_ROWS = 1_048_576
+EXCEL_SHEET_NAME = os.getenv("GOLDEN_SAPPHIRE_EXCEL_SHEET_NAME", "Sheet")
+
+CellWriter = Callable[[Any, int, int, Any], Any]
+
+
+class ExcelBatchEncoder:
+    """
+    Writes rows to an .xlsx workbook in xlsxwriter's constant-memory mode.
+
+    Each row is flushed to a temp file as soon as the next one starts, so
+    memory does not grow with the export. When a sheet reaches Excel's row
+    limit the header is repeated on a new sheet (``Sheet1``, ``Sheet2``...).
+    The cell type of a column is chosen from its first non-null value and
+    reused for the rest of the column; timezones are dropped from datetimes.
+
+    Rows can be ``asyncpg.Record`` objects or dicts; the header comes from
+    ``columns`` or from the keys of the first row.
+    """
+
+    def __init__(
+        self,
+        out: Union[str, IO[bytes]],
+        columns: Optional[Sequence[str]] = None,
+        sheet_name: str = EXCEL_SHEET_NAME,
+        max_rows: int = EXCEL_MAX_ROWS,
+    ) -> None:
+        self._workbook = xlsxwriter.Workbook(out, {
+            "constant_memory": True,
+            "remove_timezone": True,
+            "nan_inf_to_errors": True,
+        })
+        self._formats = {
+            "datetime": self._workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"}),
+            "date": self._workbook.add_format({"num_format": "yyyy-mm-dd"}),
+            "time": self._workbook.add_format({"num_format": "hh:mm:ss"}),
+            "duration": self._workbook.add_format({"num_format": "[h]:mm:ss"}),
+        }
+        self._sheet_name = sheet_name
+        self._max_rows = max_rows
+        self._columns: Optional[List[str]] = list(columns) if columns is not None else None
+        self._writers: List[Optional[tuple]] = []
+        self._worksheet = None
+        self._sheet_count = 0
+        self._row = 0
+        self.row_count = 0
+
+    def _cell_writer(self, value: Any) -> CellWriter:
+        if isinstance(value, bool):
+            return lambda ws, r, c, v: ws.write_boolean(r, c, v)
+        if isinstance(value, (int, float)):
+            return lambda ws, r, c, v: ws.write_number(r, c, v)
+        if isinstance(value, decimal.Decimal):
+            return lambda ws, r, c, v: ws.write_number(r, c, float(v))
+        if isinstance(value, datetime.datetime):
+            fmt = self._formats["datetime"]
+        elif isinstance(value, datetime.date):
+            fmt = self._formats["date"]
+        elif isinstance(value, datetime.time):
+            fmt = self._formats["time"]
+        elif isinstance(value, datetime.timedelta):
+            fmt = self._formats["duration"]
+        elif isinstance(value, str):
+            return lambda ws, r, c, v: ws.write_string(r, c, v)
+        elif isinstance(value, (dict, list)):
+            return lambda ws, r, c, v: ws.write_string(r, c, json.dumps(v, default=str))
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            return lambda ws, r, c, v: ws.write_string(r, c, bytes(v).hex())
+        else:
+            # uuid.UUID and anything else Postgres hands back as an object
+            return lambda ws, r, c, v: ws.write_string(r, c, str(v))
+        return lambda ws, r, c, v: ws.write_datetime(r, c, v, fmt)
+
+    def _new_sheet(self) -> None:
+        self._sheet_count += 1
+        self._worksheet = self._workbook.add_worksheet(f"{self._sheet_name}{self._sheet_count}")
+        for col, name in enumerate(self._columns or []):
+            self._worksheet.write_string(0, col, str(name))
+        self._row = 1
+
+    def write_batch(self, records: Iterable[Mapping[str, Any]]) -> None:
+        records = iter(records)
+        if self._columns is None:
+            first = next(records, None)
+            if first is None:
+                return
+            self._columns = list(first.keys())
+            self.write_rows([first.values()])
+        self.write_rows(record.values() for record in records)
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        """Writes rows of values in ``columns`` order; the columns must be known already."""
+        writers = self._writers
+        if not writers:
+            writers.extend([None] * len(self._columns))
+        for values in rows:
+            if self._worksheet is None or self._row >= self._max_rows:
+                self._new_sheet()
+            ws, row = self._worksheet, self._row
+            for col, value in enumerate(values):
+                if value is None:
+                    continue
+                cached = writers[col]
+                # One type check per cell; the writer is only rebuilt when a column changes type
+                if cached is None or type(value) is not cached[0]:
+                    cached = writers[col] = (type(value), self._cell_writer(value))
+                cached[1](ws, row, col, value)
+            self._row += 1
+            self.row_count += 1
+
+    def close(self) -> None:
+        if self._worksheet is None:
+            self._new_sheet()
+        self._workbook.close()
+
+
+def write_excel(out: Union[str, IO[bytes]], rows: Iterable[Mapping[str, Any]], columns: Optional[Sequence[str]] = None) -> int:
+    """
+    Writes ``rows`` to an .xlsx file or binary file object.
+
+    Returns:
+        int: Number of rows written.
+    """
+    encoder = ExcelBatchEncoder(out, columns)
+    encoder.write_batch(rows)
+    encoder.close()
+    return encoder.row_count
+
+
+def write_excel_spool(spool_path: str, out_path: str, columns: Sequence[str]) -> int:
+    """
+    Writes an .xlsx from a spool of pickled row batches; runs as a pool task.
+
+    Args:
+        spool_path: File of batches (lists of value tuples) written one after another with ``pickle.dump``.
+        out_path: Path of the workbook to create.
+        columns: Header, in the order of the values.
+
+    Returns:
+        int: Number of rows written.
+    """
+    encoder = ExcelBatchEncoder(out_path, columns)
+    with open(spool_path, "rb") as spool:
+        while True:
+            try:
+                encoder.write_rows(pickle.load(spool))
+            except EOFError:
+                break
+    encoder.close()
+    return encoder.row_count
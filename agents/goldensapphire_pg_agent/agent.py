@@ -11,52 +11,28 @@ from genai_session.utils.context import GenAIContext
 from genai_session.utils.agents import AgentResponse
 from genai_session.utils.file_manager import FileManager
 import traceback
-import re
 import requests
 import datetime
-import decimal
-import uuid
 
 import pandas as pd
 import tempfile
 
-def make_json_serializable(obj):
-    if isinstance(obj, dict):
-        return {k: make_json_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [make_json_serializable(item) for item in obj]
-    elif isinstance(obj, (uuid.UUID, decimal.Decimal)):
-        return str(obj)
-    elif isinstance(obj, (datetime.datetime, datetime.date)):
-        return obj.isoformat()
-    else:
-        return obj
+from cost_guard import COST_GUARD_PREVIEW_ROWS, QueryRejected, apply_cost_guard
+from excel_export import write_excel
+from metrics import BYTES_TOTAL, OPERATION_SECONDS, REGISTRY, ROWS_TOTAL, STAGE_SECONDS, LoopLagMonitor, cache_families, publish_metrics
+from pagination import PageError, decode_token, encode_token, page_key_columns, page_query, page_size_for, query_fingerprint, split_page
+from pg_pool import pg_pools, prepare_cached
+from replica_router import replica_router
+from sql_params import parameterizer
+from row_encoder import RowEncoder
+from sql_rewriter import get_rewriter
 
 def rewrite_table_aliases(sql: str, table_aliases: Dict[str, str]) -> str:
-    for alias, real_name in table_aliases.items():
-        sql = re.sub(rf"\b{alias}\b", real_name, sql, flags=re.IGNORECASE)
-    return sql
+    return get_rewriter(table_aliases).rewrite(sql)
 
 def rewrite_column_value_clauses(sql: str, value_mappings: Dict[str, Dict[str, str]]) -> str:
-    where_pattern = re.search(r"\bWHERE\b\s+(.+)", sql, re.IGNORECASE)
-    if not where_pattern:
-        return sql  # No WHERE clause — skip
-
-    condition = where_pattern.group(1)
-
-    # Rewrite conditions for each table's mapping
-    for table, mappings in value_mappings.items():
-        for user_term, db_condition in mappings.items():
-            # Replace exact match like: active = true
-            pattern = rf"\b{user_term}\s*=\s*true\b"
-            condition = re.sub(pattern, db_condition, condition, flags=re.IGNORECASE)
-
-            # Optional: handle shorthand like just "active"
-            condition = re.sub(rf"\b{user_term}\b", db_condition, condition, flags=re.IGNORECASE)
-
-    # Reconstruct the SQL
-    updated_sql = re.sub(r"\bWHERE\b\s+(.+)", f"WHERE {condition}", sql, flags=re.IGNORECASE)
-    return updated_sql
+    # Only terms after WHERE are rewritten; literals and quoted identifiers are left alone
+    return get_rewriter({}, value_mappings).rewrite(sql)
 
 # Load environment variables
 load_dotenv()
@@ -68,6 +44,7 @@ TABLE_ALIASES = {
 }
 
 def resolve_table_alias(sql: str) -> str:
+    # Plain str.replace beats any scan of the query for these few aliases
     for alias, actual in TABLE_ALIASES.items():
         sql = sql.replace(f" {alias} ", f" {actual} ")
         sql = sql.replace(f" {alias}\n", f" {actual}\n")
@@ -116,6 +93,8 @@ def get_my_agents(base_url) -> list[dict]:
 
 AGENT_JWT = os.getenv("GENAI_JWT_TOKEN")
 session = GenAISession(jwt_token=AGENT_JWT)
+REGISTRY.const_labels["component"] = "postgres_query_agent"
+REGISTRY.register_collector(lambda: cache_families({"prepared_statements": pg_pools.statement_stats()}))
 
 # Load DB connection string and schema path
 PG_URL = os.getenv("GOLDEN_SAPPHIRE_DB_URL")
@@ -149,15 +128,59 @@ if SCHEMA_PATH:
 async def postgres_query_agent(
     agent_context: GenAIContext,
     request: Annotated[str, "SQL SELECT query to execute with placeholders like $1, $2, etc."],
-    export_format: Annotated[str, "Optional export format (csv or excel)"] = 'excel',
+    export_format: Annotated[Optional[str], "Optional export format (csv or excel); excel unless a page is requested"] = None,
     arguments: Annotated[Optional[Dict[str, Any]], "Dictionary of parameters to bind to the SQL query"] = None,
+    max_replica_lag: Annotated[Optional[float], "Seconds of replication lag acceptable when a read replica serves the query; 0 reads from the primary"] = None,
+    page_size: Annotated[Optional[int], "Rows per page; returns one page and a next_page_token instead of every row. Cannot be combined with export_format"] = None,
+    page_token: Annotated[Optional[str], "next_page_token of the previous page, to fetch the page after it"] = None,
+    page_key: Annotated[Optional[list[str]], "Result columns that are unique together (e.g. the primary key), to order the pages by; NULLs sort last. All orderable columns by default"] = None,
 ) -> Any:
     """Executes SELECT queries on PostgreSQL with parameters"""
+    started = time.perf_counter()
+    outcome = "error"
+    paged = page_size is not None or page_token is not None or page_key is not None
+    if export_format is None and not paged:
+        export_format = 'excel'
+    try:
+        if paged and export_format:
+            result = {
+                "success": False,
+                "error": "invalid_page",
+                "message": "page_size, page_token and page_key cannot be combined with export_format.",
+            }
+        else:
+            result = await _run_query(
+                agent_context, request, export_format, arguments, max_replica_lag,
+                paged, page_size, page_token, page_key,
+            )
+        if not result["success"]:
+            outcome = result["error"]
+        elif "export_error" in result:
+            outcome = "export_failed"
+        elif paged:
+            outcome = "paged"
+        else:
+            outcome = "exported" if export_format else "queried"
+        return result
+    finally:
+        OPERATION_SECONDS.observe(time.perf_counter() - started, operation="postgres_query_agent", outcome=outcome)
+
+
+async def _run_query(
+    agent_context: GenAIContext,
+    request: str,
+    export_format: Optional[str],
+    arguments: Optional[Dict[str, Any]],
+    max_replica_lag: Optional[float] = None,
+    paged: bool = False,
+    page_size: Optional[int] = None,
+    page_token: Optional[str] = None,
+    page_key: Optional[list[str]] = None,
+) -> Dict[str, Any]:
     session_url = os.getenv("GENAI_API_BASE_URL")
     if not session_url:
         raise ValueError("GENAI_API_BASE_URL environment variable is not set")
     print(f'Active agent UUID: {agent_context.agent_uuid}')
-    data = get_my_agents(session_url)
     agent_context.logger.info(f"Request: {request}, Arguments: {arguments}")
 #     agent_context.logger.info(f"Active agents: {data}")
 #     print(f"Active agents: {data}")
@@ -181,9 +204,7 @@ async def postgres_query_agent(
 #          raise Exception("Could not fetch schema alias context")
 
 #     raw_sql = request.strip()  # your incoming query string
-#     sql1 = rewrite_table_aliases(raw_sql, table_aliases)
-#     sql2 = rewrite_column_value_clauses(sql1, column_value_mappings)
-#     sql = sql2
+#     sql = get_rewriter(table_aliases, column_value_mappings).rewrite(raw_sql)
 
     sql = request.strip()  # your incoming query string
     agent_context.logger.info("Executing query request")
@@ -201,18 +222,61 @@ async def postgres_query_agent(
         }
 
     try:
-        conn = await asyncpg.connect(PG_URL)
-
-        agent_context.logger.debug(f"Resolved SQL: {sql}")
-        rows = await conn.fetch(sql, *tuple(arguments.values()) if arguments else ())
-        await conn.close()
-        result = [dict(row) for row in rows]
-        for row in result:
-            for key, value in row.items():
-                row[key] = make_json_serializable(value)
+        if paged:
+            page_size = page_size_for(page_size)
+            fingerprint = query_fingerprint(sql, arguments)
+            cursor = decode_token(page_token, fingerprint) if page_token else None
+            if cursor is not None and page_key and list(page_key) != list(cursor.columns):
+                raise PageError("page_key cannot change between pages of a query.")
+        with STAGE_SECONDS.time(operation="postgres_query_agent", stage="query"):
+            # Replicas come from GOLDEN_SAPPHIRE_DB_REPLICA_URLS
+            async with replica_router.acquire(PG_URL, sql, max_replica_lag) as conn:
+                agent_context.logger.debug(f"Resolved SQL: {sql}")
+                # Inline literals become parameters, so recurring report shapes reuse a prepared statement
+                query = await parameterizer.prepare(conn, sql, arguments)
+                if paged:
+                    # Keyset pagination: the page starts after the token's key, not at an OFFSET
+                    attributes = query.statement.get_attributes()
+                    key_columns = page_key_columns(attributes, cursor.columns if cursor else page_key)
+                    paged_sql, key_args = page_query(query.sql, attributes, key_columns, page_size, cursor, len(query.args) + 1)
+                    args = query.args + tuple(key_args)
+                    sql = (await apply_cost_guard(conn, paged_sql, {f"${index}": value for index, value in enumerate(args, 1)} or None)).sql
+                    stmt = await prepare_cached(conn, sql)
+                    rows = await stmt.fetch(*args)
+                    # Names stop before the page key column, so the encoded rows leave it out
+                    row_encoder = RowEncoder(attributes)
+                else:
+                    # Results returned inline are capped at a preview; exports are not
+                    preview_rows = None if export_format else COST_GUARD_PREVIEW_ROWS
+                    guarded = await apply_cost_guard(conn, query.sql, query.arguments, preview_rows)
+                    sql = guarded.sql
+                    stmt = query.statement if sql == query.sql else await prepare_cached(conn, sql)
+                    rows = await stmt.fetch(*query.args)
+                    row_encoder = RowEncoder(stmt.get_attributes())
+                    # The guard's LIMIT lets one row past the preview through when there are more
+                    truncated = guarded.limited and len(rows) > preview_rows
+                    if truncated:
+                        rows = rows[:preview_rows]
+        agent_context.logger.debug(f"Pool stats: {pg_pools.stats()}, replicas: {replica_router.stats()}")
+        agent_context.logger.debug(
+            f"Parameterized {query.lifted} literals; statements: {pg_pools.statement_stats()}, "
+            f"parameterization: {parameterizer.stats()}"
+        )
+        if paged:
+            rows, next_cursor = split_page(rows, key_columns, page_size, cursor)
+        with STAGE_SECONDS.time(operation="postgres_query_agent", stage="encode"):
+            result = row_encoder.encode(rows)
         agent_context.logger.info(f"Query returned {len(result)} rows")
+        if paged:
+            return {
+                "success": True,
+                "message": "Query succeeded",
+                "data": result,
+                "page_size": page_size,
+                "page_key": key_columns,
+                "next_page_token": encode_token(fingerprint, next_cursor) if next_cursor else None,
+            }
         if export_format:
-           df = pd.DataFrame(result)
            suffix = ".csv" if export_format == "csv" else ".xlsx"
            filename = f"exported_data_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}"
            tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
@@ -220,23 +284,24 @@ async def postgres_query_agent(
 
            try:
 
-               if export_format == "csv":
-                   df.to_csv(file_path, index=False)
-               elif export_format == "excel":
-                   df.to_excel(file_path, index=False)
-               else:
-                   raise ValueError("Unsupported export format")
+               with STAGE_SECONDS.time(operation="postgres_query_agent", stage="write_file"):
+                   if export_format == "csv":
+                       pd.DataFrame(result).to_csv(file_path, index=False)
+                   elif export_format == "excel":
+                       # Constant-memory writer; keeps the native column types of the records
+                       write_excel(file_path, rows)
+                   else:
+                       raise ValueError("Unsupported export format")
                fm = FileManager(api_base_url=os.getenv("GENAI_API_BASE_URL"), session_id=agent_context.session_id,request_id=agent_context.request_id,jwt_token=AGENT_JWT)
                with open(file_path, "rb") as f:
                    file_bytes = f.read()
-               file_id = await fm.save(file_bytes, filename)
+               with STAGE_SECONDS.time(operation="postgres_query_agent", stage="upload"):
+                   file_id = await fm.save(file_bytes, filename)
+               ROWS_TOTAL.inc(len(rows), operation="postgres_query_agent", format=export_format)
+               BYTES_TOTAL.inc(len(file_bytes), operation="postgres_query_agent", format=export_format)
                agent_context.logger.info(f"Exported result to {file_path} with file_id {file_id}")
                agent_context.logger.info(f"Exported result to {file_path}")
-               file_service_url = os.getenv("GENAI_API_BASE_URL", "http://localhost:8000")
-               print('File Id', make_json_serializable(file_id))
-               download_url = f"{file_service_url}/files/{file_id}"
-               content = await fm.get_by_id(file_id),
-               time.sleep(5)
+               agent_context.logger.debug(f"File Id: {file_id}")
                return {
                    "success": True,
                    "message": f"Query and export to {export_format} successful",
@@ -251,12 +316,41 @@ async def postgres_query_agent(
                    #"data": result,
                    "export_error": str(ex)
                }
+        elif truncated:
+            agent_context.logger.warning(
+                f"Inline result cut to {preview_rows} rows; about {guarded.estimated_rows:,.0f} estimated"
+            )
+            return {
+                "success": True,
+                "message": (
+                    f"Query succeeded; only the first {preview_rows} rows are returned. "
+                    "Pass page_size to page through every row, or export_format to get a file."
+                ),
+                "data": result,
+                "truncated": True,
+                "estimated_rows": guarded.estimated_rows,
+            }
         else:
             return {
                 "success": True,
                 "message": "Query succeeded",
                 "data": result,
             }
+    except PageError as e:
+        agent_context.logger.warning(f"Page request rejected: {e}")
+        return {
+            "success": False,
+            "error": "invalid_page",
+            "message": str(e),
+        }
+    except QueryRejected as e:
+        agent_context.logger.warning(f"Query rejected by cost guard: {e.reason}")
+        return {
+            "success": False,
+            "error": "query_rejected",
+            "message": e.reason,
+            "details": e.to_dict(),
+        }
     except Exception as e:
         tb = traceback.format_exc()
         print("Error:", e)
@@ -279,7 +373,16 @@ async def postgres_query_agent(
 
 async def main():
     print(f"Postgres Query Agent with token '{{agent_token}}' started")
-    await session.process_events()
+    loop_lag_monitor = LoopLagMonitor()
+    loop_lag_monitor.start()
+    publisher = asyncio.create_task(publish_metrics("postgres_query_agent"))
+    try:
+        await session.process_events()
+    finally:
+        publisher.cancel()
+        await loop_lag_monitor.stop()
+        # Drain pooled DB connections on shutdown
+        await pg_pools.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
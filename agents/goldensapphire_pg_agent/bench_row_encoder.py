@@ -0,0 +1,136 @@
+"""
+Micro-benchmark of RowEncoder against the per-value make_json_serializable
+loop it replaced in agent.py, on synthetic amf_delivery rows.
+
+The columns of amf_delivery are repeated ``--width`` times to model wide
+results. Records are plain tuples standing in for asyncpg.Record, which
+iterates the same way; UUIDs are asyncpg's own UUID type, as in real results.
+
+Usage:
+    python bench_row_encoder.py [--rows 50000] [--width 3] [--repeat 5]
+"""
+import argparse
+import datetime
+import decimal
+import json
+import statistics
+import time
+import uuid
+
+from asyncpg.pgproto.pgproto import UUID
+from asyncpg.types import Attribute, Type
+
+import row_encoder
+from row_encoder import RowEncoder, dumps
+
+
+AMF_DELIVERY = [
+    ("delivery_id", "uuid"),
+    ("time_queued", "timestamptz"),
+    ("message_id", "uuid"),
+    ("file_name", "text"),
+    ("file_path", "text"),
+    ("message_type", "text"),
+    ("next_time", "timestamptz"),
+    ("sender", "text"),
+    ("receiver", "text"),
+    ("status", "text"),
+    ("orig_file", "text"),
+    ("deleted", "bool"),
+    ("locked", "bool"),
+]
+
+
+def legacy_make_json_serializable(obj):
+    if isinstance(obj, dict):
+        return {k: legacy_make_json_serializable(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [legacy_make_json_serializable(item) for item in obj]
+    elif isinstance(obj, (uuid.UUID, decimal.Decimal)):
+        return str(obj)
+    elif isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    else:
+        return obj
+
+
+def make_rows(count: int, width: int) -> tuple[list, list[tuple]]:
+    columns = [
+        Attribute(name if copy == 0 else f"{name}_{copy}", Type(0, type_name, "scalar", "pg_catalog"))
+        for copy in range(width)
+        for name, type_name in AMF_DELIVERY
+    ]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    rows = []
+    for i in range(count):
+        row = (
+            UUID(uuid.uuid4().bytes), now - datetime.timedelta(seconds=i), UUID(uuid.uuid4().bytes),
+            f"file_{i}.edi", f"/data/outbound/{i % 50}/file_{i}.edi", "850",
+            now + datetime.timedelta(minutes=i % 60), f"SENDER{i % 50}", f"RECEIVER{i % 80}",
+            ("Delivered", "Failed", "Queued")[i % 3], None if i % 4 else f"orig_{i}.edi",
+            i % 7 == 0, False,
+        )
+        rows.append(row * width)
+    return columns, rows
+
+
+def legacy(columns: list, rows: list[tuple]) -> list:
+    names = [column.name for column in columns]
+    result = [dict(zip(names, row)) for row in rows]
+    for row in result:
+        for key, value in row.items():
+            row[key] = legacy_make_json_serializable(value)
+    return result
+
+
+def timed(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--width", type=int, default=3, help="Times the amf_delivery columns are repeated")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    columns, rows = make_rows(args.rows, args.width)
+    encoder = RowEncoder(columns)
+    assert encoder.encode(rows[:100]) == legacy(columns, rows[:100])
+
+    def dump_with(backend: str):
+        # Same setup as the JSON exporters: converters chosen for the backend
+        backend_encoder = RowEncoder(columns, backend)
+
+        def run() -> list:
+            row_encoder.JSON_BACKEND = backend
+            return [dumps(r) for r in backend_encoder.encode(rows)]
+        return run
+
+    # (name, function, baseline name)
+    cases = [
+        ("make_json_serializable", lambda: legacy(columns, rows), "make_json_serializable"),
+        ("RowEncoder", lambda: encoder.encode(rows), "make_json_serializable"),
+        ("make_json_serializable + json",
+         lambda: [json.dumps(r, ensure_ascii=False).encode("utf-8") for r in legacy(columns, rows)],
+         "make_json_serializable + json"),
+        ("RowEncoder + json", dump_with("json"), "make_json_serializable + json"),
+    ]
+    if row_encoder.orjson is not None:
+        cases.append(("RowEncoder + orjson", dump_with("orjson"), "make_json_serializable + json"))
+
+    print(f"{args.rows} rows x {len(columns)} columns, median of {args.repeat}\n")
+    results = {}
+    for name, fn, baseline in cases:
+        seconds = results[name] = timed(fn, args.repeat)
+        print(f"{name:<32} {seconds * 1000:>9.1f} ms {args.rows / seconds:>12,.0f} rows/s "
+              f"{results[baseline] / seconds:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
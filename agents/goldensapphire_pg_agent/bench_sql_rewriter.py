@@ -0,0 +1,123 @@
+"""
+Micro-benchmark of the single-pass SqlRewriter against the per-alias regex
+loops it replaced in agent.py.
+
+Usage:
+    python bench_sql_rewriter.py [--iterations 2000]
+"""
+import argparse
+import re
+import time
+from typing import Dict
+
+from sql_rewriter import get_rewriter
+
+
+TABLE_ALIASES = {
+    "users": "amf_user",
+    "messages": "amf_message",
+    "deliveries": "amf_delivery",
+    "customers": "amf_customer",
+}
+
+# Same shape as the column_value_mappings served by schema_alias_context_agent
+COLUMN_VALUE_MAPPINGS = {
+    "amf_user": {
+        "active": "active=true",
+        "inactive": "active = false",
+        "first_name": "given_name",
+        "last_name": "surname",
+        "email_address": "email",
+        "phone": "phone_number",
+    },
+    "amf_message": {
+        "message_id": "message_id::text",
+        "delivered": "status = 'Delivered'",
+        "failed": "status = 'Failed'",
+        "held": "status = 'Held'",
+        "queued": "status = 'Queued'",
+        "date": "create_time",
+        "message_type": "msg_type",
+        "id": "message_id",
+        "create_time": "create_time::text",
+        "file_size": "file_size",
+    },
+    "amf_delivery": {
+        "delivered": "status = 'Delivered'",
+        "failed": "status = 'Failed'",
+        "held": "status = 'Held'",
+        "queued": "status = 'Queued'",
+        "date": "create_time",
+        "active": "deleted= false",
+        "deleted": "deleted= true",
+    },
+    "amf_customer": {
+        "customer_name": "customer",
+        "billing_id": "billing_id",
+    },
+}
+
+QUERIES = {
+    "short": "SELECT * FROM users WHERE active = true",
+    "medium": (
+        "SELECT m.sender, m.receiver, count(*) AS total FROM messages m "
+        "JOIN deliveries d ON d.message_id = m.message_id "
+        "WHERE failed AND m.sender <> 'unknown' AND d.receiver IN (SELECT user_name FROM users WHERE active) "
+        "GROUP BY m.sender, m.receiver ORDER BY total DESC LIMIT 100"
+    ),
+}
+QUERIES["long"] = " UNION ALL ".join([QUERIES["medium"].replace(" LIMIT 100", "").replace("ORDER BY total DESC", "")] * 20)
+
+
+def legacy_rewrite_table_aliases(sql: str, table_aliases: Dict[str, str]) -> str:
+    for alias, real_name in table_aliases.items():
+        sql = re.sub(rf"\b{alias}\b", real_name, sql, flags=re.IGNORECASE)
+    return sql
+
+
+def legacy_rewrite_column_value_clauses(sql: str, value_mappings: Dict[str, Dict[str, str]]) -> str:
+    where_pattern = re.search(r"\bWHERE\b\s+(.+)", sql, re.IGNORECASE)
+    if not where_pattern:
+        return sql
+    condition = where_pattern.group(1)
+    for table, mappings in value_mappings.items():
+        for user_term, db_condition in mappings.items():
+            pattern = rf"\b{user_term}\s*=\s*true\b"
+            condition = re.sub(pattern, db_condition, condition, flags=re.IGNORECASE)
+            condition = re.sub(rf"\b{user_term}\b", db_condition, condition, flags=re.IGNORECASE)
+    return re.sub(r"\bWHERE\b\s+(.+)", f"WHERE {condition}", sql, flags=re.IGNORECASE)
+
+
+def timed(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'query':<8} {'chars':>6} {'legacy us':>10} {'single-pass us':>15} {'speedup':>8}")
+    for name, sql in QUERIES.items():
+        def legacy():
+            return legacy_rewrite_column_value_clauses(
+                legacy_rewrite_table_aliases(sql, TABLE_ALIASES), COLUMN_VALUE_MAPPINGS
+            )
+
+        def single_pass():
+            return get_rewriter(TABLE_ALIASES, COLUMN_VALUE_MAPPINGS).rewrite(sql)
+
+        legacy_us = timed(legacy, args.iterations)
+        single_us = timed(single_pass, args.iterations)
+        print(f"{name:<8} {len(sql):>6} {legacy_us:>10.1f} {single_us:>15.1f} {legacy_us / single_us:>7.1f}x")
+
+    print("\nLegacy output:     ", legacy_rewrite_column_value_clauses(
+        legacy_rewrite_table_aliases(QUERIES["short"], TABLE_ALIASES), COLUMN_VALUE_MAPPINGS))
+    print("Single-pass output:", get_rewriter(TABLE_ALIASES, COLUMN_VALUE_MAPPINGS).rewrite(QUERIES["short"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+
+COST_GUARD_ENABLED = os.getenv("GOLDEN_SAPPHIRE_COST_GUARD", "true").lower() in ("1", "true", "yes")
+# Planner cost units; queries estimated above either budget are rejected
+COST_GUARD_MAX_COST = float(os.getenv("GOLDEN_SAPPHIRE_COST_GUARD_MAX_COST", "10000000"))
+COST_GUARD_MAX_ROWS = float(os.getenv("GOLDEN_SAPPHIRE_COST_GUARD_MAX_ROWS", "50000000"))
+# Server-side limit for every guarded query, in milliseconds
+COST_GUARD_STATEMENT_TIMEOUT = int(os.getenv("GOLDEN_SAPPHIRE_COST_GUARD_STATEMENT_TIMEOUT", "300000"))
+COST_GUARD_PREVIEW_ROWS = int(os.getenv("GOLDEN_SAPPHIRE_COST_GUARD_PREVIEW_ROWS", "1000"))
+
+
+@dataclass(frozen=True)
+class CostEstimate:
+    total_cost: float
+    plan_rows: float
+    node_type: str
+
+
+@dataclass(frozen=True)
+class GuardedQuery:
+    """The SQL to run after the guard: possibly wrapped in a LIMIT, with its estimate and timeout."""
+    sql: str
+    estimate: Optional[CostEstimate]
+    statement_timeout: int
+    limited: bool = False
+    # Estimated rows of the query as written, before any LIMIT
+    estimated_rows: Optional[float] = None
+
+
+class QueryRejected(Exception):
+    """Raised when the planner estimate of a query is over budget."""
+
+    def __init__(self, reason: str, estimate: CostEstimate, max_cost: float, max_rows: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.estimate = estimate
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "error": "query_rejected",
+            "message": self.reason,
+            "estimated_cost": self.estimate.total_cost,
+            "estimated_rows": self.estimate.plan_rows,
+            "max_cost": self.max_cost,
+            "max_rows": self.max_rows,
+        }
+
+
+async def explain(conn: asyncpg.Connection, sql: str, arguments: Optional[dict] = None) -> CostEstimate:
+    """Returns the planner's estimate for ``sql`` from ``EXPLAIN (FORMAT JSON)``; the query is not run."""
+    raw = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *tuple(arguments.values()) if arguments else ())
+    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+    return CostEstimate(
+        total_cost=float(plan["Total Cost"]),
+        plan_rows=float(plan["Plan Rows"]),
+        node_type=plan.get("Node Type", ""),
+    )
+
+
+def limit_query(sql: str, rows: int) -> str:
+    """Wraps ``sql`` so at most ``rows`` rows come back, whatever clauses it ends with."""
+    query = sql.strip().rstrip(";").rstrip()
+    return f"SELECT * FROM (\n{query}\n) AS preview LIMIT {int(rows)}"
+
+
+async def guard_query(
+    conn: asyncpg.Connection,
+    sql: str,
+    arguments: Optional[dict] = None,
+    preview_rows: Optional[int] = None,
+    max_cost: float = COST_GUARD_MAX_COST,
+    max_rows: float = COST_GUARD_MAX_ROWS,
+    statement_timeout: int = COST_GUARD_STATEMENT_TIMEOUT,
+) -> GuardedQuery:
+    """
+    Checks generated SQL against the cost budgets before it runs.
+
+    The query is planned with ``EXPLAIN``. For preview-sized requests
+    (``preview_rows``) a query estimated to return more rows is wrapped in a
+    LIMIT of one row more and planned again; getting that extra row back
+    tells the caller the preview was cut short. A plan still over ``max_cost`` or ``max_rows`` is
+    rejected; otherwise ``statement_timeout`` is set on the connection, so
+    even a misestimated query is cancelled by the server. The setting is
+    cleared when the connection goes back to the pool.
+
+    Args:
+        conn: Connection the query will run on.
+        sql: Generated SQL query.
+        arguments: Optional query parameters.
+        preview_rows: Row cap for requests that only show a preview.
+        max_cost: Largest accepted planner cost.
+        max_rows: Largest accepted estimated row count.
+        statement_timeout: Timeout in milliseconds; 0 disables it.
+
+    Returns:
+        GuardedQuery: The SQL to execute and its estimate.
+
+    Raises:
+        QueryRejected: If the estimate is over budget.
+    """
+    estimate = await explain(conn, sql, arguments)
+    estimated_rows = estimate.plan_rows
+    limited = False
+    if preview_rows is not None and estimate.plan_rows > preview_rows:
+        sql = limit_query(sql, preview_rows + 1)
+        estimate = await explain(conn, sql, arguments)
+        limited = True
+
+    if estimate.total_cost > max_cost:
+        raise QueryRejected(
+            f"Estimated cost {estimate.total_cost:,.0f} is over the budget of {max_cost:,.0f}; "
+            "the query probably scans or joins too much. Narrow it with filters or a time range.",
+            estimate, max_cost, max_rows,
+        )
+    if estimate.plan_rows > max_rows:
+        raise QueryRejected(
+            f"Estimated {estimate.plan_rows:,.0f} rows is over the budget of {max_rows:,.0f}. "
+            "Narrow the request with filters or a time range.",
+            estimate, max_cost, max_rows,
+        )
+
+    if statement_timeout:
+        await conn.execute(f"SET statement_timeout = {int(statement_timeout)}")
+    return GuardedQuery(
+        sql=sql, estimate=estimate, statement_timeout=statement_timeout, limited=limited, estimated_rows=estimated_rows,
+    )
+
+
+async def apply_cost_guard(
+    conn: asyncpg.Connection,
+    sql: str,
+    arguments: Optional[dict] = None,
+    preview_rows: Optional[int] = None,
+) -> GuardedQuery:
+    """Runs :func:`guard_query` unless the guard is disabled; then the SQL is returned as it is."""
+    if not COST_GUARD_ENABLED:
+        return GuardedQuery(sql=sql, estimate=None, statement_timeout=0)
+    return await guard_query(conn, sql, arguments, preview_rows)
@@ -0,0 +1,238 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+
+PAGE_SIZE = int(os.getenv("GOLDEN_SAPPHIRE_PAGE_SIZE", "500"))
+PAGE_SIZE_MAX = int(os.getenv("GOLDEN_SAPPHIRE_PAGE_SIZE_MAX", "10000"))
+# Seconds a continuation token stays valid
+PAGE_TOKEN_TTL = int(os.getenv("GOLDEN_SAPPHIRE_PAGE_TOKEN_TTL", "900"))
+PAGE_TOKEN_SECRET = os.getenv(
+    "GOLDEN_SAPPHIRE_PAGE_TOKEN_SECRET",
+    os.getenv("SIGNED_SECRET_KEY", "very long secret key for download file securely"),
+)
+
+# Extra result column carrying each row's key as text; it is not returned
+PAGE_KEY_COLUMN = "__page_key"
+# Types without a default btree ordering, so they cannot be part of a key
+UNORDERABLE_TYPES = {"json", "xml", "point", "line", "lseg", "box", "path", "polygon", "circle"}
+
+
+class PageError(Exception):
+    """Raised for a continuation token or page key that cannot be used."""
+
+
+@dataclass(frozen=True)
+class PageCursor:
+    """
+    Where the previous page ended: the key of its last row, and how many
+    rows with that key it returned. Rows are ordered by the key columns, so
+    the next page starts at that key; the tie count only matters when the
+    key is not unique.
+    """
+    columns: Tuple[str, ...]
+    values: Tuple[Optional[str], ...]
+    ties: int
+
+
+def query_fingerprint(sql: str, arguments: Optional[Dict[str, Any]]) -> str:
+    """Hex SHA-256 of the query and its arguments; a token only continues the query it came from."""
+    data = json.dumps([sql, arguments or {}], default=str, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(PAGE_TOKEN_SECRET.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def encode_token(fingerprint: str, cursor: PageCursor, ttl: int = PAGE_TOKEN_TTL) -> str:
+    """Signs ``cursor`` into an opaque token for the query with ``fingerprint``."""
+    payload = _b64encode(json.dumps({
+        "q": fingerprint,
+        "k": list(cursor.columns),
+        "v": list(cursor.values),
+        "t": cursor.ties,
+        "e": int(time.time()) + ttl,
+    }, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}"
+
+
+def decode_token(token: str, fingerprint: str) -> PageCursor:
+    """
+    Checks a token from :func:`encode_token` and returns its cursor.
+
+    Raises:
+        PageError: If the token is malformed, forged, expired or was issued
+            for another query.
+    """
+    payload, _, signature = token.partition(".")
+    if not signature or not hmac.compare_digest(signature, _sign(payload)):
+        raise PageError("Invalid page token.")
+    try:
+        data = json.loads(_b64decode(payload))
+        expires, issued_for = data["e"], data["q"]
+        cursor = PageCursor(tuple(data["k"]), tuple(data["v"]), int(data["t"]))
+    except (ValueError, KeyError, TypeError):
+        raise PageError("Invalid page token.")
+    if expires < time.time():
+        raise PageError("Page token expired; run the query again from the first page.")
+    if issued_for != fingerprint:
+        raise PageError("Page token was issued for another query or other arguments.")
+    return cursor
+
+
+def page_size_for(requested: Optional[int]) -> int:
+    """The page size to use: ``requested`` capped at ``PAGE_SIZE_MAX``, or the default."""
+    if requested is None:
+        return min(PAGE_SIZE, PAGE_SIZE_MAX)
+    if requested < 1:
+        raise PageError("page_size must be at least 1.")
+    return min(requested, PAGE_SIZE_MAX)
+
+
+def page_key_columns(attributes: Sequence[asyncpg.Attribute], requested: Optional[Sequence[str]] = None) -> List[str]:
+    """
+    Picks the columns the pages are ordered by.
+
+    Without ``requested`` every orderable column is used, so rows only tie
+    when they are identical and it does not matter which of them comes
+    first. A key of a few columns that are unique together (e.g. the
+    primary key) makes pages cheaper to sort and lets Postgres use an index.
+
+    Raises:
+        PageError: If a requested column is not in the result or cannot be ordered.
+    """
+    types = {attribute.name: attribute.type for attribute in attributes}
+    if not requested:
+        columns = [name for name, pg_type in types.items() if pg_type.name not in UNORDERABLE_TYPES]
+        if not columns:
+            raise PageError("The result has no column that can be ordered; it cannot be paged.")
+        return columns
+    for name in requested:
+        if name not in types:
+            raise PageError(f"page_key column {name!r} is not in the result.")
+        if types[name].name in UNORDERABLE_TYPES:
+            raise PageError(f"page_key column {name!r} is of type {types[name].name}, which cannot be ordered.")
+    return list(requested)
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _keyset_predicate(keys: Sequence[Tuple[str, str]], values: Sequence[Optional[str]], first_param: int) -> Tuple[str, list]:
+    # Lexicographic "key >= cursor" in the order of ORDER BY ... ASC, where
+    # NULLs sort last; a row comparison would drop rows with NULL keys
+    args = []
+    params = []
+    for (column, type_name), value in zip(keys, values):
+        if value is None:
+            params.append(None)
+        else:
+            params.append(f"${first_param + len(args)}::text::{type_name}")
+            args.append(value)
+    terms = []
+    equal: List[str] = []
+    for (column, _), param in zip(keys, params):
+        if param is not None:
+            terms.append(" AND ".join(equal + [f"({column} > {param} OR {column} IS NULL)"]))
+        equal.append(f"{column} IS NULL" if param is None else f"{column} = {param}")
+    terms.append(" AND ".join(equal))
+    return " OR ".join(f"({term})" for term in terms), args
+
+
+def page_query(
+    sql: str,
+    attributes: Sequence[asyncpg.Attribute],
+    columns: Sequence[str],
+    page_size: int,
+    cursor: Optional[PageCursor] = None,
+    first_param: int = 1,
+) -> Tuple[str, list]:
+    """
+    Wraps ``sql`` to return one page, ordered by ``columns``.
+
+    The page starts at the cursor's key instead of skipping rows with
+    OFFSET, so every page sorts at most ``page_size`` rows (plus the
+    cursor's ties) whatever its depth. The query's own ORDER BY is replaced
+    by the key order. Each row gets its key as text in ``PAGE_KEY_COLUMN``.
+
+    Args:
+        sql: The query, with ``first_param - 1`` placeholders of its own.
+        attributes: Result columns of ``sql``.
+        columns: Key columns, from :func:`page_key_columns`.
+        page_size: Rows per page.
+        cursor: End of the previous page; None for the first page.
+        first_param: Number of the first placeholder the key values may use.
+
+    Returns:
+        Tuple[str, list]: The page query and the values of its new placeholders.
+    """
+    types = {attribute.name: attribute.type for attribute in attributes}
+    keys = [
+        (f"page.{_quote(name)}", f"{_quote(types[name].schema)}.{_quote(types[name].name)}")
+        for name in columns
+    ]
+    query = sql.strip().rstrip(";").rstrip()
+    where = ""
+    args: list = []
+    limit = page_size + 1
+    if cursor is not None:
+        predicate, args = _keyset_predicate(keys, cursor.values, first_param)
+        where = f"\nWHERE {predicate}"
+        limit += cursor.ties
+    key_text = ", ".join(f"{column}::text" for column, _ in keys)
+    order = ", ".join(column for column, _ in keys)
+    return (
+        f"SELECT page.*, ARRAY[{key_text}] AS {PAGE_KEY_COLUMN} FROM (\n{query}\n) AS page"
+        f"{where}\nORDER BY {order}\nLIMIT {int(limit)}",
+        args,
+    )
+
+
+def split_page(
+    records: Sequence[asyncpg.Record],
+    columns: Sequence[str],
+    page_size: int,
+    cursor: Optional[PageCursor] = None,
+) -> Tuple[Sequence[asyncpg.Record], Optional[PageCursor]]:
+    """
+    Cuts the rows of a :func:`page_query` down to the page.
+
+    Returns:
+        Tuple[Sequence[asyncpg.Record], Optional[PageCursor]]: The page's rows
+        and the cursor for the next page, or None when this is the last page.
+    """
+    skipped = 0
+    if cursor is not None:
+        # Rows with the cursor's key that the previous pages already returned
+        while skipped < min(cursor.ties, len(records)) and tuple(records[skipped][PAGE_KEY_COLUMN]) == cursor.values:
+            skipped += 1
+    rows = records[skipped:]
+    page = rows[:page_size]
+    if len(rows) <= page_size:
+        return page, None
+    last = tuple(page[-1][PAGE_KEY_COLUMN])
+    ties = 0
+    for record in reversed(page):
+        if tuple(record[PAGE_KEY_COLUMN]) != last:
+            break
+        ties += 1
+    if ties == len(page) and cursor is not None and last == cursor.values:
+        ties += skipped
+    return page, PageCursor(tuple(columns), last, ties)
@@ -0,0 +1,225 @@
+import asyncio
+import os
+import random
+import re
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from pg_pool import PoolRegistry, _mask_dsn, pg_pools, resolve_dsn
+
+
+# Replicas of GOLDEN_SAPPHIRE_DB_URL, comma-separated
+REPLICA_URLS = [url.strip() for url in os.getenv("GOLDEN_SAPPHIRE_DB_REPLICA_URLS", "").split(",") if url.strip()]
+# Seconds of replication lag a read accepts unless the request says otherwise; 0 always reads the primary
+REPLICA_MAX_LAG = float(os.getenv("GOLDEN_SAPPHIRE_REPLICA_MAX_LAG", "30"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("GOLDEN_SAPPHIRE_REPLICA_LAG_CHECK_INTERVAL", "5"))
+REPLICA_LAG_CHECK_TIMEOUT = float(os.getenv("GOLDEN_SAPPHIRE_REPLICA_LAG_CHECK_TIMEOUT", "2"))
+
+# A replica in sync with the primary has replayed everything it received; the
+# replay timestamp alone would report an idle primary as lag
+LAG_QUERY = """
+SELECT
+    CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END AS lag,
+    (SELECT count(*) FROM pg_stat_activity
+     WHERE state = 'active' AND backend_type = 'client backend' AND pid <> pg_backend_pid()) AS active
+"""
+
+CONNECT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+)
+
+_LITERALS_AND_COMMENTS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.DOTALL)
+_READ_STATEMENT = re.compile(r"^\s*\(*\s*(select|with|values|table)\b", re.IGNORECASE)
+# Writes, DDL and row locks all fail on a hot standby
+_WRITE_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|merge|create|alter|drop|truncate|grant|revoke|copy|call|lock|"
+    r"refresh|vacuum|analyze|reindex|cluster|comment|into|nextval|setval)\b|\bfor\s+(key\s+)?share\b",
+    re.IGNORECASE,
+)
+
+
+def is_read_only(sql: str) -> bool:
+    """
+    Whether ``sql`` can run on a replica.
+
+    Conservative: anything that is not a plain SELECT/WITH/VALUES/TABLE, or
+    mentions a write, DDL, ``SELECT ... INTO``, ``FOR UPDATE`` or a sequence
+    function outside a literal or comment, goes to the primary.
+    """
+    stripped = _LITERALS_AND_COMMENTS.sub(" ", sql)
+    return bool(_READ_STATEMENT.match(stripped)) and not _WRITE_KEYWORDS.search(stripped)
+
+
+def db_targets(db_config: Any) -> Tuple[str, List[str]]:
+    """
+    Splits a DB config into the primary DSN and its replica DSNs.
+
+    A dict config may name the ``primary`` (a connection string or a dict of
+    fields, as :func:`pg_pool.resolve_dsn` accepts) and a list of
+    ``replicas`` in the same forms. Any other config is a primary alone. A
+    primary equal to ``GOLDEN_SAPPHIRE_DB_URL`` without replicas of its own
+    gets those of ``GOLDEN_SAPPHIRE_DB_REPLICA_URLS``.
+    """
+    primary = resolve_dsn(db_config)
+    replicas = db_config.get("replicas") if isinstance(db_config, dict) else None
+    if replicas:
+        return primary, [resolve_dsn(replica) for replica in replicas]
+    if REPLICA_URLS and primary == os.getenv("GOLDEN_SAPPHIRE_DB_URL", "").strip():
+        return primary, list(REPLICA_URLS)
+    return primary, []
+
+
+@dataclass(frozen=True)
+class ReplicaStatus:
+    """Result of one lag check; ``lag`` is None when the replica could not be checked."""
+    lag: Optional[float]
+    active: int
+    checked_at: float
+    error: Optional[str] = None
+
+    def lag_bound(self, now: float) -> float:
+        # Replay can at worst have stalled since the check, so the lag now is
+        # at most the measured lag plus the age of the measurement
+        if self.lag is None:
+            return float("inf")
+        return self.lag + (now - self.checked_at)
+
+
+class ReplicaRouter:
+    """
+    Sends read-only queries to the least-loaded replica that is fresh enough.
+
+    Replication lag and active backends are checked on each replica at most
+    every ``check_interval`` seconds, on a pooled connection. A replica
+    qualifies for a request when its lag, plus the age of the check, is
+    within the request's ``max_lag``. Among those, the one with the fewest
+    active queries (its server's, plus ours in flight) wins. Writes,
+    ``max_lag`` 0, and requests no replica qualifies for go to the primary,
+    as do queries whose replica cannot be reached.
+    """
+
+    def __init__(
+        self,
+        pools: PoolRegistry = pg_pools,
+        default_max_lag: float = REPLICA_MAX_LAG,
+        check_interval: float = REPLICA_LAG_CHECK_INTERVAL,
+        check_timeout: float = REPLICA_LAG_CHECK_TIMEOUT,
+    ) -> None:
+        self.pools = pools
+        self.default_max_lag = default_max_lag
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._statuses: Dict[str, ReplicaStatus] = {}
+        self._checks: Dict[str, asyncio.Future] = {}
+        self.routed: Dict[str, int] = {"replica": 0, "primary": 0, "fallback": 0}
+
+    async def _check(self, dsn: str) -> ReplicaStatus:
+        try:
+            async with self.pools.acquire(dsn) as conn:
+                row = await conn.fetchrow(LAG_QUERY, timeout=self.check_timeout)
+            lag = float(row["lag"]) if row["lag"] is not None else None
+            status = ReplicaStatus(lag=lag, active=row["active"], checked_at=time.monotonic(),
+                                   error=None if lag is not None else "No transaction replayed yet")
+        except Exception as e:
+            print(f"Replica {_mask_dsn(dsn)} lag check failed: {e!r}")
+            status = ReplicaStatus(lag=None, active=0, checked_at=time.monotonic(), error=str(e) or type(e).__name__)
+        self._statuses[dsn] = status
+        return status
+
+    async def status(self, dsn: str) -> ReplicaStatus:
+        """The replica's last status, checked again first if it is older than ``check_interval``."""
+        status = self._statuses.get(dsn)
+        if status is not None and time.monotonic() - status.checked_at < self.check_interval:
+            return status
+        # Concurrent requests share one check per replica
+        check = self._checks.get(dsn)
+        if check is None:
+            check = asyncio.ensure_future(self._check(dsn))
+            self._checks[dsn] = check
+            check.add_done_callback(lambda _, dsn=dsn: self._checks.pop(dsn, None))
+        return await asyncio.shield(check)
+
+    async def choose(self, db_config: Any, sql: Optional[str] = None, max_lag: Optional[float] = None) -> Tuple[str, str]:
+        """
+        Picks the server for a query.
+
+        Args:
+            db_config: DB config, see :func:`db_targets`.
+            sql: The query; None or anything not read-only goes to the primary.
+            max_lag: Seconds of replication lag acceptable; None uses ``default_max_lag``.
+
+        Returns:
+            Tuple[str, str]: The primary DSN and the DSN chosen.
+        """
+        primary, replicas = db_targets(db_config)
+        max_lag = self.default_max_lag if max_lag is None else max_lag
+        if not replicas or max_lag <= 0 or sql is None or not is_read_only(sql):
+            self.routed["primary"] += 1
+            return primary, primary
+
+        statuses = await asyncio.gather(*(self.status(dsn) for dsn in replicas))
+        now = time.monotonic()
+        fresh = [(dsn, status) for dsn, status in zip(replicas, statuses) if status.lag_bound(now) <= max_lag]
+        if not fresh:
+            self.routed["fallback"] += 1
+            return primary, primary
+        self.routed["replica"] += 1
+        # Ties are broken at random so equal replicas share the load
+        dsn, _ = min(fresh, key=lambda item: (item[1].active + self.pools.in_use(item[0]), random.random()))
+        return primary, dsn
+
+    @asynccontextmanager
+    async def acquire(self, db_config: Any, sql: Optional[str] = None, max_lag: Optional[float] = None):
+        """
+        Acquires a pooled connection to the server :meth:`choose` picks.
+
+        Usage:
+            async with replica_router.acquire(db_config, sql, max_lag) as conn:
+                rows = await conn.fetch(sql)
+        """
+        primary, dsn = await self.choose(db_config, sql, max_lag)
+        async with AsyncExitStack() as stack:
+            try:
+                conn = await stack.enter_async_context(self.pools.acquire(dsn))
+            except CONNECT_ERRORS as e:
+                if dsn == primary:
+                    raise
+                # Unreachable replica: skip it until its next check and read the primary
+                print(f"Replica {_mask_dsn(dsn)} unavailable, using the primary: {e!r}")
+                self._statuses[dsn] = ReplicaStatus(lag=None, active=0, checked_at=time.monotonic(), error=str(e) or type(e).__name__)
+                self.routed["replica"] -= 1
+                self.routed["fallback"] += 1
+                conn = await stack.enter_async_context(self.pools.acquire(primary))
+            yield conn
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "default_max_lag": self.default_max_lag,
+            "routed": dict(self.routed),
+            "replicas": {
+                _mask_dsn(dsn): {
+                    "lag_seconds": round(status.lag, 3) if status.lag is not None else None,
+                    "active": status.active,
+                    "in_use": self.pools.in_use(dsn),
+                    "checked_seconds_ago": round(now - status.checked_at, 3),
+                    "error": status.error,
+                }
+                for dsn, status in self._statuses.items()
+            },
+        }
+
+
+replica_router = ReplicaRouter()
@@ -0,0 +1,288 @@
+import datetime
+import decimal
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import asyncpg
+
+from pg_pool import prepare_cached
+
+
+AUTO_PARAMETERIZE = os.getenv("GOLDEN_SAPPHIRE_AUTO_PARAMETERIZE", "true").lower() in ("1", "true", "yes")
+
+# One token per match. Spans that are never lifted come first: prefixed and
+# dollar-quoted strings, quoted identifiers, comments, existing parameters
+_TOKEN = re.compile(
+    r"""
+      (?P<skip>
+        [EeBbXxNn]'(?:[^'\\]|\\.|'')*'           # E'...', B'...', X'...', N'...'
+      | [Uu]&'(?:[^']|'')*'                      # U&'...'
+      | (?P<dollar>\$[A-Za-z_]*\$).*?(?P=dollar) # dollar-quoted literal
+      | "(?:[^"]|"")*"                           # quoted identifier
+      | --[^\n]*                                 # line comment
+      | /\*.*?\*/                                # block comment
+      )
+    | \$(?P<param>\d+)
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<operator>::|->>?|\#>>?|@>|<@)        # casts and JSON operators, not comparisons
+    | (?P<compare><>|!=|<=|>=|=|<|>)
+    | (?P<punct>[(),])
+    | (?P<other>\S)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_UTC_NAMES = {"utc", "etc/utc", "gmt", "etc/gmt", "uct", "universal", "zulu", "z"}
+
+_INTEGER = re.compile(r"\s*[+-]?\d+\s*")
+_DECIMAL = re.compile(r"\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*")
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?)?")
+_OFFSET = re.compile(r"(?:Z|[+-]\d{2}(?::?\d{2})?)")
+_BOOLEANS = {
+    "t": True, "true": True, "y": True, "yes": True, "on": True, "1": True,
+    "f": False, "false": False, "n": False, "no": False, "off": False, "0": False,
+}
+
+
+@lru_cache(maxsize=256)
+def lift_literals(sql: str) -> Tuple[str, int, Tuple[str, ...]]:
+    """
+    Replaces the literal operands of predicates and LIMIT/OFFSET with parameters.
+
+    Only literals compared with ``=``, ``<>``, ``<``..., matched with LIKE,
+    listed in ``IN (...)`` or bounding a BETWEEN are lifted, because there
+    Postgres infers the parameter's type from the other side exactly as it
+    would the literal's. Literals elsewhere (select list, function
+    arguments, ``DATE '...'``, ``INTERVAL '...'``) stay inline.
+
+    Returns:
+        Tuple[str, int, Tuple[str, ...]]: The SQL with ``$n`` placeholders,
+        the number of the first lifted parameter (after any the query
+        already had), and the text of each lifted literal in order.
+    """
+    tokens = [("skip" if match.group("skip") else match.lastgroup, match) for match in _TOKEN.finditer(sql)]
+    first = 1 + max((int(match.group("param")) for kind, match in tokens if kind == "param"), default=0)
+
+    out = []
+    literals = []
+    position = 0
+    # What the last token was, as far as lifting the next literal goes
+    previous = ""
+    depth = 0
+    in_list_depth = None
+    between = False
+    for kind, match in tokens:
+        if kind in ("skip", "param"):
+            previous = "other"
+            continue
+        text = match.group(0)
+        lower = text.lower()
+        if kind in ("string", "number"):
+            liftable = (
+                previous in ("compare", "like", "between", "between_and")
+                or (previous in ("(", ",") and in_list_depth == depth)
+                or (previous == "count" and kind == "number")
+            )
+            if liftable:
+                out.append(sql[position:match.start()])
+                out.append(f"${first + len(literals)}")
+                literals.append(text[1:-1].replace("''", "'") if kind == "string" else text)
+                position = match.end()
+            previous = "literal"
+        elif kind == "compare":
+            previous = "compare"
+        elif kind == "word":
+            if lower in ("like", "ilike"):
+                previous = "like"
+            elif lower == "between":
+                previous, between = "between", True
+            elif lower == "and" and between:
+                previous, between = "between_and", False
+            elif lower in ("limit", "offset"):
+                previous = "count"
+            elif lower == "in":
+                previous = "in"
+            else:
+                if lower == "select" and in_list_depth == depth:
+                    # IN (SELECT ...) is a subquery, not a list
+                    in_list_depth = None
+                previous = "word"
+        elif text == "(":
+            depth += 1
+            if previous == "in":
+                in_list_depth = depth
+            previous = "("
+        elif text == ")":
+            if in_list_depth == depth:
+                in_list_depth = None
+            depth -= 1
+            previous = ")"
+        elif text == ",":
+            previous = ","
+        else:
+            previous = "other"
+    out.append(sql[position:])
+    return "".join(out), first, tuple(literals)
+
+
+def _timestamp(text: str, with_zone: bool, time_zone: Optional[str]) -> datetime.datetime:
+    text = text.strip()
+    stamp = _TIMESTAMP.match(text)
+    if stamp is None:
+        raise ValueError(text)
+    offset = text[stamp.end():].strip()
+    if offset and not (with_zone and _OFFSET.fullmatch(offset)):
+        raise ValueError(text)
+    value = datetime.datetime.fromisoformat(stamp.group(0) + ("+00:00" if offset == "Z" else offset))
+    if with_zone and value.tzinfo is None:
+        # Without an offset the session time zone applies; only UTC is known here for sure
+        if (time_zone or "").lower() not in _UTC_NAMES:
+            raise ValueError(text)
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def _date(text: str) -> datetime.date:
+    if not _DATE.fullmatch(text.strip()):
+        raise ValueError(text)
+    return datetime.date.fromisoformat(text.strip())
+
+
+def _number(text: str, pattern: re.Pattern, convert: Callable[[str], Any]) -> Any:
+    # Python also reads "1_000"; Postgres may not, so only plain digits go through
+    if not pattern.fullmatch(text):
+        raise ValueError(text)
+    return convert(text.strip())
+
+
+def _boolean(text: str) -> bool:
+    return _BOOLEANS[text.strip().lower()]
+
+
+# Parameter type -> literal text to the value asyncpg encodes for it; the
+# conversions accept a subset of what Postgres does, never more
+_CONVERTERS: Dict[str, Callable[[str, Optional[str]], Any]] = {
+    **{name: (lambda text, tz: text) for name in ("text", "varchar", "bpchar", "char", "name", "json", "jsonb")},
+    **{name: (lambda text, tz: _number(text, _INTEGER, int)) for name in ("int2", "int4", "int8", "oid")},
+    "numeric": lambda text, tz: _number(text, _DECIMAL, decimal.Decimal),
+    "float4": lambda text, tz: float(text),
+    "float8": lambda text, tz: float(text),
+    "bool": lambda text, tz: _boolean(text),
+    "uuid": lambda text, tz: uuid.UUID(text.strip()),
+    "date": lambda text, tz: _date(text),
+    "timestamp": lambda text, tz: _timestamp(text, False, tz),
+    "timestamptz": lambda text, tz: _timestamp(text, True, tz),
+}
+
+
+def convert_literals(literals: Sequence[str], types: Sequence[Any], time_zone: Optional[str] = None) -> Optional[tuple]:
+    """
+    Converts lifted literal texts to values of the parameter types Postgres inferred.
+
+    Returns:
+        Optional[tuple]: The values, or None if a type is not supported or a
+        literal does not convert exactly; the query then runs as written.
+    """
+    values = []
+    for text, param_type in zip(literals, types):
+        converter = _CONVERTERS.get(param_type.name) if param_type.schema == "pg_catalog" else None
+        if converter is None:
+            return None
+        try:
+            values.append(converter(text, time_zone))
+        except (ValueError, KeyError, decimal.InvalidOperation):
+            return None
+    return tuple(values)
+
+
+@dataclass(frozen=True)
+class PreparedQuery:
+    """A query ready to run: the SQL prepared, its positional arguments and its statement."""
+    sql: str
+    args: tuple
+    statement: "asyncpg.prepared_stmt.PreparedStatement"
+    lifted: int = 0
+
+    @property
+    def arguments(self) -> Optional[Dict[str, Any]]:
+        """``args`` as the arguments dict the cost guard and the agent take."""
+        return {f"${index}": value for index, value in enumerate(self.args, 1)} if self.args else None
+
+
+class Parameterizer:
+    """
+    Turns inline literals of generated SQL into parameters before it runs.
+
+    The LLM writes dates, statuses and sender names into the SQL, so every
+    request is a new statement to Postgres. Lifting those literals gives
+    recurring report shapes the same text, and the per-connection statement
+    cache (see :func:`pg_pool.prepare_cached`) then skips parsing and lets
+    Postgres reuse plans. When the rewritten query cannot be prepared or a
+    literal does not convert exactly to its parameter type, the query runs
+    as written.
+    """
+
+    def __init__(self, enabled: bool = AUTO_PARAMETERIZE) -> None:
+        self.enabled = enabled
+        self.parameterized = 0
+        self.unchanged = 0
+        self.fallbacks = 0
+        self.literals_lifted = 0
+        # Rewrites Postgres could not prepare, so they are not tried again
+        self._unpreparable: set = set()
+
+    async def prepare(self, conn: asyncpg.Connection, sql: str, arguments: Optional[dict] = None) -> PreparedQuery:
+        """
+        Prepares ``sql`` on ``conn``, parameterized when possible.
+
+        Args:
+            conn: Connection the query will run on.
+            sql: Generated SQL query, possibly with ``$n`` placeholders already.
+            arguments: Values of the existing placeholders, in order.
+
+        Returns:
+            PreparedQuery: The SQL prepared, all its arguments and the statement.
+        """
+        args = tuple(arguments.values()) if arguments else ()
+        if self.enabled:
+            template, first, literals = lift_literals(sql)
+            if literals and first == len(args) + 1:
+                statement = None
+                if template not in self._unpreparable:
+                    try:
+                        statement = await prepare_cached(conn, template)
+                    except asyncpg.PostgresError:
+                        # e.g. an operator that is ambiguous once its operand has no type
+                        if len(self._unpreparable) >= 256:
+                            self._unpreparable.clear()
+                        self._unpreparable.add(template)
+                if statement is not None:
+                    types = statement.get_parameters()[len(args):]
+                    values = convert_literals(literals, types, conn.get_settings().TimeZone)
+                    if values is not None:
+                        self.parameterized += 1
+                        self.literals_lifted += len(literals)
+                        return PreparedQuery(template, args + values, statement, len(literals))
+                self.fallbacks += 1
+            else:
+                self.unchanged += 1
+        return PreparedQuery(sql, args, await prepare_cached(conn, sql))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "parameterized": self.parameterized,
+            "unchanged": self.unchanged,
+            "fallbacks": self.fallbacks,
+            "literals_lifted": self.literals_lifted,
+        }
+
+
+parameterizer = Parameterizer()
@@ -0,0 +1,150 @@
+import copy
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+
+REWRITER_CACHE_SIZE = 32
+
+# Spans a rewrite must step over untouched. The lookahead lets the scanner
+# reject most positions on one character class instead of trying every branch.
+_SKIP = r"""
+    (?=['"$/:a-])
+    (?:
+      '(?:[^']|'')*'                              # string literal
+    | (?P<dollar>\$[A-Za-z_]*\$).*?(?P=dollar)    # dollar-quoted literal
+    | "(?:[^"]|"")*"                              # quoted identifier
+    | --[^\n]*                                    # line comment
+    | /\*.*?\*/                                   # block comment
+    | ::\s*[A-Za-z_][A-Za-z0-9_$]*                # type cast (::date)
+    | \bAS\s+[A-Za-z_][A-Za-z0-9_$]*              # output name or CAST target
+    )
+"""
+
+
+class SqlRewriter:
+    """
+    Rewrites table aliases and semantic column terms in one token-aware pass.
+
+    Built once from a table alias map and the per-table column value mappings
+    of ``schema_alias_context_agent``: every alias and term is folded into a
+    single compiled pattern, so a rewrite is one scan of the SQL no matter how
+    many mappings there are. Text inside string literals, quoted identifiers
+    and comments is never touched, nor are names after ``AS`` or a ``::``
+    cast. Table aliases are not replaced after a ``.`` qualifier; column terms
+    (``active``, ``delivered = true``...) only after the first ``WHERE``. When
+    a term is mapped for several tables, the mapping of a table the query
+    references wins, then the first table that defines it.
+    """
+
+    def __init__(self, table_aliases: Dict[str, str], value_mappings: Optional[Dict[str, Dict[str, str]]] = None) -> None:
+        self.table_aliases = {alias.lower(): real for alias, real in table_aliases.items()}
+        self.value_mappings = [
+            (table.lower(), {term.lower(): condition for term, condition in mappings.items()})
+            for table, mappings in (value_mappings or {}).items()
+        ]
+        self._mapped_tables = {table for table, _ in self.value_mappings}
+        self._terms_for = lru_cache(maxsize=64)(self._build_terms)
+
+        vocabulary = set(self.table_aliases) | self._mapped_tables
+        for _, mappings in self.value_mappings:
+            vocabulary.update(mappings)
+        words = "|".join(re.escape(w) for w in sorted(vocabulary, key=len, reverse=True)) or r"(?!)"
+        initials = re.escape("".join(sorted({w[0] for w in vocabulary})))
+        self._words = tuple(sorted(vocabulary, key=len, reverse=True))
+        self._vocabulary = re.compile(rf"\b(?:{words})\b", re.IGNORECASE)
+        self._pattern = re.compile(
+            rf"""
+              (?P<skip>{_SKIP})
+            | (?=w)(?P<where>\bWHERE\b)
+            | (?=[.{initials}])(?P<dot>\.\s*)?(?P<word>\b(?:{words})\b)(?P<eqtrue>\s*=\s*true\b)?
+            """,
+            re.VERBOSE | re.DOTALL | re.IGNORECASE,
+        )
+
+    def _build_terms(self, referenced: Tuple[str, ...]) -> Dict[str, str]:
+        ordered = sorted(self.value_mappings, key=lambda item: item[0] not in referenced)
+        terms: Dict[str, str] = {}
+        for _, mappings in ordered:
+            for term, condition in mappings.items():
+                terms.setdefault(term, condition)
+        return terms
+
+    def rewrite(self, sql: str) -> str:
+        """Returns ``sql`` with table aliases and column value terms rewritten."""
+        lowered = sql.lower()
+        # Substring checks are cheap; the regex confirms whole words
+        if not any(word in lowered for word in self._words) or not self._vocabulary.search(sql):
+            return sql
+        out: List[str] = []
+        pending_terms: List[Tuple[int, str, str, Optional[str]]] = []
+        referenced = set()
+        in_where = False
+        position = 0
+
+        for match in self._pattern.finditer(sql):
+            word = match.group("word")
+            if word is None:
+                in_where = in_where or match.group("where") is not None
+                continue
+            out.append(sql[position:match.start()])
+            position = match.end()
+            dot = match.group("dot") or ""
+            lower = word.lower()
+            eqtrue = match.group("eqtrue") or ""
+            if in_where and self.value_mappings:
+                # Resolved after the pass, once the referenced tables are known
+                pending_terms.append((len(out), lower, dot, None if dot else eqtrue))
+                out.append(match.group(0))
+            elif lower in self.table_aliases and not dot:
+                real = self.table_aliases[lower]
+                referenced.add(real.lower())
+                out.append(real + eqtrue)
+            else:
+                if lower in self._mapped_tables:
+                    referenced.add(lower)
+                out.append(match.group(0))
+        out.append(sql[position:])
+
+        if pending_terms:
+            terms = self._terms_for(tuple(sorted(referenced & self._mapped_tables)))
+            for slot, lower, dot, eqtrue in pending_terms:
+                condition = terms.get(lower)
+                if condition is not None:
+                    out[slot] = dot + condition
+                elif eqtrue is not None and lower in self.table_aliases:
+                    out[slot] = self.table_aliases[lower] + eqtrue
+        return "".join(out)
+
+
+_rewriters: "OrderedDict[str, SqlRewriter]" = OrderedDict()
+# Fast path for callers that pass the same mapping objects every time: keyed
+# by object identity and confirmed by comparing against a snapshot.
+_by_identity: Dict[Tuple[int, int], Tuple[tuple, SqlRewriter]] = {}
+
+
+def get_rewriter(table_aliases: Dict[str, str], value_mappings: Optional[Dict[str, Dict[str, str]]] = None) -> SqlRewriter:
+    """Returns the compiled rewriter for this mapping version, building it on first use."""
+    identity = (id(table_aliases), id(value_mappings))
+    known = _by_identity.get(identity)
+    if known is not None and known[0] == (table_aliases, value_mappings):
+        return known[1]
+
+    snapshot = (dict(table_aliases), copy.deepcopy(value_mappings))
+    version = hashlib.sha256(
+        json.dumps([table_aliases, value_mappings or {}], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    rewriter = _rewriters.get(version)
+    if rewriter is None:
+        rewriter = SqlRewriter(table_aliases, value_mappings)
+        _rewriters[version] = rewriter
+        while len(_rewriters) > REWRITER_CACHE_SIZE:
+            _rewriters.popitem(last=False)
+    _rewriters.move_to_end(version)
+    if len(_by_identity) >= REWRITER_CACHE_SIZE:
+        _by_identity.clear()
+    _by_identity[identity] = (snapshot, rewriter)
+    return rewriter
@@ -0,0 +1,112 @@
+"""
+Compares SQL generation prompts with and without schema pruning.
+
+Reports prompt size (characters and tokens) and the local cost of building the
+schema index and pruning. With ``--live`` it also sends both prompts to the
+LLM and reports generation latency.
+
+Usage:
+    python bench_schema_pruning.py [--schema ../goldensapphire_pg_agent/schema.sql]
+                                   [--context context.json] [--live] [--repeat 3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import schema_index
+from prompts import SYSTEM_PROMPT, build_prompt
+
+
+DEFAULT_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "goldensapphire_pg_agent", "schema.sql")
+
+SAMPLE_REQUESTS = [
+    "Show all delivered messages from last week",
+    "List active users with their customer name",
+    "Export failed deliveries grouped by sender",
+    "Count events per session for yesterday",
+    "Top 10 receivers by total file size this month",
+    "Workflow steps for every active workflow",
+]
+
+
+def count_tokens(text: str) -> int:
+    try:
+        import tiktoken
+    except ImportError:
+        # Rough average for English text and SQL
+        return len(text) // 4
+    return len(tiktoken.encoding_for_model("gpt-4").encode(text))
+
+
+def llm_latency(prompt: str, model: str) -> float:
+    from llm_client import AsyncLLMClient
+
+    async def _run() -> float:
+        client = AsyncLLMClient(model=model)
+        started = time.perf_counter()
+        try:
+            await client.generate_sql(SYSTEM_PROMPT, prompt)
+        finally:
+            await client.close()
+        return time.perf_counter() - started
+
+    return asyncio.run(_run())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA, help="Path to the raw schema definition")
+    parser.add_argument("--context", help="Path to a schema context JSON (aliases, mappings, relationships)")
+    parser.add_argument("--live", action="store_true", help="Also measure LLM latency (needs OPENAI_API_KEY)")
+    parser.add_argument("--model", default="gpt-4")
+    parser.add_argument("--repeat", type=int, default=3, help="LLM calls per prompt when --live is set")
+    args = parser.parse_args()
+
+    with open(args.schema) as f:
+        schema_text = f.read()
+    schema_context = {}
+    if args.context:
+        with open(args.context) as f:
+            schema_context = json.load(f)
+
+    started = time.perf_counter()
+    index = schema_index.SchemaIndex(schema_text, schema_context)
+    build_ms = (time.perf_counter() - started) * 1000
+    print(f"Schema: {len(index.tables)} tables, {len(schema_text)} chars; index built in {build_ms:.1f} ms\n")
+
+    header = f"{'request':<48} {'full tok':>9} {'pruned tok':>11} {'saved':>6} {'tables':>7} {'prune ms':>9}"
+    if args.live:
+        header += f" {'full s':>8} {'pruned s':>9}"
+    print(header)
+    print("-" * len(header))
+
+    totals = {"full": 0, "pruned": 0}
+    for request in SAMPLE_REQUESTS:
+        full_prompt = build_prompt(schema_context, schema_text, request, prune=False)
+        started = time.perf_counter()
+        pruned_prompt = build_prompt(schema_context, schema_text, request, prune=True)
+        prune_ms = (time.perf_counter() - started) * 1000
+        tables = len(index.relevant_tables(request)) or len(index.tables)
+
+        full_tokens, pruned_tokens = count_tokens(full_prompt), count_tokens(pruned_prompt)
+        totals["full"] += full_tokens
+        totals["pruned"] += pruned_tokens
+        line = (
+            f"{request[:48]:<48} {full_tokens:>9} {pruned_tokens:>11} "
+            f"{1 - pruned_tokens / full_tokens:>6.0%} {tables:>7} {prune_ms:>9.2f}"
+        )
+        if args.live:
+            full_s = statistics.median(llm_latency(full_prompt, args.model) for _ in range(args.repeat))
+            pruned_s = statistics.median(llm_latency(pruned_prompt, args.model) for _ in range(args.repeat))
+            line += f" {full_s:>8.2f} {pruned_s:>9.2f}"
+        print(line)
+
+    print(f"\nTotal prompt tokens: {totals['full']} full, {totals['pruned']} pruned "
+          f"({1 - totals['pruned'] / totals['full']:.0%} fewer)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,21 @@
 import asyncio
+import time
 from typing import Annotated
 from genai_session.session import GenAISession
 from genai_session.utils.context import GenAIContext
 from dotenv import load_dotenv
 load_dotenv()
-import openai
 import os
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+from llm_client import AsyncLLMClient
+from metrics import OPERATION_SECONDS, REGISTRY, STAGE_SECONDS, LoopLagMonitor, publish_metrics
+from prompts import SYSTEM_PROMPT, build_prompt
+
 import os
 AGENT_JWT = os.getenv("GENAI_JWT_TOKEN") # noqa: E501
 session = GenAISession(jwt_token=AGENT_JWT)
+llm = AsyncLLMClient()
+REGISTRY.const_labels["component"] = "gs_sql_generator"
 
 @session.bind(
     name="gs_sql_generator",
@@ -28,36 +33,30 @@ async def generate_sql(agent_context: GenAIContext, schema_context: str, schema_
     Returns:
         str: A valid SQL query as per the schema and request.
     """
-    prompt = f"""
-You are an expert data engineer. Given the following schema context and raw schema definition,
-generate a valid SQL query to satisfy the request.
-
-Schema Context:
-{schema_context}
-
-Raw Schema Definition:
-{schema_definition}
-
-Request:
-{request}
-
-SQL Query:
-"""
-    response = openai.ChatCompletion.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You're a helpful assistant"},
-            {"role": "user", "content": prompt}
-        ]
-    )
-
-    sql = response.choices[0].message["content"]
-    return sql
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with STAGE_SECONDS.time(operation="gs_sql_generator", stage="build_prompt"):
+            prompt = build_prompt(schema_context, schema_definition, request)
+        with STAGE_SECONDS.time(operation="gs_sql_generator", stage="llm"):
+            sql = await llm.generate_sql(SYSTEM_PROMPT, prompt)
+        outcome = "generated"
+        return sql
+    finally:
+        OPERATION_SECONDS.observe(time.perf_counter() - started, operation="gs_sql_generator", outcome=outcome)
 
 
 async def main():
     print(f"Agent with token '{AGENT_JWT}' started")
-    await session.process_events()
+    loop_lag_monitor = LoopLagMonitor()
+    loop_lag_monitor.start()
+    publisher = asyncio.create_task(publish_metrics("gs_sql_generator"))
+    try:
+        await session.process_events()
+    finally:
+        publisher.cancel()
+        await loop_lag_monitor.stop()
+        await llm.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import random
+import re
+from typing import Optional
+
+import openai
+
+
+LLM_MODEL = os.getenv("GOLDEN_SAPPHIRE_LLM_MODEL", "gpt-4")
+LLM_MAX_CONCURRENCY = int(os.getenv("GOLDEN_SAPPHIRE_LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.getenv("GOLDEN_SAPPHIRE_LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("GOLDEN_SAPPHIRE_LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("GOLDEN_SAPPHIRE_LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("GOLDEN_SAPPHIRE_LLM_BACKOFF_MAX", "30"))
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+_FENCE_OPEN = re.compile(r"```[ \t]*(?:sql|postgresql|postgres)?[ \t]*\n", re.IGNORECASE)
+
+
+def extract_sql(text: str) -> Optional[str]:
+    """Returns the body of the first closed ```sql code block in ``text``, or None if it has not closed yet."""
+    opening = _FENCE_OPEN.search(text)
+    if not opening:
+        return None
+    closing = text.find("```", opening.end())
+    if closing == -1:
+        return None
+    return text[opening.end():closing].strip()
+
+
+class AsyncLLMClient:
+    """
+    Async chat completion client for SQL generation.
+
+    At most ``max_concurrency`` completions run at once; each attempt is
+    bounded by ``timeout`` seconds, and rate limits, timeouts and transient
+    server errors are retried with jittered exponential backoff (honouring
+    ``Retry-After`` when the API sends it). Responses are streamed so the SQL
+    is returned as soon as its code block closes.
+    """
+
+    def __init__(
+        self,
+        model: str = LLM_MODEL,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        api_key: Optional[str] = None,
+    ) -> None:
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.api_key = api_key
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[openai.AsyncOpenAI] = None
+
+    @property
+    def client(self) -> openai.AsyncOpenAI:
+        # Created lazily so the agent can start before OPENAI_API_KEY is checked.
+        # Retries are handled here so they share the backoff policy and the semaphore.
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(
+                api_key=self.api_key or os.getenv("OPENAI_API_KEY"),
+                timeout=self.timeout,
+                max_retries=0,
+            )
+        return self._client
+
+    async def _stream_sql(self, system_prompt: str, prompt: str) -> str:
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            stream=True,
+        )
+        parts = []
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                parts.append(delta)
+                if "`" in delta:
+                    sql = extract_sql("".join(parts))
+                    if sql is not None:
+                        # Everything after the code block is commentary; stop paying for it
+                        return sql
+        finally:
+            await stream.close()
+        text = "".join(parts)
+        return extract_sql(text + "\n```") or text.strip()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(LLM_BACKOFF_MAX, float(retry_after))
+            except ValueError:
+                pass
+        delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def generate_sql(self, system_prompt: str, prompt: str) -> str:
+        """
+        Runs one SQL generation.
+
+        Args:
+            system_prompt: System message.
+            prompt: User prompt with schema and request.
+
+        Returns:
+            str: The SQL from the first code block of the answer, or the whole answer if it has none.
+        """
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return await asyncio.wait_for(self._stream_sql(system_prompt, prompt), self.timeout)
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self._backoff(attempt, e)
+                    print(f"LLM call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
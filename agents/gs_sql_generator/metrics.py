@@ -0,0 +1,353 @@
+import asyncio
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+# Directory the agents publish their metrics to and the MCP server reads them from
+METRICS_DIR = os.getenv("GOLDEN_SAPPHIRE_METRICS_DIR", "")
+METRICS_PUBLISH_INTERVAL = float(os.getenv("GOLDEN_SAPPHIRE_METRICS_PUBLISH_INTERVAL", "15"))
+LOOP_LAG_INTERVAL = float(os.getenv("GOLDEN_SAPPHIRE_LOOP_LAG_INTERVAL", "0.25"))
+# A loop stuck for longer than this gets its stack printed
+LOOP_BLOCKED_THRESHOLD = float(os.getenv("GOLDEN_SAPPHIRE_LOOP_BLOCKED_THRESHOLD", "0.5"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# (name, type, help, [(labels, value)]) as returned by collectors
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+        return f"{name}{{{label_text}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+class Registry:
+    """
+    Holds metrics and renders them in the Prometheus text format.
+
+    ``const_labels`` (e.g. ``component``) are added to every sample, so the
+    MCP server and the agents can share metric names.
+    """
+
+    def __init__(self, const_labels: Optional[Dict[str, str]] = None) -> None:
+        self.const_labels = dict(const_labels or {})
+        self._metrics: List["_Metric"] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: "_Metric") -> None:
+        self._metrics.append(metric)
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """Adds a function returning families computed at scrape time (e.g. from ``stats()``)."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        families: List[Family] = [metric.collect() for metric in self._metrics]
+        for collector in self._collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e!r}")
+        for name, metric_type, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                sample_name = labels.pop("__name__", name)
+                lines.append(_sample(sample_name, {**self.const_labels, **labels}, value))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def collect(self) -> Family:
+        with self._lock:
+            samples = [(self._labels(key), value) for key, value in self._values.items()]
+        return self.name, self.type, self.documentation, samples
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Registry = REGISTRY,
+    ) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # [per-bucket counts..., +Inf count, sum]
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observes the time spent in the ``with`` block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> Family:
+        samples = []
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state[:-1]):
+                cumulative += count
+                samples.append(({**labels, "__name__": f"{self.name}_bucket", "le": _format_value(bound)}, cumulative))
+            samples.append(({**labels, "__name__": f"{self.name}_sum"}, state[-1]))
+            samples.append(({**labels, "__name__": f"{self.name}_count"}, cumulative))
+        return self.name, self.type, self.documentation, samples
+
+
+STAGE_SECONDS = Histogram(
+    "golden_sapphire_stage_duration_seconds",
+    "Time spent in one stage of an export or agent call.",
+    ["operation", "stage"],
+)
+OPERATION_SECONDS = Histogram(
+    "golden_sapphire_operation_duration_seconds",
+    "End-to-end time of a tool or agent call.",
+    ["operation", "outcome"],
+)
+ROWS_TOTAL = Counter("golden_sapphire_rows_total", "Rows written by exports and conversions.", ["operation", "format"])
+BYTES_TOTAL = Counter("golden_sapphire_bytes_total", "Bytes written by exports and conversions.", ["operation", "format"])
+LOOP_LAG = Gauge("golden_sapphire_event_loop_lag_seconds", "How late the last event-loop probe woke up.")
+LOOP_LAG_HISTOGRAM = Histogram(
+    "golden_sapphire_event_loop_lag_distribution_seconds",
+    "How late event-loop probes wake up.",
+    buckets=LAG_BUCKETS,
+)
+LOOP_BLOCKED_TOTAL = Counter(
+    "golden_sapphire_event_loop_blocked_total",
+    "Times the event loop was stuck for longer than the blocked threshold.",
+)
+
+
+def cache_families(caches: Dict[str, Dict[str, Any]]) -> List[Family]:
+    """Hit/miss counters and hit ratios from ``stats()`` dicts that have ``hits`` and ``misses``."""
+    hits, misses, ratios = [], [], []
+    for cache, stats in caches.items():
+        if "hits" not in stats or "misses" not in stats:
+            continue
+        total = stats["hits"] + stats["misses"]
+        hits.append(({"cache": cache}, stats["hits"]))
+        misses.append(({"cache": cache}, stats["misses"]))
+        ratios.append(({"cache": cache}, stats["hits"] / total if total else 0.0))
+    return [
+        ("golden_sapphire_cache_hits_total", "counter", "Cache hits.", hits),
+        ("golden_sapphire_cache_misses_total", "counter", "Cache misses.", misses),
+        ("golden_sapphire_cache_hit_ratio", "gauge", "Cache hits over lookups since start.", ratios),
+    ]
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag and reports blocking calls.
+
+    A probe task sleeps ``interval`` seconds in a loop; how late it wakes up
+    is the lag every other coroutine sees. A watchdog thread notices when
+    the probe has not run for ``blocked_threshold`` seconds past its
+    interval and prints the loop thread's stack, which names the blocking
+    call (``time.sleep``, sync ``requests``, a CPU-bound loop...).
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, blocked_threshold: float = LOOP_BLOCKED_THRESHOLD) -> None:
+        self.interval = interval
+        self.blocked_threshold = blocked_threshold
+        self._heartbeat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread_id: Optional[int] = None
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._probe())
+        if self.blocked_threshold > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+            self._thread.start()
+
+    async def _probe(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HISTOGRAM.observe(lag)
+            self._heartbeat = time.monotonic()
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stop.wait(self.blocked_threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.blocked_threshold or reported == heartbeat:
+                continue
+            # Report each stall once
+            reported = heartbeat
+            LOOP_BLOCKED_TOTAL.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(no frame)\n"
+            print(f"Event loop blocked for {stalled:.3f}s, loop thread stack:\n{stack}")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def merge_expositions(texts: Iterable[str]) -> str:
+    """
+    Merges Prometheus text expositions into one.
+
+    Samples of the same metric from several sources (told apart by their
+    ``component`` label) are grouped under a single HELP/TYPE header, as
+    the format requires.
+    """
+    # family -> {"HELP": line, "TYPE": line}, first source wins
+    headers: Dict[str, Dict[str, str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith(("# HELP ", "# TYPE ")):
+                _, kind, family = line.split(" ", 3)[:3]
+                headers.setdefault(family, {}).setdefault(kind, line)
+                samples.setdefault(family, [])
+            elif line.strip() and not line.startswith("#") and family is not None:
+                samples[family].append(line)
+    lines: List[str] = []
+    for family, header in headers.items():
+        lines.extend(header[kind] for kind in ("HELP", "TYPE") if kind in header)
+        lines.extend(samples[family])
+    return "\n".join(lines) + "\n"
+
+
+def read_published(directory: str = METRICS_DIR, max_age: float = METRICS_PUBLISH_INTERVAL * 4) -> List[str]:
+    """Reads the ``*.prom`` files other processes published; stale ones (a stopped agent) are skipped."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    texts = []
+    now = time.time()
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith(".prom"):
+            continue
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                continue
+            with open(path, encoding="utf-8") as f:
+                texts.append(f.read())
+        except OSError:
+            continue
+    return texts
+
+
+def write_textfile(path: str, registry: Registry = REGISTRY) -> None:
+    """Writes the registry to ``path`` atomically, so readers never see half a file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+async def publish_metrics(component: str, directory: str = METRICS_DIR, interval: float = METRICS_PUBLISH_INTERVAL) -> None:
+    """
+    Publishes this process's metrics to ``<directory>/<component>.prom`` every ``interval`` seconds.
+
+    Agents have no HTTP server; the MCP server's ``/metrics`` merges these
+    files into its own output. Does nothing when no directory is configured.
+    """
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{component}.prom")
+    while True:
+        try:
+            await asyncio.to_thread(write_textfile, path)
+        except OSError as e:
+            print(f"Publishing metrics to {path} failed: {e!r}")
+        await asyncio.sleep(interval)
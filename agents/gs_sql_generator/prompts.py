@@ -0,0 +1,41 @@
+import os
+from typing import Any
+
+from schema_index import prune_schema
+
+
+SCHEMA_PRUNING = os.getenv("GOLDEN_SAPPHIRE_SCHEMA_PRUNING", "true").lower() in ("1", "true", "yes")
+
+SYSTEM_PROMPT = "You're a helpful assistant"
+
+
+def build_prompt(schema_context: Any, schema_definition: str, request: str, prune: bool = SCHEMA_PRUNING) -> str:
+    """
+    Builds the SQL generation prompt.
+
+    Args:
+        schema_context: Table/column aliases, value mappings and relationships.
+        schema_definition: Raw schema (e.g., SQL DDL).
+        request: Natural language request.
+        prune: Only include the tables relevant to the request and their join neighbours.
+
+    Returns:
+        str: The user prompt sent to the LLM.
+    """
+    if prune:
+        schema_definition = prune_schema(schema_definition, schema_context, request)
+    return f"""
+You are an expert data engineer. Given the following schema context and raw schema definition,
+generate a valid SQL query to satisfy the request.
+
+Schema Context:
+{schema_context}
+
+Raw Schema Definition:
+{schema_definition}
+
+Request:
+{request}
+
+SQL Query:
+"""
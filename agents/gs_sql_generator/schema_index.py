@@ -0,0 +1,328 @@
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+
+SCHEMA_PRUNING_MAX_TABLES = int(os.getenv("GOLDEN_SAPPHIRE_SCHEMA_PRUNING_MAX_TABLES", "8"))
+SCHEMA_INDEX_CACHE_SIZE = int(os.getenv("GOLDEN_SAPPHIRE_SCHEMA_INDEX_CACHE_SIZE", "16"))
+
+# Minimum relevance score for a table to be picked on its own merit
+RELEVANCE_THRESHOLD = 3.0
+
+_STOPWORDS = {
+    "a", "all", "an", "and", "any", "are", "as", "at", "be", "by", "for", "from", "get", "give", "has", "have",
+    "in", "is", "it", "its", "list", "me", "of", "on", "or", "per", "show", "that", "the", "their", "them",
+    "this", "to", "was", "were", "which", "with", "amf", "table", "store", "stored", "data", "export", "id",
+}
+
+_COLUMN_STOP = {"constraint", "primary", "unique", "foreign", "check", "index", "exclude"}
+
+
+@dataclass
+class TableInfo:
+    name: str
+    ddl: str
+    comment: str = ""
+    comment_ddl: str = ""
+    columns: List[str] = field(default_factory=list)
+    column_comments: Dict[str, str] = field(default_factory=dict)
+    indexes: List[str] = field(default_factory=list)
+    position: int = 0
+
+
+def _split_statements(sql: str) -> List[str]:
+    """Splits SQL on top-level semicolons, ignoring those inside quotes and comments."""
+    statements, current = [], []
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch == "'" or ch == '"':
+            end = i + 1
+            while end < n:
+                if sql[end] == ch:
+                    if end + 1 < n and sql[end + 1] == ch:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+        elif sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end == -1 else end
+            current.append(sql[i:end])
+            i = end
+        elif ch == ";":
+            statements.append("".join(current).strip())
+            current = []
+            i += 1
+        else:
+            current.append(ch)
+            i += 1
+    tail = "".join(current).strip()
+    if tail:
+        statements.append(tail)
+    return [s for s in statements if s]
+
+
+def _split_top_level(body: str) -> List[str]:
+    parts, depth, current = [], 0, []
+    for ch in body:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+    if "".join(current).strip():
+        parts.append("".join(current).strip())
+    return parts
+
+
+def _strip_line_comments(sql: str) -> str:
+    return re.sub(r"--[^\n]*", "", sql)
+
+
+def _tokens(text: str) -> Set[str]:
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    tokens = set()
+    for word in words:
+        if word in _STOPWORDS or len(word) < 2:
+            continue
+        tokens.add(word)
+        # Cheap singularisation so "messages" matches amf_message
+        if word.endswith("ies") and len(word) > 4:
+            tokens.add(word[:-3] + "y")
+        elif word.endswith("es") and len(word) > 4:
+            tokens.add(word[:-2])
+            tokens.add(word[:-1])
+        elif word.endswith("s") and len(word) > 3:
+            tokens.add(word[:-1])
+    return tokens
+
+
+def _phrases(text: str) -> Set[str]:
+    """Adjacent word pairs joined with an underscore, so "file size" matches a file_size column."""
+    words = [w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in _STOPWORDS]
+    phrases = set()
+    for first, second in zip(words, words[1:]):
+        phrases.add(f"{first}_{second}")
+        if second.endswith("s") and len(second) > 3:
+            phrases.add(f"{first}_{second[:-1]}")
+    return phrases
+
+
+def parse_context(schema_context: Any) -> Dict[str, Any]:
+    """Accepts the schema context as a dict or JSON text; anything else yields an empty context."""
+    if isinstance(schema_context, dict):
+        return schema_context
+    if isinstance(schema_context, str):
+        try:
+            parsed = json.loads(schema_context)
+        except ValueError:
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+    return {}
+
+
+class SchemaIndex:
+    """
+    Parsed view of a DDL schema used to pick the tables relevant to a request.
+
+    Holds every table's columns, comments and indexes, plus a join graph built
+    from ``REFERENCES`` clauses and the ``table_relationships`` section of the
+    schema alias context.
+    """
+
+    def __init__(self, schema_definition: str, schema_context: Optional[Dict[str, Any]] = None) -> None:
+        schema_context = schema_context or {}
+        self.tables: Dict[str, TableInfo] = {}
+        self.neighbours: Dict[str, Set[str]] = {}
+        self._parse(schema_definition)
+
+        self.aliases: Dict[str, str] = {}
+        for alias, table in (schema_context.get("table_aliases") or {}).items():
+            if table.lower() in self.tables:
+                self.aliases[alias.lower()] = table.lower()
+
+        self.value_terms: Dict[str, Set[str]] = {}
+        for table, mappings in (schema_context.get("column_value_mappings") or {}).items():
+            if table.lower() in self.tables and isinstance(mappings, dict):
+                self.value_terms[table.lower()] = {t for term in mappings for t in _tokens(term)}
+
+        for table, relationships in (schema_context.get("table_relationships") or {}).items():
+            if not isinstance(relationships, dict):
+                continue
+            for description in relationships:
+                target = re.search(r"(\w+)\.\w+\s*$", description)
+                if target:
+                    self._link(table, target.group(1))
+
+        self._name_parts = {
+            name: [p for p in name.split("_") if p and p not in _STOPWORDS and p != "qt"]
+            for name in self.tables
+        }
+        self._column_tokens = {
+            name: {c.lower() for c in table.columns} | {p for c in table.columns for p in c.lower().split("_") if len(p) > 2}
+            for name, table in self.tables.items()
+        }
+        self._column_phrases = {
+            name: {c.lower() for c in table.columns if "_" in c}
+            for name, table in self.tables.items()
+        }
+        self._comment_tokens = {
+            name: _tokens(" ".join([table.comment, *table.column_comments.values()]))
+            for name, table in self.tables.items()
+        }
+
+    def _link(self, a: str, b: str) -> None:
+        a, b = a.lower(), b.lower()
+        if a == b or a not in self.tables or b not in self.tables:
+            return
+        self.neighbours.setdefault(a, set()).add(b)
+        self.neighbours.setdefault(b, set()).add(a)
+
+    def _parse(self, schema_definition: str) -> None:
+        pending_comments: Dict[str, tuple] = {}
+        pending_column_comments: Dict[str, Dict[str, str]] = {}
+        pending_indexes: Dict[str, List[str]] = {}
+        references = []
+
+        for position, statement in enumerate(_split_statements(schema_definition)):
+            code = _strip_line_comments(statement).strip()
+            table_comment = re.match(r"COMMENT\s+ON\s+TABLE\s+([\w.\"]+)\s+IS\s+'(.*)'\s*$", code, re.I | re.S)
+            if table_comment:
+                name = table_comment.group(1).strip('"').split(".")[-1].lower()
+                pending_comments[name] = (table_comment.group(2).replace("''", "'"), statement)
+                continue
+            column_comment = re.match(r"COMMENT\s+ON\s+COLUMN\s+([\w.\"]+)\.(\w+)\s+IS\s+'(.*)'\s*$", code, re.I | re.S)
+            if column_comment:
+                name = column_comment.group(1).strip('"').split(".")[-1].lower()
+                pending_column_comments.setdefault(name, {})[column_comment.group(2)] = column_comment.group(3)
+                continue
+            index = re.match(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?[\w\"]*\s*ON\s+([\w.\"]+)", code, re.I)
+            if index:
+                name = index.group(1).strip('"').split(".")[-1].lower()
+                pending_indexes.setdefault(name, []).append(statement)
+                continue
+            table = re.match(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.\"]+)\s*\((.*)\)[^)]*$", code, re.I | re.S)
+            if not table:
+                continue
+            name = table.group(1).strip('"').split(".")[-1].lower()
+            info = TableInfo(name=name, ddl=statement, position=position)
+            for part in _split_top_level(table.group(2)):
+                first = part.split(None, 1)[0].strip('"') if part.split() else ""
+                if first and first.lower() not in _COLUMN_STOP:
+                    info.columns.append(first)
+                for ref in re.finditer(r"REFERENCES\s+([\w.\"]+)", part, re.I):
+                    references.append((name, ref.group(1).strip('"').split(".")[-1]))
+            self.tables[name] = info
+
+        for name, (comment, ddl) in pending_comments.items():
+            if name in self.tables:
+                self.tables[name].comment = comment
+                self.tables[name].comment_ddl = ddl
+        for name, comments in pending_column_comments.items():
+            if name in self.tables:
+                self.tables[name].column_comments.update(comments)
+        for name, statements in pending_indexes.items():
+            if name in self.tables:
+                self.tables[name].indexes.extend(statements)
+        for source, target in references:
+            self._link(source, target)
+
+    def score(self, request: str) -> Dict[str, float]:
+        """Relevance score of every table for a natural language request."""
+        text = request.lower()
+        tokens = _tokens(request)
+        phrases = _phrases(request)
+        scores: Dict[str, float] = {}
+        for name in self.tables:
+            score = 0.0
+            if re.search(rf"\b{re.escape(name)}\b", text):
+                score += 10
+            parts = self._name_parts[name]
+            if parts:
+                score += 6 * sum(1 for p in parts if p in tokens) / len(parts)
+            score += min(2, len(self._column_tokens[name] & tokens))
+            # Multi-word column names are specific enough to count double
+            score += min(4, 2 * len(self._column_phrases[name] & phrases))
+            score += min(2, 0.5 * len(self._comment_tokens[name] & tokens))
+            score += 2 if self.value_terms.get(name, set()) & tokens else 0
+            scores[name] = score
+        for alias, table in self.aliases.items():
+            if alias in tokens or re.search(rf"\b{re.escape(alias)}\b", text):
+                scores[table] = scores.get(table, 0) + 8
+        return scores
+
+    def relevant_tables(self, request: str, max_tables: int = SCHEMA_PRUNING_MAX_TABLES) -> List[str]:
+        """
+        Picks the tables most relevant to ``request`` plus their direct join neighbours.
+
+        Returns an empty list when nothing in the request can be tied to a
+        table, so callers can fall back to the full schema.
+        """
+        scores = self.score(request)
+        ranked = sorted((s, name) for name, s in scores.items() if s > 0)
+        ranked.reverse()
+        selected = [name for s, name in ranked if s >= RELEVANCE_THRESHOLD][:max_tables]
+        if not selected:
+            return []
+        for name in list(selected):
+            for neighbour in sorted(self.neighbours.get(name, ())):
+                if neighbour not in selected:
+                    selected.append(neighbour)
+        return sorted(selected, key=lambda n: self.tables[n].position)
+
+    def render(self, table_names: List[str]) -> str:
+        """Renders the DDL (comment, table and indexes) of the given tables in schema order."""
+        statements = []
+        for name in table_names:
+            table = self.tables[name]
+            if table.comment_ddl:
+                statements.append(table.comment_ddl + ";")
+            statements.append(table.ddl + ";")
+            statements.extend(index + ";" for index in table.indexes)
+        return "\n".join(statements)
+
+
+_index_cache: "OrderedDict[str, SchemaIndex]" = OrderedDict()
+
+
+def get_schema_index(schema_definition: str, schema_context: Optional[Dict[str, Any]] = None) -> SchemaIndex:
+    """Returns the index for this schema version, building it on first use."""
+    digest = hashlib.sha256(schema_definition.encode("utf-8"))
+    digest.update(json.dumps(schema_context or {}, sort_keys=True, default=str).encode("utf-8"))
+    key = digest.hexdigest()
+    index = _index_cache.get(key)
+    if index is None:
+        index = SchemaIndex(schema_definition, schema_context)
+        _index_cache[key] = index
+        while len(_index_cache) > SCHEMA_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    _index_cache.move_to_end(key)
+    return index
+
+
+def prune_schema(schema_definition: str, schema_context: Any, request: str, max_tables: int = SCHEMA_PRUNING_MAX_TABLES) -> str:
+    """
+    Reduces a raw schema definition to the tables relevant to ``request``.
+
+    Falls back to the full definition when it cannot be parsed as DDL or no
+    table matches the request.
+    """
+    index = get_schema_index(schema_definition, parse_context(schema_context))
+    if not index.tables:
+        return schema_definition
+    tables = index.relevant_tables(request, max_tables)
+    if not tables:
+        return schema_definition
+    header = f"-- {len(tables)} of {len(index.tables)} tables, selected for relevance to the request\n"
+    return header + index.render(tables)
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+import aiohttp
+
+
+AGENT_REGISTRY_TTL = float(os.getenv("GOLDEN_SAPPHIRE_AGENT_REGISTRY_TTL", "300"))
+AGENT_REGISTRY_REFRESH_INTERVAL = float(os.getenv("GOLDEN_SAPPHIRE_AGENT_REGISTRY_REFRESH_INTERVAL", "120"))
+
+
+class AgentRegistry:
+    """
+    Async client for ``/api/agents`` that keeps an in-memory index of agent
+    UUIDs by name.
+
+    Lookups are answered from the index. Once an entry is older than ``ttl``
+    the stale UUID is still returned while a refresh runs in the background,
+    and a background task re-fetches the list every ``refresh_interval``
+    seconds, so steady-state lookups never wait on the network. Callers that
+    see a send to a UUID fail should call :meth:`invalidate` so the next
+    lookup fetches a fresh list.
+    """
+
+    def __init__(
+        self,
+        api_base_url: str,
+        jwt_token: Optional[str],
+        ttl: float = AGENT_REGISTRY_TTL,
+        refresh_interval: float = AGENT_REGISTRY_REFRESH_INTERVAL,
+    ) -> None:
+        self.api_base_url = api_base_url
+        self.jwt_token = jwt_token
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._index: Dict[str, str] = {}
+        self._fetched_at = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+        self._background: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(headers={"Authorization": f"Bearer {self.jwt_token}"})
+        return self._session
+
+    async def _fetch(self) -> None:
+        async with self._get_session().get(f"{self.api_base_url}/api/agents") as resp:
+            resp.raise_for_status()
+            agents = await resp.json()
+        index = {}
+        for agent in agents:
+            name = agent.get("agent_name")
+            # Prefer active registrations when a name is registered more than once
+            if name and (name not in index or agent.get("is_active", True)):
+                index[name] = agent["agent_id"]
+        self._index = index
+        self._fetched_at = time.monotonic()
+        self.refreshes += 1
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._fetch())
+            self._refreshing.add_done_callback(_log_refresh_failure)
+        return self._refreshing
+
+    async def refresh(self) -> None:
+        """Re-fetches the agent list; concurrent callers share one request."""
+        await asyncio.shield(self._start_refresh())
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                # Already logged by the refresh task; keep the loop running
+                pass
+
+    def _ensure_background_refresh(self) -> None:
+        if self.refresh_interval and (self._background is None or self._background.done()):
+            self._background = asyncio.ensure_future(self._refresh_loop())
+
+    async def get_uuid(self, agent_name: str) -> str:
+        """
+        Returns the UUID registered for ``agent_name``.
+
+        Raises:
+            ValueError: If no agent with that name is registered.
+        """
+        self._ensure_background_refresh()
+        agent_uuid = self._index.get(agent_name)
+        if agent_uuid is not None:
+            self.hits += 1
+            if time.monotonic() - self._fetched_at > self.ttl:
+                self._start_refresh()
+            return agent_uuid
+
+        self.misses += 1
+        await self.refresh()
+        agent_uuid = self._index.get(agent_name)
+        if agent_uuid is None:
+            raise ValueError(f"Agent '{agent_name}' not found.")
+        return agent_uuid
+
+    def invalidate(self, agent_name: Optional[str] = None) -> None:
+        """Drops one cached name, or the whole index when ``agent_name`` is omitted."""
+        if agent_name is None:
+            self._index = {}
+        else:
+            self._index.pop(agent_name, None)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "agents": len(self._index),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "age_seconds": round(time.monotonic() - self._fetched_at, 1) if self._fetched_at else -1,
+        }
+
+    async def close(self) -> None:
+        for task in (self._background, self._refreshing):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._session is not None:
+            await self._session.close()
+
+
+def _log_refresh_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Agent registry refresh failed: {task.exception()}")
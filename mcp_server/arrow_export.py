@@ -0,0 +1,182 @@
+import decimal
+import json
+import os
+from typing import IO, Any, Callable, List, Optional, Sequence, Tuple
+
+import asyncpg
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+
+COLUMNAR_FORMATS = ("parquet", "arrow")
+COLUMNAR_COMPRESSION = os.getenv("GOLDEN_SAPPHIRE_COLUMNAR_COMPRESSION", "zstd")
+# Parquet row groups are buffered to this many rows; small groups make reads slow
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("GOLDEN_SAPPHIRE_PARQUET_ROW_GROUP_SIZE", "100000"))
+# Fractional digits of numeric columns, written as decimal128(38, scale)
+ARROW_NUMERIC_SCALE = int(os.getenv("GOLDEN_SAPPHIRE_ARROW_NUMERIC_SCALE", "9"))
+
+# Postgres type name -> Arrow type; numeric is handled by _decimal_type
+PG_ARROW_TYPES = {
+    "bool": pa.bool_(),
+    "int2": pa.int16(),
+    "int4": pa.int32(),
+    "int8": pa.int64(),
+    "oid": pa.int64(),
+    "float4": pa.float32(),
+    "float8": pa.float64(),
+    "text": pa.string(),
+    "varchar": pa.string(),
+    "bpchar": pa.string(),
+    "name": pa.string(),
+    "char": pa.string(),
+    "date": pa.date32(),
+    "time": pa.time64("us"),
+    "timestamp": pa.timestamp("us"),
+    "timestamptz": pa.timestamp("us", tz="UTC"),
+    "interval": pa.duration("us"),
+    "bytea": pa.binary(),
+    "uuid": pa.uuid(),
+    "json": pa.json_(),
+    "jsonb": pa.json_(),
+}
+
+
+def _decimal_type(scale: int = ARROW_NUMERIC_SCALE) -> pa.DataType:
+    """
+    Arrow type of numeric columns.
+
+    asyncpg does not expose the type modifier of result columns, so the
+    declared precision and scale of ``numeric(p, s)`` are unknown and every
+    numeric column is treated as unconstrained. The type is fixed before the
+    first batch, since later batches cannot change the file's schema.
+    """
+    return pa.decimal128(38, scale)
+
+
+def _decimal_values(values: List[Any], arrow_type: pa.DataType, name: str) -> List[Optional[decimal.Decimal]]:
+    # NaN and infinities have no decimal representation; extra fractional
+    # digits are rounded half-even, as a cast to numeric(38, scale) would
+    quantum = decimal.Decimal(1).scaleb(-arrow_type.scale)
+    context = decimal.Context(prec=arrow_type.precision)
+    max_digits = arrow_type.precision - arrow_type.scale
+    out = []
+    for value in values:
+        if value is None or not value.is_finite():
+            out.append(None)
+            continue
+        if value.as_tuple().exponent < -arrow_type.scale:
+            value = value.quantize(quantum, rounding=decimal.ROUND_HALF_EVEN, context=context)
+        if value and value.adjusted() >= max_digits:
+            raise ValueError(
+                f"Numeric column {name!r} has a value with {value.adjusted() + 1} integer digits; "
+                f"{arrow_type} holds at most {max_digits}. Lower GOLDEN_SAPPHIRE_ARROW_NUMERIC_SCALE "
+                "or export as csv."
+            )
+        out.append(value)
+    return out
+
+
+def _to_text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _column_array(values: List[Any], arrow_type: pa.DataType, name: str) -> pa.Array:
+    if isinstance(arrow_type, pa.ExtensionType):
+        if arrow_type.extension_name == "arrow.uuid":
+            storage = [None if v is None else v.bytes for v in values]
+        else:
+            storage = [_to_text(v) for v in values]
+        return pa.ExtensionArray.from_storage(arrow_type, pa.array(storage, type=arrow_type.storage_type))
+    if pa.types.is_string(arrow_type):
+        values = [_to_text(v) for v in values]
+    elif pa.types.is_decimal(arrow_type):
+        values = _decimal_values(values, arrow_type, name)
+    return pa.array(values, type=arrow_type)
+
+
+def arrow_record_batch(schema: pa.Schema, rows: Sequence[Sequence[Any]]) -> pa.RecordBatch:
+    """Builds a record batch of ``schema`` from rows of values; also runs as a pool task."""
+    arrays = [
+        _column_array([row[index] for row in rows], field.type, field.name)
+        for index, field in enumerate(schema)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ArrowBatchEncoder:
+    """
+    Writes record batches as Parquet or Arrow IPC with typed columns.
+
+    The Arrow schema comes from the Postgres column types of the query, so
+    UUID, JSON, numeric and timestamptz columns keep their logical types
+    instead of turning into strings. Numeric columns are written with
+    ``ARROW_NUMERIC_SCALE`` fractional digits; NaN and infinities become
+    nulls, and a value with more integer digits than that leaves room for
+    fails the export with a ValueError naming the column. Unknown types (arrays, enums, ranges...) are written as text.
+    """
+
+    def __init__(self, out: IO[bytes], output_format: str, columns: Sequence[asyncpg.Attribute]) -> None:
+        if output_format not in COLUMNAR_FORMATS:
+            raise ValueError(f"Unsupported columnar format: {output_format}")
+        self._out = out
+        self._format = output_format
+        self._columns = columns
+        self._schema: Optional[pa.Schema] = None
+        self._writer = None
+        self._pending: List[pa.RecordBatch] = []
+        self._pending_rows = 0
+
+    def _build_schema(self) -> pa.Schema:
+        fields = []
+        for column in self._columns:
+            if column.type.name == "numeric":
+                arrow_type = _decimal_type()
+            else:
+                arrow_type = PG_ARROW_TYPES.get(column.type.name, pa.string())
+            fields.append(pa.field(column.name, arrow_type))
+        return pa.schema(fields)
+
+    def _open(self) -> None:
+        self._schema = self._build_schema()
+        if self._format == "parquet":
+            self._writer = pq.ParquetWriter(self._out, self._schema, compression=COLUMNAR_COMPRESSION)
+        else:
+            options = ipc.IpcWriteOptions(compression=COLUMNAR_COMPRESSION)
+            self._writer = ipc.new_file(self._out, self._schema, options=options)
+
+    def encode_task(self, rows: List[tuple]) -> Tuple[Callable[..., pa.RecordBatch], tuple]:
+        if self._writer is None:
+            self._open()
+        return arrow_record_batch, (self._schema, rows)
+
+    def write_encoded(self, batch: pa.RecordBatch) -> None:
+        if batch.num_rows == 0:
+            return
+        if self._format == "arrow":
+            self._writer.write_batch(batch)
+            return
+        self._pending.append(batch)
+        self._pending_rows += batch.num_rows
+        if self._pending_rows >= PARQUET_ROW_GROUP_SIZE:
+            self._flush()
+
+    def write_batch(self, records: Sequence[asyncpg.Record]) -> None:
+        fn, args = self.encode_task(records)
+        self.write_encoded(fn(*args))
+
+    def _flush(self) -> None:
+        if self._pending:
+            self._writer.write_table(pa.Table.from_batches(self._pending), row_group_size=PARQUET_ROW_GROUP_SIZE)
+            self._pending = []
+            self._pending_rows = 0
+
+    def close(self) -> None:
+        if self._writer is None:
+            # No batch arrived: still write a valid file with the column schema
+            self._open()
+        if self._format == "parquet":
+            self._flush()
+        self._writer.close()
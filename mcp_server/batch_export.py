@@ -0,0 +1,67 @@
+import os
+import re
+import shutil
+import time
+import zipfile
+from typing import IO, List, Sequence, Tuple
+
+from excel_export import EXCEL_SHEET_NAME_LENGTH
+from pg_pool import POOL_MAX_SIZE
+
+
+BATCH_MAX_REQUESTS = int(os.getenv("GOLDEN_SAPPHIRE_BATCH_MAX_REQUESTS", "25"))
+# SQL generations in flight per batch
+BATCH_GENERATE_CONCURRENCY = int(os.getenv("GOLDEN_SAPPHIRE_BATCH_GENERATE_CONCURRENCY", "8"))
+# Queries in flight per batch; by default half the pool, leaving the rest for other exports
+BATCH_QUERY_CONCURRENCY = int(os.getenv("GOLDEN_SAPPHIRE_BATCH_QUERY_CONCURRENCY", str(max(1, POOL_MAX_SIZE // 2))))
+
+# Characters Excel does not allow in sheet names
+_SHEET_NAME_INVALID = re.compile(r"[\[\]:*?/\\]")
+_FILE_NAME_INVALID = re.compile(r"[^A-Za-z0-9]+")
+# Members already compressed by their format are stored as they are
+_COMPRESSED_SUFFIXES = (".xlsx", ".parquet")
+
+
+def sheet_names(requests: Sequence[str]) -> List[str]:
+    """
+    Names a workbook sheet after each request.
+
+    Names are numbered in request order, which keeps them unique, and are cut
+    to leave room for the `` (2)`` Excel row-limit overflow sheets get.
+    """
+    names = []
+    for index, request in enumerate(requests, 1):
+        title = " ".join(_SHEET_NAME_INVALID.sub(" ", request).split())
+        # Excel rejects names starting or ending with an apostrophe
+        names.append(f"{index} {title}"[:EXCEL_SHEET_NAME_LENGTH - 4].rstrip(" '"))
+    return names
+
+
+def member_names(requests: Sequence[str], suffix: str) -> List[str]:
+    """Names a zip member after each request: ``01_failed_deliveries_last_week.csv``."""
+    width = len(str(len(requests)))
+    names = []
+    for index, request in enumerate(requests, 1):
+        slug = _FILE_NAME_INVALID.sub("_", request.lower()).strip("_")[:60].rstrip("_") or "export"
+        names.append(f"{index:0{max(width, 2)}d}_{slug}{suffix}")
+    return names
+
+
+def write_zip(out: IO[bytes], members: Sequence[Tuple[str, IO[bytes]]]) -> None:
+    """
+    Writes a zip archive of ``(name, fileobj)`` members to ``out``; runs in a thread.
+
+    Members are copied in chunks, so none is read into memory whole. Text
+    formats are deflated; .xlsx and .parquet are stored as they are.
+    """
+    with zipfile.ZipFile(out, "w", allowZip64=True) as archive:
+        for name, fileobj in members:
+            compression = zipfile.ZIP_STORED if name.endswith(_COMPRESSED_SUFFIXES) else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = compression
+            info.external_attr = 0o644 << 16
+            fileobj.seek(0)
+            # Sizes are unknown until written, so every member may need zip64 headers
+            with archive.open(info, "w", force_zip64=True) as member:
+                shutil.copyfileobj(fileobj, member, 1024 * 1024)
+    out.seek(0)
@@ -0,0 +1,558 @@
+"""
+End-to-end benchmark of gs-data-export, csv-to-json and postgres_query_agent.
+
+Everything runs locally. A throwaway Postgres is created with initdb, loaded
+from the Postgres agent's schema.sql and filled with synthetic amf_message
+rows at each size. An aiohttp file service stands in for AgentOS, and
+FakeFileManager talks to it. The gs_sql_generator call is stubbed to return
+canned SQL, so the LLM is the only stage not measured.
+
+Each (size, path, format) case runs ``--repeat`` times in a fresh process,
+so peak RSS is that case's alone. Reported per case:
+
+- throughput in rows and MiB per second at the median latency
+- p50 and p99 latency
+- peak RSS, and the RSS after imports ("base")
+
+``--save`` writes the results as JSON. ``--baseline`` compares against a
+saved run and exits with status 1 when the p50 latency or peak RSS of any
+case grew by more than ``--tolerance``.
+
+Needs the Postgres server binaries (initdb, pg_ctl, psql) on PATH or in
+``--pg-bin``; initdb refuses to run as root. ``--dsn`` uses an existing
+throwaway database instead: its amf_message table is emptied and refilled.
+
+Usage:
+    python bench_e2e.py [--sizes 10k,1m,10m] [--repeat 5] [--cases gs_data_export,csv_to_json,postgres_query_agent]
+                        [--formats csv,excel] [--stream] [--save results.json] [--baseline results.json]
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PG_AGENT_DIR = os.path.join(HERE, "..", "agents", "goldensapphire_pg_agent")
+SCHEMA_SQL = os.path.join(PG_AGENT_DIR, "schema.sql")
+
+# What the stubbed gs_sql_generator answers for every request
+CANNED_SQL = "SELECT * FROM amf_message ORDER BY create_time DESC"
+REQUEST = "All messages, newest first"
+SCHEMA_CONTEXT = {
+    "table_aliases": {"messages": "amf_message"},
+    "column_descriptions": {"amf_message": {"create_time": "When the message was received"}},
+}
+
+CASE_FORMATS = {
+    "gs_data_export": ["csv", "json", "jsonl", "excel", "parquet", "arrow"],
+    "csv_to_json": ["json", "jsonl"],
+    # "inline" returns the rows in the agent response instead of a file
+    "postgres_query_agent": ["csv", "excel", "inline"],
+}
+
+# CockroachDB built-ins that schema.sql uses
+POSTGRES_SHIMS = """
+CREATE SEQUENCE IF NOT EXISTS unique_rowid_seq;
+CREATE OR REPLACE FUNCTION unique_rowid() RETURNS int8 LANGUAGE sql AS $$ SELECT nextval('unique_rowid_seq') $$;
+DO $$ BEGIN CREATE DOMAIN string AS text; EXCEPTION WHEN duplicate_object THEN NULL; END $$;
+"""
+
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+class FakeFileManager:
+    """Stands in for genai_session's FileManager, against the local file service."""
+
+    def __init__(self, api_base_url: str, session_id: str, request_id: str, jwt_token: Optional[str]) -> None:
+        self.file_service_url = api_base_url
+        self.session_id = session_id or "bench"
+        self.request_id = request_id
+        self.jwt_token = jwt_token
+
+    async def save(self, content: bytes, filename: str) -> str:
+        data = aiohttp.FormData()
+        data.add_field("file", content, filename=filename, content_type="application/octet-stream")
+        data.add_field("request_id", self.request_id)
+        data.add_field("session_id", self.session_id)
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{self.file_service_url}/files", data=data) as resp:
+                resp.raise_for_status()
+                return (await resp.json())["id"]
+
+    async def get_by_id(self, file_id: str) -> io.BytesIO:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{self.file_service_url}/files/{file_id}") as resp:
+                resp.raise_for_status()
+                return io.BytesIO(await resp.read())
+
+
+class FileService:
+    """
+    Local stand-in for the AgentOS file service.
+
+    Serves ``POST /files`` (multipart, as FileManager and upload_export send
+    it) and ``GET /files/{id}``. Files are kept on disk; uploads are counted
+    so the driver knows how many bytes each case produced.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.received_bytes = 0
+        self._uploads: List[str] = []
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, file_id: str) -> str:
+        return os.path.join(self.directory, file_id)
+
+    async def _upload(self, request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        file_id = uuid.uuid4().hex
+        async for part in reader:
+            if part.name != "file":
+                continue
+            with open(self._path(file_id), "wb") as f:
+                while chunk := await part.read_chunk(1024 * 1024):
+                    f.write(chunk)
+                    self.received_bytes += len(chunk)
+        self._uploads.append(file_id)
+        return web.json_response({"id": file_id})
+
+    async def _download(self, request: web.Request) -> web.StreamResponse:
+        path = self._path(request.match_info["file_id"])
+        if not os.path.exists(path):
+            raise web.HTTPNotFound()
+        return web.FileResponse(path)
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=0)
+        app.add_routes([web.post("/files", self._upload), web.get("/files/{file_id}", self._download)])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    def put(self, content: bytes) -> str:
+        """Stores an input file, as if the user had uploaded it."""
+        file_id = uuid.uuid4().hex
+        with open(self._path(file_id), "wb") as f:
+            f.write(content)
+        return file_id
+
+    def discard_uploads(self) -> None:
+        # Exports are only counted; dropping them keeps the disk use of a 10M run bounded
+        for file_id in self._uploads:
+            os.remove(self._path(file_id))
+        self._uploads = []
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class LocalPostgres:
+    """A throwaway Postgres cluster listening only on a socket in ``directory``."""
+
+    DATABASE = "golden_sapphire_bench"
+
+    def __init__(self, directory: str, bin_dir: Optional[str] = None) -> None:
+        self.directory = directory
+        self.bin_dir = bin_dir
+        self.data_dir = os.path.join(directory, "data")
+        self.port = 5432
+        self.dsn = f"postgresql://bench@/{self.DATABASE}?host={directory}&port={self.port}"
+
+    def _bin(self, name: str) -> str:
+        path = os.path.join(self.bin_dir, name) if self.bin_dir else shutil.which(name)
+        if not path or not os.path.exists(path):
+            raise RuntimeError(f"{name} not found; put the Postgres binaries on PATH or pass --pg-bin")
+        return path
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        subprocess.run(
+            [self._bin("initdb"), "-D", self.data_dir, "-U", "bench", "-A", "trust", "-E", "UTF8", "--no-sync"],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        # Durability is irrelevant here and would only slow the data load
+        options = (
+            f"-p {self.port} -k {self.directory} -c listen_addresses='' "
+            "-c fsync=off -c synchronous_commit=off -c full_page_writes=off"
+        )
+        subprocess.run(
+            [self._bin("pg_ctl"), "-D", self.data_dir, "-l", os.path.join(self.directory, "postgres.log"), "-o", options, "-w", "start"],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        admin_dsn = f"postgresql://bench@/postgres?host={self.directory}&port={self.port}"
+        subprocess.run([self._bin("psql"), "-X", "-q", "-d", admin_dsn, "-c", f"CREATE DATABASE {self.DATABASE}"], check=True)
+
+    def stop(self) -> None:
+        subprocess.run([self._bin("pg_ctl"), "-D", self.data_dir, "-m", "immediate", "-w", "stop"], stdout=subprocess.DEVNULL)
+
+
+def load_schema(dsn: str, bin_dir: Optional[str]) -> None:
+    """
+    Loads schema.sql with psql, one statement at a time.
+
+    schema.sql was written for CockroachDB. The shims cover its built-ins;
+    statements Postgres still rejects are skipped, as psql does without
+    ON_ERROR_STOP.
+    """
+    psql = os.path.join(bin_dir, "psql") if bin_dir else shutil.which("psql")
+    if not psql:
+        raise RuntimeError("psql not found; put the Postgres binaries on PATH or pass --pg-bin")
+    with tempfile.NamedTemporaryFile("w", suffix=".sql") as shims:
+        shims.write(POSTGRES_SHIMS)
+        shims.flush()
+        completed = subprocess.run(
+            [psql, "-X", "-q", "-d", dsn, "-f", shims.name, "-f", SCHEMA_SQL],
+            capture_output=True, text=True,
+        )
+    skipped = completed.stderr.count("ERROR:")
+    if skipped:
+        print(f"schema.sql loaded; {skipped} statements Postgres does not accept were skipped")
+
+
+async def populate(dsn: str, rows: int) -> None:
+    import asyncpg
+    from bench_csv_export import POPULATE
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute("TRUNCATE amf_message")
+        await conn.execute(POPULATE, rows)
+        await conn.execute("ANALYZE amf_message")
+    finally:
+        await conn.close()
+
+
+async def export_csv_source(dsn: str, path: str) -> None:
+    # Input of csv-to-json: the table as the COPY export writes it
+    import asyncpg
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.copy_from_query(CANNED_SQL, output=path, format="csv", header=True)
+    finally:
+        await conn.close()
+
+
+# --- Cases, each run in its own process ---------------------------------------
+
+
+async def bench_gs_data_export(output_format: str, inputs: Dict[str, str], repeat: int, stream: bool) -> List[tuple]:
+    import server
+    from export_jobs import ExportJob
+
+    async def gs_sql_generator(agent_name: str, message: dict) -> str:
+        return CANNED_SQL
+
+    server.send_to_agent = gs_sql_generator
+    fm = FakeFileManager(os.environ["GENAI_API_BASE_URL"], "bench", str(uuid.uuid4()), "bench")
+    runs = []
+    try:
+        for _ in range(repeat):
+            job = ExportJob()
+            export_input = server.GSDataExportInput(
+                schema_context_file_id=inputs["schema_context"],
+                schema_file_id=inputs["schema"],
+                db_config_file_id=inputs["db_config"],
+                request=REQUEST,
+                output_format=output_format,
+                stream=stream,
+                # Every run exports again instead of reusing the cached file
+                refresh=True,
+            )
+            started = time.perf_counter()
+            result = await server.run_data_export(export_input, fm, job)
+            seconds = time.perf_counter() - started
+            if "error" in result:
+                raise RuntimeError(f"gs-data-export failed: {result}")
+            runs.append((seconds, job.rows_written))
+    finally:
+        await server.pg_pools.close()
+    return runs
+
+
+async def bench_csv_to_json(output_format: str, inputs: Dict[str, str], repeat: int, stream: bool) -> List[tuple]:
+    import server
+
+    server.FileManager = FakeFileManager
+    # FastMCP may wrap the tool; call the function underneath
+    tool = getattr(server.csv_to_json, "fn", server.csv_to_json)
+    ctx = SimpleNamespace(request_context=SimpleNamespace(request=SimpleNamespace(headers={"mcp-session-id": "bench"})))
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await tool(inputs["csv"], ctx, output_format)
+        seconds = time.perf_counter() - started
+        if "error" in result:
+            raise RuntimeError(f"csv-to-json failed: {result}")
+        runs.append((seconds, int(inputs["rows"])))
+    return runs
+
+
+async def bench_postgres_query_agent(output_format: str, inputs: Dict[str, str], repeat: int, stream: bool) -> List[tuple]:
+    # The agent has its own copies of pg_pool, row_encoder... they must win over the server's
+    sys.path.insert(0, os.path.abspath(PG_AGENT_DIR))
+    import agent
+    from loguru import logger
+
+    agent.FileManager = FakeFileManager
+    export_format = "" if output_format == "inline" else output_format
+    runs = []
+    try:
+        for _ in range(repeat):
+            context = SimpleNamespace(logger=logger, session_id="bench", request_id=str(uuid.uuid4()), agent_uuid="bench")
+            started = time.perf_counter()
+            result = await agent._run_query(context, CANNED_SQL, export_format, None)
+            seconds = time.perf_counter() - started
+            if not result["success"] or "export_error" in result:
+                raise RuntimeError(f"postgres_query_agent failed: {result}")
+            rows = len(result["data"]) if "data" in result else int(inputs["rows"])
+            runs.append((seconds, rows))
+    finally:
+        await agent.pg_pools.close()
+    return runs
+
+
+CASES = {
+    "gs_data_export": bench_gs_data_export,
+    "csv_to_json": bench_csv_to_json,
+    "postgres_query_agent": bench_postgres_query_agent,
+}
+
+
+def run_case_process(args: argparse.Namespace) -> None:
+    """Child side: runs one case and prints its timings on a RESULT_PREFIX line."""
+    inputs = json.loads(args.inputs)
+    bench = CASES[args.case]
+    encode_pool = None
+    if args.case != "postgres_query_agent":
+        from encode_pool import encode_pool
+        # Fork the encoding processes before anything starts a thread, as main() does
+        encode_pool.start()
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        runs = asyncio.run(bench(args.format, inputs, args.repeat, args.stream))
+    finally:
+        if encode_pool is not None:
+            encode_pool.close()
+    result = {
+        "seconds": [seconds for seconds, _ in runs],
+        "rows": [rows for _, rows in runs],
+        "base_rss": base_rss,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+# --- Driver -------------------------------------------------------------------
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    # Nearest rank: with few runs p99 is the slowest one
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+
+async def run_case(
+    case: str,
+    output_format: str,
+    rows: int,
+    inputs: Dict[str, str],
+    args: argparse.Namespace,
+    env: Dict[str, str],
+    files: FileService,
+) -> Optional[Dict[str, Any]]:
+    received = files.received_bytes
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--case", case, "--format", output_format, "--repeat", str(args.repeat),
+        "--inputs", json.dumps({**inputs, "rows": str(rows)}),
+    ]
+    if args.stream:
+        command.append("--stream")
+    process = await asyncio.create_subprocess_exec(
+        *command, cwd=HERE, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+    )
+    output, _ = await process.communicate()
+    files.discard_uploads()
+    lines = output.decode(errors="replace").splitlines()
+    result_lines = [line for line in lines if line.startswith(RESULT_PREFIX)]
+    if process.returncode != 0 or not result_lines:
+        tail = "\n".join(lines[-20:])
+        print(f"{case}/{output_format} at {rows} rows failed (exit {process.returncode}):\n{tail}")
+        return None
+
+    measured = json.loads(result_lines[-1][len(RESULT_PREFIX):])
+    p50 = percentile(measured["seconds"], 0.5)
+    bytes_per_run = (files.received_bytes - received) / len(measured["seconds"])
+    return {
+        "key": f"{case}/{output_format}{'/stream' if args.stream else ''}/{rows}",
+        "case": case,
+        "format": output_format,
+        "rows": rows,
+        "runs": len(measured["seconds"]),
+        "p50": p50,
+        "p99": percentile(measured["seconds"], 0.99),
+        "rows_per_second": max(measured["rows"]) / p50 if p50 else 0.0,
+        "mib_per_second": bytes_per_run / 2**20 / p50 if p50 else 0.0,
+        "base_rss": measured["base_rss"],
+        "peak_rss": measured["peak_rss"],
+    }
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    print(
+        f"{result['rows']:>10,} {result['case']:<22} {result['format']:<7} {result['runs']:>4} "
+        f"{result['p50']:>8.3f} {result['p99']:>8.3f} {result['rows_per_second']:>12,.0f} "
+        f"{result['mib_per_second']:>7.1f} {result['peak_rss'] / 2**20:>9.0f} {result['base_rss'] / 2**20:>6.0f}"
+    )
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result["key"]: result for result in json.load(f)}
+    regressions = []
+    for result in results:
+        before = baseline.get(result["key"])
+        if before is None:
+            continue
+        for metric in ("p50", "peak_rss"):
+            if before[metric] and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{result['key']}: {metric} {before[metric]:,.3f} -> {result[metric]:,.3f} "
+                    f"(+{result[metric] / before[metric] - 1:.0%})"
+                )
+    return regressions
+
+
+async def run_suite(args: argparse.Namespace) -> int:
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    cases = [case.strip() for case in args.cases.split(",")]
+    formats = {name.strip() for name in args.formats.split(",")} if args.formats else None
+
+    with tempfile.TemporaryDirectory(prefix="gs_bench_") as workdir:
+        files = FileService(os.path.join(workdir, "files"))
+        await files.start()
+        postgres = None
+        dsn = args.dsn
+        try:
+            if not dsn:
+                postgres = LocalPostgres(os.path.join(workdir, "pg"), args.pg_bin)
+                await asyncio.to_thread(postgres.start)
+                dsn = postgres.dsn
+                await asyncio.to_thread(load_schema, dsn, args.pg_bin)
+
+            with open(SCHEMA_SQL, "rb") as f:
+                schema_id = files.put(f.read())
+            inputs = {
+                "schema_context": files.put(json.dumps(SCHEMA_CONTEXT).encode()),
+                "schema": schema_id,
+                "db_config": files.put(dsn.encode()),
+            }
+            env = {
+                **os.environ,
+                "GENAI_API_BASE_URL": files.url,
+                "GENAI_JWT_TOKEN": "bench",
+                "GOLDEN_SAPPHIRE_DB_URL": dsn,
+                # The suite measures the export paths, not the guard's budgets
+                "GOLDEN_SAPPHIRE_COST_GUARD_MAX_COST": "1e15",
+                "GOLDEN_SAPPHIRE_COST_GUARD_MAX_ROWS": "1e15",
+                "GOLDEN_SAPPHIRE_COST_GUARD_STATEMENT_TIMEOUT": "0",
+                "GOLDEN_SAPPHIRE_METRICS_DIR": "",
+            }
+
+            results = []
+            print(
+                f"{'rows':>10} {'case':<22} {'format':<7} {'runs':>4} {'p50 s':>8} {'p99 s':>8} "
+                f"{'rows/s':>12} {'MiB/s':>7} {'peak MiB':>9} {'base':>6}"
+            )
+            for rows in sizes:
+                started = time.perf_counter()
+                await populate(dsn, rows)
+                csv_path = os.path.join(files.directory, "amf_message.csv")
+                await export_csv_source(dsn, csv_path)
+                print(f"-- loaded {rows:,} rows in {time.perf_counter() - started:.1f}s")
+                for case in cases:
+                    for output_format in CASE_FORMATS[case]:
+                        if formats is not None and output_format not in formats:
+                            continue
+                        size_inputs = {**inputs, "csv": os.path.basename(csv_path)}
+                        result = await run_case(case, output_format, rows, size_inputs, args, env, files)
+                        if result is not None:
+                            results.append(result)
+                            print_result(result)
+                os.remove(csv_path)
+        finally:
+            await files.close()
+            if postgres is not None:
+                await asyncio.to_thread(postgres.stop)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions over {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10k,1m,10m", help="Table sizes to run, e.g. 10k,1m,10m")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case")
+    parser.add_argument("--cases", default=",".join(CASES), help="Paths to run")
+    parser.add_argument("--formats", default="", help="Only these output formats (default: all of each path)")
+    parser.add_argument("--stream", action="store_true", help="Export csv, json and jsonl through the server-side cursor")
+    parser.add_argument("--dsn", default="", help="Existing throwaway database to use instead of a local cluster")
+    parser.add_argument("--pg-bin", default="", help="Directory of initdb, pg_ctl and psql")
+    parser.add_argument("--save", default="", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default="", help="Results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed growth of p50 latency and peak RSS")
+    # Internal: run one case in this process
+    parser.add_argument("--case", choices=list(CASES), help=argparse.SUPPRESS)
+    parser.add_argument("--format", help=argparse.SUPPRESS)
+    parser.add_argument("--inputs", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case_process(args)
+        return
+    unknown = set(args.cases.split(",")) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    sys.exit(asyncio.run(run_suite(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Measures event-loop lag while exports are encoded inline and in the encode pool.
+
+Synthetic amf_delivery batches are fed through ``encode_export`` for
+``--exports`` concurrent exports, as stream_export does after its cursor
+fetches. A probe task sleeps 5 ms in a loop and records how late it wakes
+up: that delay is what every other MCP request and download stream sees.
+Formats outside ``POOLED_FORMATS`` are encoded inline either way (set
+GOLDEN_SAPPHIRE_ENCODE_POOL_FORMATS to compare them). No database is needed.
+
+Usage:
+    python bench_encode_pool.py [--format excel|json|jsonl|csv|parquet] [--rows 100000] [--exports 2] [--workers 4]
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import statistics
+import time
+import uuid
+
+from asyncpg.pgproto.pgproto import UUID
+from asyncpg.types import Attribute, Type
+
+import export_stream
+from encode_pool import EncodePool
+
+
+AMF_DELIVERY = [
+    ("delivery_id", "uuid"),
+    ("time_queued", "timestamptz"),
+    ("message_id", "uuid"),
+    ("file_name", "text"),
+    ("file_path", "text"),
+    ("message_type", "text"),
+    ("next_time", "timestamptz"),
+    ("sender", "text"),
+    ("receiver", "text"),
+    ("status", "text"),
+    ("orig_file", "text"),
+    ("deleted", "bool"),
+    ("locked", "bool"),
+]
+COLUMNS = [Attribute(name, Type(0, type_name, "scalar", "pg_catalog")) for name, type_name in AMF_DELIVERY]
+NAMES = [column.name for column in COLUMNS]
+
+
+class Row(tuple):
+    """Stands in for asyncpg.Record: a tuple with keys() and values()."""
+
+    def keys(self) -> list:
+        return NAMES
+
+    def values(self) -> tuple:
+        return tuple(self)
+
+
+def make_rows(count: int) -> list:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        Row((
+            UUID(uuid.uuid4().bytes), now - datetime.timedelta(seconds=i), UUID(uuid.uuid4().bytes),
+            f"file_{i}.edi", f"/data/outbound/{i % 50}/file_{i}.edi", "850",
+            now + datetime.timedelta(minutes=i % 60), f"SENDER{i % 50}", f"RECEIVER{i % 80}",
+            ("Delivered", "Failed", "Queued")[i % 3], None if i % 4 else f"orig_{i}.edi",
+            i % 7 == 0, False,
+        ))
+        for i in range(count)
+    ]
+
+
+async def probe(lags: list, stop: asyncio.Event, interval: float = 0.005) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def export(output_format: str, rows: list, batch_size: int) -> int:
+    async def batches():
+        for start in range(0, len(rows), batch_size):
+            # Stands in for the cursor round trip
+            await asyncio.sleep(0.001)
+            yield rows[start:start + batch_size]
+
+    return await export_stream.encode_export(batches(), output_format, COLUMNS, io.BytesIO())
+
+
+async def run(pool: EncodePool, output_format: str, rows: list, exports: int, batch_size: int) -> tuple:
+    export_stream.encode_pool = pool
+    lags: list = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(export(output_format, rows, batch_size) for _ in range(exports)))
+    seconds = time.perf_counter() - started
+    stop.set()
+    await probe_task
+    lags.sort()
+    return seconds, statistics.median(lags), lags[int(len(lags) * 0.99)], lags[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", default="excel", choices=["csv", "json", "jsonl", "excel", "parquet", "arrow"])
+    parser.add_argument("--rows", type=int, default=100_000, help="Rows per export")
+    parser.add_argument("--exports", type=int, default=2, help="Concurrent exports")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    print(f"{args.exports} x {args.rows} rows as {args.format}\n")
+    print(f"{'':<16} {'total':>9} {'lag p50':>9} {'lag p99':>9} {'lag max':>9}")
+    for name, workers in (("inline", 0), (f"pool ({args.workers})", args.workers)):
+        pool = EncodePool(workers=workers)
+        pool.start()
+        try:
+            seconds, p50, p99, worst = asyncio.run(run(pool, args.format, rows, args.exports, args.batch_size))
+        finally:
+            pool.close()
+        print(f"{name:<16} {seconds:>8.2f}s {p50 * 1000:>7.1f}ms {p99 * 1000:>7.1f}ms {worst * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import codecs
+import csv
+import re
+from typing import IO, Any, Dict, List, Optional
+
+from encode_pool import encode_pool
+from export_stream import ENCODERS, EXPORT_BATCH_SIZE
+from row_encoder import dumps
+
+
+CSV_JSON_FORMATS = ("json", "jsonl")
+
+_INT_RE = re.compile(r"[+-]?\d+")
+_FLOAT_RE = re.compile(r"[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?")
+
+
+def infer_value(value: str) -> Any:
+    """Converts a CSV cell the way ``pd.read_csv`` would: empty -> None, numbers -> int/float."""
+    if value == "":
+        return None
+    if _INT_RE.fullmatch(value):
+        return int(value)
+    if _FLOAT_RE.fullmatch(value):
+        return float(value)
+    return value
+
+
+def encode_csv_records(header: List[str], records: List[str]) -> List[bytes]:
+    """
+    Parses complete CSV records into one JSON document per row; runs as a pool task.
+
+    Missing trailing fields become None; blank records are skipped.
+    """
+    rows: List[Dict[str, Any]] = []
+    for fields in csv.reader(records):
+        if not fields:
+            continue
+        row = {name: infer_value(value) for name, value in zip(header, fields)}
+        for name in header[len(fields):]:
+            row[name] = None
+        rows.append(row)
+    return [dumps(row) for row in rows]
+
+
+class PreviewWriter:
+    """Pass-through binary writer that remembers the first ``limit`` bytes written."""
+
+    def __init__(self, out: IO[bytes], limit: int = 500) -> None:
+        self._out = out
+        self._limit = limit
+        self._head = bytearray()
+        self.bytes_written = 0
+
+    def write(self, data: bytes) -> int:
+        if len(self._head) < self._limit:
+            self._head.extend(data[:self._limit - len(self._head)])
+        self.bytes_written += len(data)
+        return self._out.write(data)
+
+    @property
+    def preview(self) -> str:
+        return self._head.decode("utf-8", errors="ignore")
+
+
+class CsvToJsonConverter:
+    """
+    Incremental CSV to JSON / JSON Lines converter.
+
+    Bytes are fed in arbitrary chunks; complete records are parsed and encoded
+    as soon as they arrive, so memory holds at most one chunk plus one
+    partial record regardless of file size. A record is complete at a line
+    break outside double quotes, so quoted fields may contain newlines.
+    """
+
+    def __init__(self, out: IO[bytes], output_format: str = "json", preview_limit: int = 500) -> None:
+        if output_format not in CSV_JSON_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.writer = PreviewWriter(out, preview_limit)
+        self._encoder = ENCODERS[output_format](self.writer)
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._pending = ""
+        self._pending_quotes = 0
+        self._header: Optional[List[str]] = None
+        self._batch: List[str] = []
+        self.row_count = 0
+
+    def feed(self, chunk: bytes) -> None:
+        self._write_records(self._split(self._decoder.decode(chunk)))
+
+    async def feed_async(self, chunk: bytes) -> None:
+        """
+        Like :meth:`feed`, but parsing and encoding run in the encode pool.
+
+        Complete records are collected until there are ``EXPORT_BATCH_SIZE``
+        of them and then converted in one pool task.
+        """
+        self._batch.extend(self._split(self._decoder.decode(chunk)))
+        if self._header is None:
+            self._batch = self._take_header(self._batch)
+        if len(self._batch) >= EXPORT_BATCH_SIZE:
+            records, self._batch = self._batch, []
+            lines = await encode_pool.run(encode_csv_records, self._header, records, rows=len(records))
+            self._write_lines(lines)
+
+    def _split(self, text: str, final: bool = False) -> List[str]:
+        records = []
+        start = 0
+        while True:
+            newline = text.find("\n", start)
+            if newline == -1:
+                break
+            line = text[start:newline + 1]
+            start = newline + 1
+            self._pending += line
+            self._pending_quotes += line.count('"')
+            if self._pending_quotes % 2 == 0:
+                records.append(self._pending)
+                self._pending = ""
+                self._pending_quotes = 0
+        tail = text[start:]
+        self._pending += tail
+        self._pending_quotes += tail.count('"')
+        if final and self._pending.strip():
+            records.append(self._pending)
+            self._pending = ""
+        return records
+
+    def _take_header(self, records: List[str]) -> List[str]:
+        # The first non-empty record is the header; returns the records after it
+        for index, fields in enumerate(csv.reader(records)):
+            if fields:
+                self._header = fields
+                return records[index + 1:]
+        return []
+
+    def _write_records(self, records: List[str]) -> None:
+        if self._header is None:
+            records = self._take_header(records)
+        if records:
+            self._write_lines(encode_csv_records(self._header, records))
+
+    def _write_lines(self, lines: List[bytes]) -> None:
+        if lines:
+            self._encoder.write_encoded(lines)
+            self.row_count += len(lines)
+
+    def close(self) -> None:
+        records, self._batch = self._batch, []
+        records.extend(self._split(self._decoder.decode(b"", final=True), final=True))
+        self._write_records(records)
+        self._encoder.close()
+
+    @property
+    def preview(self) -> str:
+        return self.writer.preview
@@ -0,0 +1,174 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Encoding processes; 0 encodes on the event loop as before
+ENCODE_WORKERS = int(os.getenv("GOLDEN_SAPPHIRE_ENCODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Smaller batches are encoded inline: shipping them costs more than encoding them
+ENCODE_POOL_MIN_ROWS = int(os.getenv("GOLDEN_SAPPHIRE_ENCODE_POOL_MIN_ROWS", "1000"))
+
+
+def pack_records(records: Iterable[Any]) -> List[tuple]:
+    """
+    Compact form of a batch for the encoding processes: one tuple of values per row.
+
+    Column names travel once per task instead of once per row, and plain
+    tuples pickle faster than records or dicts.
+    """
+    return [tuple(record.values()) if hasattr(record, "values") else tuple(record) for record in records]
+
+
+class EncodePool:
+    """
+    Process pool for the CPU-bound encoding stages of exports.
+
+    Encoding runs in other processes, so a large export neither stalls the
+    event loop nor competes for its GIL, and concurrent exports use
+    several cores. Tasks are module-level functions taking packed rows
+    (see :func:`pack_records`); batches under ``min_rows`` rows, or all of
+    them when ``workers`` is 0, are encoded inline.
+
+    Workers are forked, so :meth:`start` should run at startup, before the
+    server has started any threads; otherwise the pool starts on first use.
+    """
+
+    def __init__(self, workers: int = ENCODE_WORKERS, min_rows: int = ENCODE_POOL_MIN_ROWS) -> None:
+        self.workers = workers
+        self.min_rows = min_rows
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.offloaded = 0
+        self.inline = 0
+        self.restarts = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def offloads(self, rows: int) -> bool:
+        return self.enabled and rows >= self.min_rows
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"),
+            )
+        return self._executor
+
+    def start(self) -> None:
+        """Forks the workers now (a fork-context pool starts all of them on its first task)."""
+        if self.enabled:
+            self._get_executor().submit(int).result()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, rows: int = 0) -> asyncio.Future:
+        """
+        Schedules ``fn(*args)`` and returns a future for its result.
+
+        Args:
+            fn: Module-level function; it and its arguments must pickle.
+            *args: Arguments, with rows packed by :func:`pack_records`.
+            rows: Rows in the task, to decide whether it is worth offloading.
+
+        Returns:
+            asyncio.Future: Resolves to the return value of ``fn``.
+        """
+        loop = asyncio.get_running_loop()
+        if not self.offloads(rows):
+            self.inline += 1
+            future = loop.create_future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        self.offloaded += 1
+        try:
+            future = loop.run_in_executor(self._get_executor(), fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); replace the pool and retry once
+            self.restarts += 1
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            future = loop.run_in_executor(self._get_executor(), fn, *args)
+        return future
+
+    async def run(self, fn: Callable[..., Any], *args: Any, rows: int = 0) -> Any:
+        started = time.perf_counter()
+        try:
+            return await self.submit(fn, *args, rows=rows)
+        finally:
+            self.wait_seconds += time.perf_counter() - started
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "min_rows": self.min_rows,
+            "offloaded": self.offloaded,
+            "inline": self.inline,
+            "restarts": self.restarts,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+encode_pool = EncodePool()
+
+
+async def encode_batches(
+    pool: EncodePool,
+    batches: AsyncIterable[Sequence[Any]],
+    encode_task: Callable[[List[tuple]], Tuple[Callable[..., Any], tuple]],
+    write_encoded: Callable[[Any], None],
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Encodes record batches in the pool while the next one is being fetched.
+
+    Args:
+        pool: Pool to encode in.
+        batches: Record batches, e.g. from a server-side cursor.
+        encode_task: Returns ``(fn, args)`` for a packed batch; called in batch order.
+        write_encoded: Writes the result of a task; results are written in batch order.
+        progress: Called with the number of rows in each batch once it is written.
+
+    Returns:
+        int: Number of rows written.
+    """
+    row_count = 0
+    # (future, rows) of the batch being encoded while the next one is read
+    pending: Optional[Tuple[asyncio.Future, int]] = None
+
+    async def write_pending() -> None:
+        nonlocal row_count
+        future, rows = pending
+        started = time.perf_counter()
+        write_encoded(await future)
+        pool.wait_seconds += time.perf_counter() - started
+        row_count += rows
+        if progress is not None:
+            progress(rows)
+
+    try:
+        async for batch in batches:
+            fn, args = encode_task(pack_records(batch))
+            future = pool.submit(fn, *args, rows=len(batch))
+            if pending is not None:
+                await write_pending()
+            pending = (future, len(batch))
+        if pending is not None:
+            await write_pending()
+    finally:
+        if pending is not None and not pending[0].done():
+            pending[0].cancel()
+    return row_count
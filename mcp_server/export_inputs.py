@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict
+
+from cache import SingleFlight, TTLCache
+
+
+INPUT_FILE_CACHE_TTL = float(os.getenv("GOLDEN_SAPPHIRE_INPUT_FILE_CACHE_TTL", "3600"))
+INPUT_FILE_CACHE_MAX_ENTRIES = int(os.getenv("GOLDEN_SAPPHIRE_INPUT_FILE_CACHE_MAX_ENTRIES", "256"))
+INPUT_FILE_CACHE_MAX_BYTES = int(os.getenv("GOLDEN_SAPPHIRE_INPUT_FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def parse_db_config(db_config_text: str) -> Any:
+    """Parses a DB config file: a JSON object, or a plain connection string."""
+    db_config_text = db_config_text.strip()
+    return json.loads(db_config_text) if db_config_text.startswith("{") else db_config_text
+
+
+@dataclass(frozen=True)
+class CachedFile:
+    text: str
+    parsed: Any
+
+
+@dataclass(frozen=True)
+class ExportInputs:
+    """Schema, schema context and DB config for one export, in raw and parsed form."""
+    context_text: str
+    schema_text: str
+    db_config_text: str
+    schema_context: Dict[str, Any]
+    db_config: Any
+
+
+# Uploaded file IDs are immutable, so entries only leave the cache through
+# TTL or the memory budget. Entries are keyed by (kind, file_id) because the
+# parsed form depends on how the file is used.
+input_files = TTLCache(
+    maxsize=INPUT_FILE_CACHE_MAX_ENTRIES,
+    ttl=INPUT_FILE_CACHE_TTL,
+    max_weight=INPUT_FILE_CACHE_MAX_BYTES,
+    weigher=lambda cached: len(cached.text),
+)
+_single_flight = SingleFlight()
+
+
+async def _get_file(fm, file_id: str, kind: str, parse: Callable[[str], Any]) -> CachedFile:
+    key = (kind, file_id)
+    cached = input_files.get(key)
+    if cached is not None:
+        return cached
+
+    async def _fetch() -> CachedFile:
+        stream = await fm.get_by_id(file_id)
+        text = stream.read().decode("utf-8")
+        loaded = CachedFile(text=text, parsed=parse(text))
+        input_files.set(key, loaded)
+        return loaded
+
+    return await _single_flight.do(key, _fetch)
+
+
+async def load_export_inputs(fm, schema_context_file_id: str, schema_file_id: str, db_config_file_id: str) -> ExportInputs:
+    """
+    Fetches the schema context, schema and DB config files concurrently.
+
+    Files already seen are served from the in-process cache along with their
+    parsed forms, so repeat exports skip the file service entirely.
+
+    Args:
+        fm: FileManager used for cache misses.
+        schema_context_file_id: File ID of the schema context JSON.
+        schema_file_id: File ID of the raw schema definition.
+        db_config_file_id: File ID of the DB config.
+
+    Returns:
+        ExportInputs: Raw texts plus the parsed context dict and DB config.
+    """
+    context_file, schema_file, db_config_file = await asyncio.gather(
+        _get_file(fm, schema_context_file_id, "schema_context", json.loads),
+        _get_file(fm, schema_file_id, "schema", lambda text: None),
+        _get_file(fm, db_config_file_id, "db_config", parse_db_config),
+    )
+    return ExportInputs(
+        context_text=context_file.text,
+        schema_text=schema_file.text,
+        db_config_text=db_config_file.text,
+        schema_context=context_file.parsed,
+        db_config=db_config_file.parsed,
+    )
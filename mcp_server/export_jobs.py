@@ -0,0 +1,231 @@
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+# Exports that run at the same time; the rest wait in the queue
+EXPORT_JOB_WORKERS = int(os.getenv("GOLDEN_SAPPHIRE_EXPORT_JOB_WORKERS", "4"))
+EXPORT_JOB_MAX_QUEUED = int(os.getenv("GOLDEN_SAPPHIRE_EXPORT_JOB_MAX_QUEUED", "100"))
+# Seconds a finished job can still be polled
+EXPORT_JOB_RETENTION = float(os.getenv("GOLDEN_SAPPHIRE_EXPORT_JOB_RETENTION", "3600"))
+
+# Pipeline stages in the order a job goes through them
+JOB_STAGES = ("queued", "loading_inputs", "generating_sql", "querying", "packaging", "uploading", "done")
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its limit."""
+
+
+@dataclass
+class ExportJob:
+    """
+    State of one export, updated by the pipeline as it goes.
+
+    ``status`` is one of queued, running, succeeded, failed or cancelled;
+    ``stage`` is one of ``JOB_STAGES``. Row counts come from streamed
+    exports, byte counts from COPY exports.
+    """
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"
+    stage: str = "queued"
+    rows_written: int = 0
+    bytes_written: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def set_stage(self, stage: str) -> None:
+        self.stage = stage
+
+    def add_rows(self, count: int) -> None:
+        self.rows_written += count
+
+    def add_bytes(self, count: int) -> None:
+        self.bytes_written += count
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        status = {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "rows_written": self.rows_written,
+            "bytes_written": self.bytes_written,
+            "queued_seconds": round((self.started_at or end) - self.created_at, 3),
+            "elapsed_seconds": round(end - self.started_at, 3) if self.started_at else 0.0,
+        }
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+JobRunner = Callable[[ExportJob], Awaitable[Dict[str, Any]]]
+
+
+class JobQueue:
+    """
+    Runs submitted jobs on a fixed number of worker tasks.
+
+    At most ``workers`` jobs run at once and at most ``max_queued`` wait;
+    ``submit`` fails fast beyond that instead of growing the backlog. A job
+    is cancelled by cancelling its task, so the database query and upload
+    stop with it. Finished jobs are kept for ``retention`` seconds.
+    """
+
+    def __init__(
+        self,
+        workers: int = EXPORT_JOB_WORKERS,
+        max_queued: int = EXPORT_JOB_MAX_QUEUED,
+        retention: float = EXPORT_JOB_RETENTION,
+    ) -> None:
+        self.workers = workers
+        self.retention = retention
+        self._queue: Optional[asyncio.Queue] = None
+        self._max_queued = max_queued
+        self._workers: List[asyncio.Task] = []
+        self._jobs: Dict[str, ExportJob] = {}
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def _start(self) -> None:
+        # Created lazily: the queue and workers need the server's running loop
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._max_queued)
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def submit(self, run: JobRunner) -> ExportJob:
+        """
+        Queues ``run`` and returns its job right away.
+
+        Args:
+            run: Coroutine function taking the job; its dict result is stored on the job.
+
+        Returns:
+            ExportJob: The queued job.
+
+        Raises:
+            JobQueueFull: If ``max_queued`` jobs are already waiting.
+        """
+        self._start()
+        self._prune()
+        job = ExportJob()
+        try:
+            self._queue.put_nowait((job, run))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFull(f"{self._queue.qsize()} export jobs are already queued; try again later")
+        self._jobs[job.id] = job
+        self.submitted += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        self._prune()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[ExportJob]:
+        """Cancels a queued or running job; finished jobs are returned unchanged."""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job.task is None:
+            # Still queued: the worker skips it when it comes up
+            self._finish(job, "cancelled")
+        else:
+            job.task.cancel()
+        return job
+
+    def _finish(self, job: ExportJob, status: str, error: Optional[str] = None) -> None:
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        if status == "succeeded":
+            job.stage = "done"
+            self.succeeded += 1
+        elif status == "failed":
+            self.failed += 1
+        else:
+            self.cancelled += 1
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _settle(self, job: ExportJob, task: asyncio.Task) -> None:
+        # Done callback of the job task: it runs before anyone awaiting the
+        # task resumes, so they all see the final status
+        if job.finished:
+            return
+        if task.cancelled():
+            self._finish(job, "cancelled")
+        elif task.exception() is not None:
+            error = task.exception()
+            print(f"Export job {job.id} failed: {error!r}")
+            self._finish(job, "failed", str(error) or type(error).__name__)
+        else:
+            job.result = task.result()
+            if "error" in job.result:
+                self._finish(job, "failed", str(job.result.get("message") or job.result["error"]))
+            else:
+                self._finish(job, "succeeded")
+
+    async def _work(self) -> None:
+        while True:
+            job, run = await self._queue.get()
+            try:
+                if job.finished:
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+                job.task = asyncio.create_task(run(job))
+                job.task.add_done_callback(lambda task, job=job: self._settle(job, task))
+                try:
+                    # wait() does not raise when the job task is cancelled, only
+                    # when this worker is
+                    await asyncio.wait({job.task})
+                except asyncio.CancelledError:
+                    self._finish(job, "cancelled", "Server shutting down")
+                    job.task.cancel()
+                    raise
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        running = sum(1 for job in self._jobs.values() if job.status == "running")
+        return {
+            "workers": self.workers,
+            "running": running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queued": self._max_queued,
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+        }
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+export_jobs = JobQueue()
@@ -0,0 +1,489 @@
+import asyncio
+import csv
+import functools
+import io
+import json
+import mimetypes
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import IO, Any, AsyncIterator, Callable, Iterable, List, Optional, Sequence, Tuple
+
+import aiohttp
+import asyncpg
+import pandas as pd
+
+from arrow_export import COLUMNAR_FORMATS, ArrowBatchEncoder
+from cost_guard import apply_cost_guard
+from encode_pool import encode_batches, encode_pool, pack_records
+from excel_export import ExcelBatchEncoder, write_excel_spool
+from metrics import STAGE_SECONDS
+from pg_pool import prepare_cached
+from replica_router import replica_router
+from sql_params import parameterizer
+from row_encoder import JSON_BACKEND, RowEncoder, dumps, json_default
+
+
+EXPORT_BATCH_SIZE = int(os.getenv("GOLDEN_SAPPHIRE_EXPORT_BATCH_SIZE", "5000"))
+# Exports smaller than this stay in memory; larger ones spill to a temp file
+EXPORT_SPOOL_MAX_SIZE = int(os.getenv("GOLDEN_SAPPHIRE_EXPORT_SPOOL_MAX_SIZE", str(16 * 1024 * 1024)))
+STREAMING_FORMATS = ("csv", "json", "jsonl", "excel") + COLUMNAR_FORMATS
+JSON_FORMATS = ("json", "jsonl")
+# Formats whose writers are built for row-by-row output; these always stream
+ALWAYS_STREAMED_FORMATS = ("excel",) + COLUMNAR_FORMATS
+# Streamed formats encoded in the encode pool. Shipping a batch to a worker
+# costs about as much as encoding it with orjson or pyarrow, so those stay inline
+POOLED_FORMATS = tuple(os.getenv(
+    "GOLDEN_SAPPHIRE_ENCODE_POOL_FORMATS", "csv,excel" if JSON_BACKEND == "orjson" else "csv,excel,json,jsonl"
+).split(","))
+# CSV exports are produced by Postgres itself with COPY ... TO STDOUT
+CSV_COPY_EXPORT = os.getenv("GOLDEN_SAPPHIRE_CSV_COPY_EXPORT", "true").lower() in ("1", "true", "yes")
+
+
+def encode_csv_rows(rows: Iterable[Sequence[Any]], header: Optional[Sequence[str]] = None) -> bytes:
+    """Encodes rows of values (and an optional header line) as UTF-8 CSV; None becomes an empty field."""
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator="\n")
+    if header is not None:
+        writer.writerow(header)
+    writer.writerows(["" if v is None else v for v in row] for row in rows)
+    return text.getvalue().encode("utf-8")
+
+
+class CsvBatchEncoder:
+    """Writes record batches as CSV with a header from ``columns`` or the first batch."""
+
+    def __init__(self, out: IO[bytes], columns: Optional[Sequence[str]] = None) -> None:
+        self._out = out
+        self._columns = list(columns) if columns is not None else None
+        self._header_written = False
+
+    def encode_task(self, rows: List[tuple]) -> Tuple[Callable[..., bytes], tuple]:
+        header = None
+        if not self._header_written:
+            header = self._columns
+            self._header_written = True
+        return encode_csv_rows, (rows, header)
+
+    def write_encoded(self, data: bytes) -> None:
+        self._out.write(data)
+
+    def write_batch(self, records: Sequence[asyncpg.Record]) -> None:
+        if not records:
+            return
+        if self._columns is None:
+            self._columns = list(records[0].keys())
+        fn, args = self.encode_task([record.values() for record in records])
+        self.write_encoded(fn(*args))
+
+    def close(self) -> None:
+        if not self._header_written and self._columns is not None:
+            self._out.write(encode_csv_rows([], self._columns))
+
+
+def _encode_lines(records: Iterable[Any], row_encoder: Optional[RowEncoder]) -> list[bytes]:
+    rows = row_encoder.encode(records) if row_encoder is not None else [dict(record) for record in records]
+    return [dumps(row) for row in rows]
+
+
+@functools.lru_cache(maxsize=64)
+def _row_encoder_for(columns: Tuple[asyncpg.Attribute, ...], backend: Optional[str]) -> RowEncoder:
+    return RowEncoder(columns, backend)
+
+
+def encode_json_rows(columns: Tuple[asyncpg.Attribute, ...], rows: List[tuple], backend: Optional[str]) -> list[bytes]:
+    """Pool task: one JSON document per row, converted for the result column types."""
+    return _encode_lines(rows, _row_encoder_for(columns, backend))
+
+
+class _JsonBatchEncoder:
+    def __init__(self, out: IO[bytes], row_encoder: Optional[RowEncoder] = None) -> None:
+        self._out = out
+        self._row_encoder = row_encoder
+
+    def encode_task(self, rows: List[tuple]) -> Tuple[Callable[..., list], tuple]:
+        if self._row_encoder is None:
+            raise ValueError("Encoding packed rows needs a RowEncoder for the result columns")
+        return encode_json_rows, (self._row_encoder.columns, rows, self._row_encoder.backend)
+
+    def write_batch(self, records: Iterable[asyncpg.Record]) -> None:
+        self.write_encoded(_encode_lines(records, self._row_encoder))
+
+
+class JsonLinesBatchEncoder(_JsonBatchEncoder):
+    """
+    Writes one JSON object per line.
+
+    With a ``row_encoder`` built for the query, values are converted per
+    column; without one (plain dicts) non-JSON values fall back to ``json_default``.
+    """
+
+    def write_encoded(self, lines: list[bytes]) -> None:
+        if lines:
+            self._out.write(b"\n".join(lines) + b"\n")
+
+    def close(self) -> None:
+        pass
+
+
+class JsonArrayBatchEncoder(_JsonBatchEncoder):
+    """Writes a single JSON array incrementally, one row per line."""
+
+    def __init__(self, out: IO[bytes], row_encoder: Optional[RowEncoder] = None) -> None:
+        super().__init__(out, row_encoder)
+        self._out.write(b"[")
+        self._first = True
+
+    def write_encoded(self, lines: list[bytes]) -> None:
+        if not lines:
+            return
+        prefix = b"\n" if self._first else b",\n"
+        self._out.write(prefix + b",\n".join(lines))
+        self._first = False
+
+    def close(self) -> None:
+        self._out.write(b"\n]" if not self._first else b"]")
+
+
+def encode_frame(columns: List[str], rows: List[tuple], output_format: str) -> bytes:
+    """
+    Encodes a whole buffered result with pandas; runs as a pool task.
+
+    Args:
+        columns: Column names.
+        rows: Rows of values, packed by ``pack_records``.
+        output_format: One of 'csv', 'json', 'jsonl', 'excel'.
+
+    Returns:
+        bytes: The encoded export.
+    """
+    buffer = io.BytesIO()
+    if output_format == "excel":
+        encoder = ExcelBatchEncoder(buffer, columns)
+        encoder.write_rows(rows)
+        encoder.close()
+        return buffer.getvalue()
+
+    df = pd.DataFrame(rows, columns=columns)
+    if output_format == "csv":
+        df.to_csv(buffer, index=False)
+    elif output_format == "json":
+        buffer.write(json.dumps(df.to_dict(orient="records"), indent=4, default=json_default).encode("utf-8"))
+    elif output_format == "jsonl":
+        df.to_json(buffer, orient="records", lines=True, date_format="iso", default_handler=json_default)
+    else:
+        raise ValueError(f"Unsupported format: {output_format}")
+    return buffer.getvalue()
+
+
+ENCODERS = {
+    "csv": CsvBatchEncoder,
+    "json": JsonArrayBatchEncoder,
+    "jsonl": JsonLinesBatchEncoder,
+    "excel": ExcelBatchEncoder,
+}
+
+
+async def iter_query_batches(
+    conn: asyncpg.Connection,
+    sql: str,
+    arguments: Optional[dict] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> AsyncIterator[list[asyncpg.Record]]:
+    """
+    Reads a query through a server-side cursor, ``batch_size`` rows at a time.
+
+    Args:
+        conn: Connection to run the query on.
+        sql: The SQL query to execute.
+        arguments: Optional query parameters.
+        batch_size: Number of rows fetched per round trip.
+
+    Yields:
+        list[asyncpg.Record]: The next batch of rows.
+    """
+    # Cursors only live inside a transaction; exports never write
+    async with conn.transaction(readonly=True):
+        stmt = await prepare_cached(conn, sql)
+        cursor = await stmt.cursor(*tuple(arguments.values()) if arguments else ())
+        while True:
+            batch = await cursor.fetch(batch_size)
+            if not batch:
+                break
+            yield batch
+
+
+@asynccontextmanager
+async def open_query_batches(
+    db_url: Any,
+    sql: str,
+    arguments: Optional[dict] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    max_lag: Optional[float] = None,
+) -> AsyncIterator[Tuple[Sequence[asyncpg.Attribute], AsyncIterator[list[asyncpg.Record]]]]:
+    """
+    Prepares an export query on a pooled connection and yields its columns and batches.
+
+    The query is parameterized and checked by the cost guard first. The
+    connection is held until the block exits.
+
+    Usage:
+        async with open_query_batches(db_url, sql) as (columns, batches):
+            async for batch in batches:
+                ...
+    """
+    async with replica_router.acquire(db_url, sql, max_lag) as conn:
+        query = await parameterizer.prepare(conn, sql, arguments)
+        sql = (await apply_cost_guard(conn, query.sql, query.arguments)).sql
+        # The prepared statement is cached, so the cursor reuses it
+        stmt = query.statement if sql == query.sql else await prepare_cached(conn, sql)
+        yield stmt.get_attributes(), iter_query_batches(conn, sql, query.arguments, batch_size)
+
+
+async def stream_export(
+    db_url: Any,
+    sql: str,
+    output_format: str,
+    out: IO[bytes],
+    arguments: Optional[dict] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    progress: Optional[Callable[[int], None]] = None,
+    max_lag: Optional[float] = None,
+) -> int:
+    """
+    Executes SQL and encodes the result into ``out`` batch by batch.
+
+    Args:
+        db_url: Database connection string or parsed DB config.
+        sql: Generated SQL query.
+        output_format: One of 'csv', 'json', 'jsonl', 'excel', 'parquet', 'arrow'.
+        out: Binary file object the export is written to.
+        arguments: Optional query parameters.
+        batch_size: Rows held in memory at a time.
+        progress: Called with the number of rows in each batch once it is written.
+        max_lag: Replication lag acceptable if a replica serves the query.
+
+    Returns:
+        int: Number of rows written.
+    """
+    if output_format not in STREAMING_FORMATS:
+        raise ValueError(f"Unsupported streaming format: {output_format}")
+
+    fetch_seconds = [0.0]
+    async with open_query_batches(db_url, sql, arguments, batch_size, max_lag) as (columns, batches):
+        started = time.perf_counter()
+        # Headers, JSON converters and columnar schemas come from the result columns
+        row_count = await encode_export(_timed_batches(batches, fetch_seconds), output_format, columns, out, progress)
+    # Time not spent waiting for Postgres went to encoding and writing
+    STAGE_SECONDS.observe(fetch_seconds[0], operation="export", stage="query")
+    STAGE_SECONDS.observe(time.perf_counter() - started - fetch_seconds[0], operation="export", stage="encode")
+    return row_count
+
+
+async def _timed_batches(batches: AsyncIterator[list], elapsed: List[float]) -> AsyncIterator[list]:
+    # Adds the time spent waiting for each batch to elapsed[0]
+    while True:
+        started = time.perf_counter()
+        try:
+            batch = await batches.__anext__()
+        except StopAsyncIteration:
+            elapsed[0] += time.perf_counter() - started
+            return
+        elapsed[0] += time.perf_counter() - started
+        yield batch
+
+
+async def encode_export(
+    batches: AsyncIterator[Sequence[asyncpg.Record]],
+    output_format: str,
+    columns: Sequence[asyncpg.Attribute],
+    out: IO[bytes],
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Encodes record batches into ``out``, in the encode pool for ``POOLED_FORMATS``.
+
+    Args:
+        batches: Record batches of the query, e.g. from ``iter_query_batches``.
+        output_format: One of 'csv', 'json', 'jsonl', 'excel', 'parquet', 'arrow'.
+        columns: Result column attributes.
+        out: Binary file object the export is written to.
+        progress: Called with the number of rows in each batch once it is written.
+
+    Returns:
+        int: Number of rows written.
+    """
+    names = [column.name for column in columns]
+    pooled = encode_pool.enabled and output_format in POOLED_FORMATS
+    if output_format == "excel" and pooled:
+        return await _spooled_excel_export(batches, names, out, progress)
+
+    if output_format in COLUMNAR_FORMATS:
+        encoder = ArrowBatchEncoder(out, output_format, columns)
+    elif output_format in JSON_FORMATS:
+        encoder = ENCODERS[output_format](out, RowEncoder(columns, JSON_BACKEND))
+    else:
+        encoder = ENCODERS[output_format](out, names)
+    if pooled:
+        # Batches are encoded in worker processes while the next one is fetched
+        row_count = await encode_batches(encode_pool, batches, encoder.encode_task, encoder.write_encoded, progress)
+    else:
+        row_count = 0
+        async for batch in batches:
+            encoder.write_batch(batch)
+            row_count += len(batch)
+            if progress is not None:
+                progress(len(batch))
+    encoder.close()
+    out.seek(0)
+    return row_count
+
+
+async def _spooled_excel_export(
+    batches: AsyncIterator[list[asyncpg.Record]],
+    columns: List[str],
+    out: IO[bytes],
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    # A workbook cannot be split across processes: batches are pickled to a
+    # spool as they arrive and one pool task writes the whole .xlsx from it
+    with tempfile.NamedTemporaryFile(suffix=".spool") as spool, tempfile.NamedTemporaryFile(suffix=".xlsx") as xlsx:
+        row_count = await spool_batches(batches, spool, progress)
+        await encode_pool.run(write_excel_spool, spool.name, xlsx.name, columns, rows=row_count)
+        await asyncio.to_thread(shutil.copyfileobj, xlsx, out)
+    out.seek(0)
+    return row_count
+
+
+async def spool_batches(
+    batches: AsyncIterator[Sequence[asyncpg.Record]],
+    spool: IO[bytes],
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Pickles record batches to ``spool`` as packed value tuples, for :func:`excel_export.write_excel_spool`.
+
+    Returns:
+        int: Number of rows spooled.
+    """
+    row_count = 0
+    async for batch in batches:
+        pickle.dump(pack_records(batch), spool, protocol=pickle.HIGHEST_PROTOCOL)
+        row_count += len(batch)
+        if progress is not None:
+            progress(len(batch))
+    spool.flush()
+    return row_count
+
+
+async def spool_query(
+    db_url: Any,
+    sql: str,
+    spool: IO[bytes],
+    progress: Optional[Callable[[int], None]] = None,
+    max_lag: Optional[float] = None,
+) -> Tuple[List[str], int]:
+    """
+    Runs an export query and pickles its rows to ``spool``, see :func:`spool_batches`.
+
+    Returns:
+        Tuple[List[str], int]: Column names and number of rows spooled.
+    """
+    with STAGE_SECONDS.time(operation="export", stage="query"):
+        async with open_query_batches(db_url, sql, max_lag=max_lag) as (columns, batches):
+            row_count = await spool_batches(batches, spool, progress)
+    return [column.name for column in columns], row_count
+
+
+async def copy_csv_export(
+    db_url: Any,
+    sql: str,
+    out: IO[bytes],
+    arguments: Optional[dict] = None,
+    progress: Optional[Callable[[int], None]] = None,
+    max_lag: Optional[float] = None,
+) -> int:
+    """
+    Exports a query as CSV with ``COPY (query) TO STDOUT WITH CSV HEADER``.
+
+    Postgres encodes the rows and the CSV bytes are written to ``out`` as they
+    arrive, so no value is ever decoded into a Python object. Values use the
+    Postgres text format (``t``/``f`` booleans, ``+00`` offsets, JSON as JSON).
+
+    Args:
+        db_url: Database connection string or parsed DB config.
+        sql: Generated SQL query.
+        out: Binary file object the export is written to.
+        arguments: Optional query parameters.
+        progress: Called with the number of bytes in each chunk Postgres sends;
+            rows are only counted once the COPY has finished.
+        max_lag: Replication lag acceptable if a replica serves the query.
+
+    Returns:
+        int: Number of rows written.
+    """
+    # COPY takes a bare query: no trailing semicolon, and a newline so a
+    # trailing line comment cannot swallow the closing parenthesis
+    query = sql.strip().rstrip(";").rstrip()
+
+    async def write(data: bytes) -> None:
+        out.write(data)
+        if progress is not None:
+            progress(len(data))
+
+    with STAGE_SECONDS.time(operation="export", stage="query"):
+        async with replica_router.acquire(db_url, query, max_lag) as conn:
+            query = (await apply_cost_guard(conn, query, arguments)).sql + "\n"
+            async with conn.transaction(readonly=True):
+                status = await conn.copy_from_query(
+                    query,
+                    *tuple(arguments.values()) if arguments else (),
+                    output=write,
+                    format="csv",
+                    header=True,
+                )
+    out.seek(0)
+    # Status is "COPY <rows>"
+    return int(status.split()[-1])
+
+
+def spooled_export_file() -> IO[bytes]:
+    """Temp file that stays in memory for small exports and spills to disk for large ones."""
+    return tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE, mode="w+b")
+
+
+async def upload_export(fm, fileobj: IO[bytes], filename: str) -> str:
+    """
+    Uploads a file object to the file service without reading it into memory.
+
+    ``FileManager.save`` only accepts ``bytes``; this sends the same multipart
+    request but lets aiohttp stream the body from ``fileobj``.
+
+    Args:
+        fm: FileManager holding the file service URL, session and credentials.
+        fileobj: Binary file object positioned at the start of the export.
+        filename: Name of the file to upload.
+
+    Returns:
+        str: ID of the uploaded file.
+    """
+    mime_type = mimetypes.guess_type(url=filename)[0]
+    data = aiohttp.FormData()
+    data.add_field(
+        "file",
+        fileobj,
+        filename=filename,
+        content_type=mime_type or "application/octet-stream",
+    )
+    data.add_field("request_id", fm.request_id)
+    data.add_field("session_id", fm.session_id)
+
+    headers = {"Authorization": f"Bearer {fm.jwt_token}"}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async with session.post(f"{fm.file_service_url}/files", data=data) as resp:
+            resp.raise_for_status()
+            json_resp = await resp.json()
+            return json_resp.get("id")
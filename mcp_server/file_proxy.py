@@ -0,0 +1,366 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import IO, Any, AsyncIterator, Dict, Mapping, Optional, Tuple
+
+import aiohttp
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from cache import CACHE_DIR, SingleFlight
+
+
+FILE_PROXY_CACHE_DIR = os.getenv("GOLDEN_SAPPHIRE_FILE_PROXY_CACHE_DIR", os.path.join(CACHE_DIR, "downloads"))
+FILE_PROXY_CACHE_MAX_BYTES = int(os.getenv("GOLDEN_SAPPHIRE_FILE_PROXY_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Larger files are streamed straight through and never cached
+FILE_PROXY_CACHE_MAX_FILE_SIZE = int(os.getenv("GOLDEN_SAPPHIRE_FILE_PROXY_CACHE_MAX_FILE_SIZE", str(512 * 1024 ** 2)))
+FILE_PROXY_MAX_CONNECTIONS = int(os.getenv("GOLDEN_SAPPHIRE_FILE_PROXY_MAX_CONNECTIONS", "32"))
+FILE_PROXY_CHUNK_SIZE = 64 * 1024
+
+_FILE_ID = re.compile(r"[A-Za-z0-9_.-]+")
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single-range ``Range`` header into inclusive byte offsets.
+
+    Returns None when there is no usable range (absent, malformed or
+    multi-range), in which case the whole file is served.
+
+    Raises:
+        RangeNotSatisfiable: If the range lies outside the file.
+    """
+    match = _RANGE.fullmatch(header.strip()) if header else None
+    if match is None or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+    else:
+        # Suffix range: the last N bytes
+        suffix = int(match.group(2))
+        if suffix == 0:
+            raise RangeNotSatisfiable()
+        start, end = max(0, size - suffix), size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+@dataclass
+class CachedFile:
+    file_id: str
+    size: int
+    etag: str
+    content_type: str
+    content_disposition: str
+
+
+class FileProxy:
+    """
+    Download proxy in front of the file service.
+
+    Upstream requests share one pooled ``aiohttp`` session. Files up to
+    ``max_file_size`` are kept in a local disk cache, bounded to
+    ``max_bytes`` with least recently served files evicted first; exports are
+    immutable once uploaded, so cached copies never need revalidation. Cached
+    files are served with ``ETag`` and ``Accept-Ranges``, so repeat downloads
+    can get a 304 and interrupted ones resume with a ``Range`` request, both
+    without going back to the file service. On a miss the file is fetched
+    into the cache once (concurrent requests share the fetch) and then served.
+    """
+
+    def __init__(
+        self,
+        api_base_url: str,
+        jwt_token: Optional[str],
+        directory: str = FILE_PROXY_CACHE_DIR,
+        max_bytes: int = FILE_PROXY_CACHE_MAX_BYTES,
+        max_file_size: int = FILE_PROXY_CACHE_MAX_FILE_SIZE,
+        max_connections: int = FILE_PROXY_MAX_CONNECTIONS,
+    ) -> None:
+        self.api_base_url = api_base_url
+        self.jwt_token = jwt_token
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._index: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self._bytes = 0
+        self._fills = SingleFlight()
+        # Files known to be over max_file_size go straight to pass-through
+        self._too_large: set = set()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.bytes_from_cache = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, file_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{file_id}{suffix}")
+
+    def _load_index(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    entry = CachedFile(**json.load(f))
+                mtime = os.path.getmtime(self._path(entry.file_id, ".bin"))
+            except (OSError, ValueError, TypeError):
+                continue
+            entries.append((mtime, entry))
+        # Oldest first, so LRU eviction order survives restarts
+        for _, entry in sorted(entries, key=lambda item: item[0]):
+            self._index[entry.file_id] = entry
+            self._bytes += entry.size
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"Authorization": f"Bearer {self.jwt_token}"},
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+            )
+        return self._session
+
+    def _remove(self, file_id: str) -> None:
+        entry = self._index.pop(file_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        for suffix in (".json", ".bin"):
+            try:
+                os.remove(self._path(file_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _store(self, entry: CachedFile, tmp_path: str) -> None:
+        os.replace(tmp_path, self._path(entry.file_id, ".bin"))
+        with open(self._path(entry.file_id, ".json"), "w") as f:
+            json.dump(asdict(entry), f)
+        previous = self._index.pop(entry.file_id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        self._index[entry.file_id] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            oldest = next(iter(self._index))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _entry_from_response(self, file_id: str, resp: aiohttp.ClientResponse, size: int, digest: str) -> CachedFile:
+        return CachedFile(
+            file_id=file_id,
+            size=size,
+            etag=resp.headers.get("etag") or f'"{digest[:32]}"',
+            content_type=resp.headers.get("content-type", "application/octet-stream"),
+            content_disposition=resp.headers.get("content-disposition", f'attachment; filename="{file_id}"'),
+        )
+
+    async def _fill(self, file_id: str) -> Optional[CachedFile]:
+        """Downloads a file into the cache; returns None if it is too large to cache."""
+        tmp_path = self._path(file_id, f".{os.getpid()}.{time.monotonic_ns()}.part")
+        digest = hashlib.sha256()
+        size = 0
+        async with self._get_session().get(f"{self.api_base_url}/files/{file_id}") as resp:
+            resp.raise_for_status()
+            if resp.content_length is not None and resp.content_length > self.max_file_size:
+                return None
+            try:
+                with open(tmp_path, "wb") as f:
+                    async for chunk in resp.content.iter_chunked(FILE_PROXY_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_file_size:
+                            return None
+                        digest.update(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+                entry = self._entry_from_response(file_id, resp, size, digest.hexdigest())
+                self._store(entry, tmp_path)
+                return entry
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _headers(self, entry: CachedFile) -> Dict[str, str]:
+        return {
+            "ETag": entry.etag,
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": entry.content_disposition,
+            "Cache-Control": "private, max-age=600",
+        }
+
+    def _serve_cached(self, entry: CachedFile, request_headers: Mapping[str, str]) -> Optional[Response]:
+        """Serves a cached file; returns None if it was evicted meanwhile."""
+        # Opened before anything else: once open, the file stays readable even
+        # if an eviction unlinks it while the response is streamed
+        try:
+            f = open(self._path(entry.file_id, ".bin"), "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            response = self._cached_response(entry, f, request_headers)
+        except BaseException:
+            f.close()
+            raise
+        if not isinstance(response, StreamingResponse):
+            f.close()
+        return response
+
+    def _cached_response(self, entry: CachedFile, f: IO[bytes], request_headers: Mapping[str, str]) -> Response:
+        headers = self._headers(entry)
+        if etag_matches(request_headers.get("if-none-match"), entry.etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if if_range and if_range.strip() != entry.etag:
+            # The client's partial copy is of a different version; send it all
+            range_header = None
+        try:
+            byte_range = parse_range(range_header, entry.size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{entry.size}"})
+
+        status = 200
+        start, end = 0, entry.size - 1
+        if byte_range is not None:
+            status = 206
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{entry.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        self.bytes_from_cache += end - start + 1
+        os.utime(f.fileno())
+        return StreamingResponse(
+            self._read(f, start, end),
+            status_code=status,
+            media_type=entry.content_type,
+            headers=headers,
+        )
+
+    async def _read(self, f: IO[bytes], start: int, end: int) -> AsyncIterator[bytes]:
+        with f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(FILE_PROXY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    async def _pass_through(self, file_id: str, request_headers: Mapping[str, str]) -> Response:
+        """Streams an uncacheable file from upstream, forwarding Range and conditional headers."""
+        forwarded = {
+            name: request_headers[name]
+            for name in ("range", "if-range", "if-none-match")
+            if name in request_headers
+        }
+        resp = await self._get_session().get(f"{self.api_base_url}/files/{file_id}", headers=forwarded)
+        if resp.status not in (200, 206, 304):
+            content = await resp.text()
+            resp.release()
+            return JSONResponse({"error": f"Failed to fetch file: {resp.status}", "details": content}, status_code=resp.status)
+
+        headers = {
+            "Content-Disposition": resp.headers.get("content-disposition", f'attachment; filename="{file_id}"'),
+        }
+        for name in ("etag", "accept-ranges", "content-range", "content-length"):
+            if name in resp.headers:
+                headers[name] = resp.headers[name]
+
+        async def body() -> AsyncIterator[bytes]:
+            try:
+                async for chunk in resp.content.iter_chunked(FILE_PROXY_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                resp.release()
+
+        return StreamingResponse(
+            body(),
+            status_code=resp.status,
+            media_type=resp.headers.get("content-type", "application/octet-stream"),
+            headers=headers,
+        )
+
+    async def download(self, file_id: str, request_headers: Mapping[str, str]) -> Response:
+        """
+        Serves ``file_id`` from the local cache, filling it from upstream on a miss.
+
+        Args:
+            file_id: File service ID of the file.
+            request_headers: Headers of the client request (``Range``, ``If-Range``, ``If-None-Match``).
+
+        Returns:
+            Response: 200/206/304/416 response, or a JSON error for upstream failures.
+        """
+        if not _FILE_ID.fullmatch(file_id):
+            return JSONResponse({"error": "Invalid file id"}, status_code=400)
+
+        entry = self._index.get(file_id)
+        if entry is not None:
+            response = self._serve_cached(entry, request_headers)
+            if response is not None:
+                self.hits += 1
+                self._index.move_to_end(file_id)
+                return response
+            if self._index.get(file_id) is entry:
+                self._remove(file_id)
+
+        self.misses += 1
+        if file_id in self._too_large:
+            return await self._pass_through(file_id, request_headers)
+        try:
+            entry = await self._fills.do(file_id, lambda: self._fill(file_id))
+        except aiohttp.ClientResponseError as e:
+            return JSONResponse({"error": f"Failed to fetch file: {e.status}", "details": e.message}, status_code=e.status)
+        if entry is None:
+            if len(self._too_large) >= 1024:
+                self._too_large.clear()
+            self._too_large.add(file_id)
+            return await self._pass_through(file_id, request_headers)
+        response = self._serve_cached(entry, request_headers)
+        if response is None:
+            # Evicted by another fill before it could be opened
+            return await self._pass_through(file_id, request_headers)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "files": len(self._index),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "bytes_from_cache": self.bytes_from_cache,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+from typing import Any, Awaitable, Callable, Dict
+
+from cache import DiskCache, SingleFlight, TTLCache
+
+
+GENERATION_CACHE_TTL = float(os.getenv("GOLDEN_SAPPHIRE_GENERATION_CACHE_TTL", str(24 * 3600)))
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GOLDEN_SAPPHIRE_GENERATION_CACHE_MAX_ENTRIES", "1024"))
+GENERATION_CACHE_DISK_MAX_ENTRIES = int(os.getenv("GOLDEN_SAPPHIRE_GENERATION_CACHE_DISK_MAX_ENTRIES", "20000"))
+
+
+# Quoted spans of a request are kept exactly as written
+_QUOTED = re.compile(r"""('[^']*'|"[^"]*")""")
+
+
+def normalize_request(request: str) -> str:
+    """
+    Collapses whitespace outside quoted spans and trailing punctuation of a natural language request.
+
+    Case is kept: requests differing only in the case of a name or status
+    code ("sender 'ACME'" vs "sender 'acme'") must not share generated SQL.
+    """
+    parts = _QUOTED.split(request)
+    # Odd parts are the quoted spans
+    parts[::2] = [re.sub(r"\s+", " ", part) for part in parts[::2]]
+    return "".join(parts).strip().rstrip(".?!;").strip()
+
+
+def generation_key(schema_text: str, schema_context: Any, request: str) -> str:
+    """
+    Builds the cache key for a SQL generation.
+
+    Args:
+        schema_text: Raw schema definition sent to the generator.
+        schema_context: Parsed schema context (aliases, mappings, relationships).
+        request: Natural language request.
+
+    Returns:
+        str: Hex SHA-256 digest over the schema, the canonical context JSON and the normalized request.
+    """
+    digest = hashlib.sha256()
+    for part in (
+        schema_text,
+        json.dumps(schema_context, sort_keys=True, default=str),
+        normalize_request(request),
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class GenerationCache:
+    """
+    Two-tier cache for generated SQL.
+
+    Lookups hit the in-process LRU first, then the on-disk tier, and only call
+    the generator when both miss. Concurrent misses for the same key share a
+    single generator call.
+    """
+
+    def __init__(
+        self,
+        ttl: float = GENERATION_CACHE_TTL,
+        max_entries: int = GENERATION_CACHE_MAX_ENTRIES,
+        disk_max_entries: int = GENERATION_CACHE_DISK_MAX_ENTRIES,
+    ) -> None:
+        self.memory = TTLCache(maxsize=max_entries, ttl=ttl)
+        self.disk = DiskCache("sql_generation", max_entries=disk_max_entries, ttl=ttl)
+        self.single_flight = SingleFlight()
+        self.disk_hits = 0
+        self.generations = 0
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[str]]) -> str:
+        """
+        Returns the cached SQL for ``key`` or calls ``generate`` and caches its result.
+
+        Exceptions from ``generate`` propagate and nothing is cached.
+        """
+        sql = self.memory.get(key)
+        if sql is not None:
+            return sql
+
+        async def _load() -> str:
+            cached = await self.disk.get(key)
+            if cached is not None:
+                self.disk_hits += 1
+                self.memory.set(key, cached)
+                return cached
+            self.generations += 1
+            result = await generate()
+            self.memory.set(key, result)
+            await self.disk.set(key, result)
+            return result
+
+        return await self.single_flight.do(key, _load)
+
+    async def invalidate(self, key: str) -> None:
+        self.memory.invalidate(key)
+        await self.disk.invalidate(key)
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        return {
+            "memory": memory,
+            "disk_hits": self.disk_hits,
+            "generations": self.generations,
+            "coalesced": self.single_flight.coalesced,
+            "hits": memory["hits"] + self.disk_hits,
+            "misses": self.generations,
+        }
+
+
+generation_cache = GenerationCache()
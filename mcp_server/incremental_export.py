@@ -0,0 +1,337 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from cache import CACHE_DIR
+from generation_cache import normalize_request
+from replica_router import replica_router
+from result_cache import db_fingerprint
+
+
+# table:column pairs; the column should lead an index so each window is an index range scan
+INCREMENTAL_TABLES = dict(
+    pair.strip().split(":", 1)
+    for pair in os.getenv(
+        "GOLDEN_SAPPHIRE_INCREMENTAL_TABLES",
+        "amf_message:create_time,amf_event:create_time,amf_session:session_start",
+    ).split(",")
+    if ":" in pair
+)
+# Rows younger than this are left for the next run, so a row whose
+# transaction commits a little after its timestamp was taken is not skipped
+INCREMENTAL_SETTLE_SECONDS = float(os.getenv("GOLDEN_SAPPHIRE_INCREMENTAL_SETTLE_SECONDS", "30"))
+
+# Upper bound of the next window. It is read as JSON text, which is ISO 8601
+# whatever the DateStyle, and cast back to the column's type in the query;
+# NULL when no row has settled past the watermark
+BOUND_QUERY = (
+    "SELECT to_json(max({column})) #>> '{{}}' AS bound, pg_typeof(max({column}))::text AS type_name "
+    "FROM {table} WHERE {column} <= now() - make_interval(secs => $1){after}"
+)
+
+_IDENTIFIER = r'[A-Za-z_][A-Za-z0-9_$]*|"(?:[^"]|"")*"'
+_TOKEN = re.compile(
+    rf"""
+      (?P<skip>'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/|(?P<dollar>\$[A-Za-z_]*\$).*?(?P=dollar))
+    | (?P<name>(?:(?P<schema>{_IDENTIFIER})\.)?(?P<table>{_IDENTIFIER}))
+    | (?P<other>\S)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# Words that can follow a table reference without being its alias
+_NOT_ALIASES = {
+    "where", "join", "inner", "left", "right", "full", "cross", "natural", "on", "using", "group",
+    "order", "limit", "offset", "having", "union", "intersect", "except", "window", "for", "fetch",
+    "tablesample",
+}
+
+
+class IncrementalError(Exception):
+    """Raised when a query cannot be exported incrementally."""
+
+
+def typed_literal(value: str, type_name: str) -> str:
+    return "'" + value.replace("'", "''") + "'::" + type_name
+
+
+def _identifier(name: str) -> str:
+    # Unquoted names fold to lower case; quoted ones are taken as written
+    return name[1:-1].replace('""', '"') if name.startswith('"') else name.lower()
+
+
+@dataclass(frozen=True)
+class TableReference:
+    """A watermarked table in the FROM or JOIN clause of a query."""
+    table: str
+    start: int
+    end: int
+    text: str
+    has_alias: bool
+
+
+def table_references(sql: str, tables: Dict[str, str] = INCREMENTAL_TABLES) -> List[TableReference]:
+    """
+    Finds the references to ``tables`` in the FROM and JOIN clauses of ``sql``.
+
+    Raises:
+        IncrementalError: If a table is referenced some other way (e.g. in a
+            comma-separated FROM list), where its rows could not be limited.
+    """
+    tokens = [match for match in _TOKEN.finditer(sql) if not match.group("skip")]
+    references = []
+    for index, match in enumerate(tokens):
+        if not match.group("name") or _identifier(match.group("table")) not in tables:
+            continue
+        previous = tokens[index - 1].group(0).lower() if index else ""
+        following = tokens[index + 1] if index + 1 < len(tokens) else None
+        if following is not None and following.group(0) == ".":
+            # schema.table.column: a qualified column, not a table
+            continue
+        if previous not in ("from", "join"):
+            raise IncrementalError(
+                f"{match.group('table')} is referenced outside a FROM or JOIN clause, "
+                "so its rows cannot be limited to the new ones"
+            )
+        has_alias = (
+            following is not None
+            and bool(following.group("name"))
+            and following.group(0).lower() not in _NOT_ALIASES
+        )
+        references.append(TableReference(_identifier(match.group("table")), match.start(), match.end(), match.group(0), has_alias))
+    return references
+
+
+@dataclass(frozen=True)
+class Window:
+    """Rows of ``table`` whose ``column`` is past ``start`` (all when None) and at most ``end``."""
+    key: str
+    table: str
+    column: str
+    start: Optional[str]
+    end: Optional[str]
+    type_name: Optional[str]
+
+    @property
+    def empty(self) -> bool:
+        return self.end is None or self.end == self.start
+
+    def predicate(self) -> str:
+        if self.end is None:
+            # Nothing has settled yet
+            return "false"
+        bounds = [f"{self.column} <= {typed_literal(self.end, self.type_name)}"]
+        if self.start is not None:
+            bounds.insert(0, f"{self.column} > {typed_literal(self.start, self.type_name)}")
+        return " AND ".join(bounds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"table": self.table, "column": self.column, "from": self.start, "to": self.end}
+
+
+def rewrite_query(sql: str, references: Sequence[TableReference], windows: Dict[str, Window]) -> str:
+    """
+    Limits each watermarked table in ``sql`` to its window.
+
+    ``FROM amf_message m`` becomes ``FROM (SELECT * FROM amf_message WHERE
+    create_time > ... AND create_time <= ...) m``. Postgres pulls such
+    subqueries up into the outer query, so the bounds reach the time index
+    and the rest of the query is unchanged: joins, filters and aggregates
+    all see only the new rows.
+    """
+    out = []
+    position = 0
+    for reference in references:
+        window = windows[reference.table]
+        out.append(sql[position:reference.start])
+        out.append(f"(SELECT * FROM {reference.text} WHERE {window.predicate()})")
+        if not reference.has_alias:
+            # Columns qualified with the table name still resolve
+            out.append(f' AS "{reference.table}"')
+        position = reference.end
+    out.append(sql[position:])
+    return "".join(out)
+
+
+def request_fingerprint(request: str) -> str:
+    """Hex SHA-256 of the normalized request, so requests differing only in spacing share a watermark."""
+    return hashlib.sha256(normalize_request(request).encode("utf-8")).hexdigest()
+
+
+class WatermarkStore:
+    """
+    SQLite table of watermarks: the end of the last exported window per
+    (request fingerprint, DB fingerprint, table).
+
+    Watermarks only move through :meth:`advance`, which sets all of an
+    export's windows in one transaction and only if none moved meanwhile.
+    """
+
+    def __init__(self, name: str = "watermarks", directory: str = CACHE_DIR) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                "key TEXT PRIMARY KEY, table_name TEXT NOT NULL, column_name TEXT NOT NULL, "
+                "value TEXT NOT NULL, type_name TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+        # Runs of the same export in this process wait for each other instead of overlapping
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        self.advanced = 0
+        self.conflicts = 0
+        self.empty = 0
+
+    def _get(self, key: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, type_name FROM watermarks WHERE key = ?", (key,)).fetchone()
+        return tuple(row) if row else None
+
+    async def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """The watermark for ``key`` and the Postgres type of its column, or None before the first export."""
+        return await asyncio.to_thread(self._get, key)
+
+    def _advance(self, windows: Sequence[Window]) -> bool:
+        now = time.time()
+        with self._lock:
+            try:
+                with self._conn:
+                    for window in windows:
+                        if window.start is None:
+                            cursor = self._conn.execute(
+                                "INSERT OR IGNORE INTO watermarks (key, table_name, column_name, value, type_name, updated_at) "
+                                "VALUES (?, ?, ?, ?, ?, ?)",
+                                (window.key, window.table, window.column, window.end, window.type_name, now),
+                            )
+                        else:
+                            cursor = self._conn.execute(
+                                "UPDATE watermarks SET value = ?, type_name = ?, updated_at = ? WHERE key = ? AND value = ?",
+                                (window.end, window.type_name, now, window.key, window.start),
+                            )
+                        if cursor.rowcount != 1:
+                            raise _Conflict()
+            except _Conflict:
+                return False
+        return True
+
+    async def advance(self, windows: Sequence[Window]) -> bool:
+        """
+        Moves each window's watermark from its start to its end, all or none.
+
+        Returns:
+            bool: False if another export moved one of them first; nothing is changed then.
+        """
+        windows = [window for window in windows if not window.empty]
+        if not windows:
+            self.empty += 1
+            return True
+        advanced = await asyncio.to_thread(self._advance, windows)
+        if advanced:
+            self.advanced += 1
+        else:
+            self.conflicts += 1
+        return advanced
+
+    def _reset(self, keys: Sequence[str]) -> int:
+        with self._lock, self._conn:
+            return self._conn.executemany("DELETE FROM watermarks WHERE key = ?", [(key,) for key in keys]).rowcount
+
+    async def reset(self, keys: Sequence[str]) -> int:
+        """Drops watermarks, so the next incremental export starts from the full history."""
+        return await asyncio.to_thread(self._reset, keys)
+
+    @asynccontextmanager
+    async def locked(self, keys: Sequence[str]):
+        async with AsyncExitStack() as stack:
+            # Sorted, so two exports sharing several keys cannot deadlock
+            for key in sorted(set(keys)):
+                await stack.enter_async_context(self._key_locks.setdefault(key, asyncio.Lock()))
+            yield
+
+    def _count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM watermarks").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "watermarks": self._count(),
+            "advanced": self.advanced,
+            "conflicts": self.conflicts,
+            "empty": self.empty,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class _Conflict(Exception):
+    pass
+
+
+watermarks = WatermarkStore()
+
+
+@dataclass(frozen=True)
+class IncrementalPlan:
+    """An incremental export: the rewritten query and the windows it covers."""
+    sql: str
+    windows: Tuple[Window, ...]
+
+    @property
+    def empty(self) -> bool:
+        return all(window.empty for window in self.windows)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"windows": [window.to_dict() for window in self.windows]}
+
+
+def watermark_key(request: str, db_config: Any, table: str) -> str:
+    return f"{request_fingerprint(request)}:{db_fingerprint(db_config)}:{table}"
+
+
+async def plan_incremental(
+    db_config: Any,
+    request: str,
+    sql: str,
+    store: WatermarkStore = watermarks,
+    tables: Dict[str, str] = INCREMENTAL_TABLES,
+    settle_seconds: float = INCREMENTAL_SETTLE_SECONDS,
+) -> IncrementalPlan:
+    """
+    Rewrites ``sql`` to read only the rows past each table's watermark.
+
+    Each window ends at the newest row at least ``settle_seconds`` old, read
+    on the primary: the bound and the export must see the same rows, which a
+    replica lagging behind the other would not guarantee.
+
+    Raises:
+        IncrementalError: If the query reads none of ``tables``, or one of
+            them in a way that cannot be limited.
+    """
+    references = table_references(sql, tables)
+    if not references:
+        raise IncrementalError(
+            "Incremental exports need a query on one of: " + ", ".join(sorted(tables))
+        )
+    windows = {}
+    async with replica_router.acquire(db_config, None, 0) as conn:
+        for table in dict.fromkeys(reference.table for reference in references):
+            column = tables[table]
+            key = watermark_key(request, db_config, table)
+            watermark = await store.get(key)
+            start = watermark[0] if watermark else None
+            after = f" AND {column} > {typed_literal(*watermark)}" if watermark else ""
+            row = await conn.fetchrow(BOUND_QUERY.format(table=table, column=column, after=after), settle_seconds)
+            # Nothing new: the window is empty and the watermark stays put
+            end = row["bound"] if row["bound"] is not None else start
+            windows[table] = Window(key, table, column, start, end, row["type_name"])
+    return IncrementalPlan(rewrite_query(sql, references, windows), tuple(windows.values()))
@@ -0,0 +1,353 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from urllib.parse import quote
+
+import asyncpg
+
+
+POOL_MIN_SIZE = int(os.getenv("GOLDEN_SAPPHIRE_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("GOLDEN_SAPPHIRE_POOL_MAX_SIZE", "10"))
+POOL_MAX_POOLS = int(os.getenv("GOLDEN_SAPPHIRE_POOL_MAX_POOLS", "8"))
+POOL_IDLE_TTL = float(os.getenv("GOLDEN_SAPPHIRE_POOL_IDLE_TTL", "600"))
+POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("GOLDEN_SAPPHIRE_POOL_HEALTH_CHECK_INTERVAL", "30"))
+POOL_CONNECTION_IDLE_LIFETIME = float(os.getenv("GOLDEN_SAPPHIRE_POOL_CONNECTION_IDLE_LIFETIME", "300"))
+# Prepared statements kept per pooled connection; 0 prepares every query again
+POOL_STATEMENT_CACHE_SIZE = int(os.getenv("GOLDEN_SAPPHIRE_POOL_STATEMENT_CACHE_SIZE", "100"))
+
+
+def resolve_dsn(db_config: Any) -> str:
+    """
+    Resolves a PostgreSQL connection string from a DB config.
+
+    Args:
+        db_config: Either a plain connection string or a dict parsed from the
+            DB config file. Dicts may carry a ``dsn``/``url``/``db_url`` key or
+            the individual ``host``, ``port``, ``user``, ``password`` and
+            ``database`` fields. A config with a ``primary`` (and
+            ``replicas``) resolves to the primary.
+
+    Returns:
+        str: The connection string. Falls back to ``GOLDEN_SAPPHIRE_DB_URL``
+        when the config is empty.
+    """
+    if isinstance(db_config, dict):
+        if db_config.get("primary"):
+            return resolve_dsn(db_config["primary"])
+        for key in ("dsn", "url", "db_url"):
+            if db_config.get(key):
+                return db_config[key]
+        if db_config.get("host"):
+            user = quote(str(db_config.get("user", "")), safe="")
+            password = db_config.get("password")
+            auth = f"{user}:{quote(str(password), safe='')}@" if password else (f"{user}@" if user else "")
+            port = f":{db_config['port']}" if db_config.get("port") else ""
+            database = db_config.get("database") or db_config.get("dbname") or ""
+            return f"postgresql://{auth}{db_config['host']}{port}/{database}"
+        db_config = None
+    dsn = (db_config or "").strip() or os.getenv("GOLDEN_SAPPHIRE_DB_URL", "")
+    if not dsn:
+        raise ValueError("No database connection string configured")
+    return dsn
+
+
+class PoolStats:
+    """Counters collected for a single pool."""
+
+    def __init__(self) -> None:
+        self.acquires = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+        self.in_use = 0
+        self.connections_opened = 0
+        self.connections_discarded = 0
+        self.health_checks = 0
+        self.health_check_failures = 0
+        self.statement_hits = 0
+        self.statement_misses = 0
+
+    def record_acquire(self, wait: float) -> None:
+        self.acquires += 1
+        self.acquire_wait_total += wait
+        self.acquire_wait_max = max(self.acquire_wait_max, wait)
+
+    def as_dict(self) -> Dict[str, Any]:
+        avg_wait = self.acquire_wait_total / self.acquires if self.acquires else 0.0
+        return {
+            "acquires": self.acquires,
+            "acquire_wait_avg_ms": round(avg_wait * 1000, 3),
+            "acquire_wait_max_ms": round(self.acquire_wait_max * 1000, 3),
+            "in_use": self.in_use,
+            "connections_opened": self.connections_opened,
+            "connections_discarded": self.connections_discarded,
+            "health_checks": self.health_checks,
+            "health_check_failures": self.health_check_failures,
+            "statement_cache_hits": self.statement_hits,
+            "statement_cache_misses": self.statement_misses,
+        }
+
+
+class CachingConnection(asyncpg.Connection):
+    """
+    Connection that keeps its prepared statements by SQL text, see :func:`prepare_cached`.
+
+    asyncpg's own statement cache only serves ``fetch``/``cursor`` calls and
+    counts nothing; this one backs explicit prepares and reports its hits.
+    It lives and dies with the connection, so statements never outlive the
+    session they were prepared in.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.statements: "OrderedDict[str, asyncpg.prepared_stmt.PreparedStatement]" = OrderedDict()
+        self.pool_stats: Optional[PoolStats] = None
+
+
+async def prepare_cached(conn: asyncpg.Connection, sql: str) -> "asyncpg.prepared_stmt.PreparedStatement":
+    """
+    Returns the prepared statement for ``sql`` on ``conn``, preparing it on first use.
+
+    Recurring queries skip parsing and planning setup. Connections that are
+    not :class:`CachingConnection` (or a cache size of 0) prepare every time.
+    """
+    statements = getattr(conn, "statements", None)
+    if statements is None or POOL_STATEMENT_CACHE_SIZE <= 0:
+        return await conn.prepare(sql)
+    stats = conn.pool_stats
+    statement = statements.get(sql)
+    if statement is not None:
+        statements.move_to_end(sql)
+        if stats is not None:
+            stats.statement_hits += 1
+        return statement
+    if stats is not None:
+        stats.statement_misses += 1
+    statement = await conn.prepare(sql)
+    statements[sql] = statement
+    if len(statements) > POOL_STATEMENT_CACHE_SIZE:
+        statements.popitem(last=False)
+    return statement
+
+
+class _PoolEntry:
+    def __init__(self, pool: asyncpg.Pool, stats: PoolStats) -> None:
+        self.pool = pool
+        self.stats = stats
+        self.last_used = time.monotonic()
+        # acquire() calls holding or waiting for one of its connections; the
+        # pool is not closed while any are
+        self.leases = 0
+        # Last successful health check, keyed by backend pid since pool
+        # proxies are recreated on every acquire.
+        self.checked_at: Dict[int, float] = {}
+
+
+class PoolRegistry:
+    """
+    Keeps one asyncpg pool per DSN so queries reuse warm connections instead of
+    reconnecting for every call.
+
+    Pools are kept in LRU order. When more than ``max_pools`` are open, or a
+    pool has been idle for longer than ``idle_ttl`` seconds, the least recently
+    used idle pool is closed. A background task checks for expired pools every
+    ``idle_ttl / 2`` seconds (at most a minute), so they close even when no new
+    DSN comes along. Connections that have not been used for
+    ``health_check_interval`` seconds are pinged before being handed out.
+    """
+
+    def __init__(
+        self,
+        min_size: int = POOL_MIN_SIZE,
+        max_size: int = POOL_MAX_SIZE,
+        max_pools: int = POOL_MAX_POOLS,
+        idle_ttl: float = POOL_IDLE_TTL,
+        health_check_interval: float = POOL_HEALTH_CHECK_INTERVAL,
+        connection_idle_lifetime: float = POOL_CONNECTION_IDLE_LIFETIME,
+    ) -> None:
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_pools = max_pools
+        self.idle_ttl = idle_ttl
+        self.health_check_interval = health_check_interval
+        self.connection_idle_lifetime = connection_idle_lifetime
+        self._pools: "OrderedDict[str, _PoolEntry]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._closed = False
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def get_pool(self, dsn: str) -> asyncpg.Pool:
+        """Returns the pool for ``dsn``, creating it on first use."""
+        return (await self._get_entry(dsn)).pool
+
+    async def _get_entry(self, dsn: str, lease: bool = False) -> _PoolEntry:
+        # With ``lease`` the entry is leased before anything else can run, so
+        # it cannot be evicted between this lookup and the caller's acquire
+        if self._closed:
+            raise RuntimeError("Pool registry is closed")
+        entry = self._pools.get(dsn)
+        if entry is not None:
+            self._pools.move_to_end(dsn)
+            entry.last_used = time.monotonic()
+            entry.leases += lease
+            return entry
+
+        async with self._lock:
+            entry = self._pools.get(dsn)
+            if entry is None:
+                stats = PoolStats()
+
+                async def _on_connect(conn: asyncpg.Connection) -> None:
+                    stats.connections_opened += 1
+                    conn.pool_stats = stats
+
+                pool = await asyncpg.create_pool(
+                    dsn,
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    max_inactive_connection_lifetime=self.connection_idle_lifetime,
+                    init=_on_connect,
+                    connection_class=CachingConnection,
+                )
+                entry = _PoolEntry(pool, stats)
+                self._pools[dsn] = entry
+                if self._sweeper is None:
+                    self._sweeper = asyncio.create_task(self._sweep())
+            self._pools.move_to_end(dsn)
+            entry.last_used = time.monotonic()
+            await self._evict_idle(keep=dsn)
+            entry.leases += lease
+            return entry
+
+    async def _evict_idle(self, keep: Optional[str] = None) -> None:
+        # Callers hold the lock. The lease checks and removals all happen
+        # before the first await, so no acquire can lease a pool being closed
+        now = time.monotonic()
+        closing = []
+        for dsn, entry in list(self._pools.items()):
+            over_capacity = len(self._pools) > self.max_pools
+            expired = now - entry.last_used > self.idle_ttl
+            if not (over_capacity or expired):
+                continue
+            if entry.leases or dsn == keep:
+                continue
+            del self._pools[dsn]
+            closing.append(entry)
+        for entry in closing:
+            try:
+                await entry.pool.close()
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError):
+                entry.pool.terminate()
+
+    async def _sweep(self) -> None:
+        # Closes pools that went idle even when no new DSN comes along
+        interval = max(1.0, min(self.idle_ttl / 2, 60.0))
+        while not self._closed:
+            await asyncio.sleep(interval)
+            async with self._lock:
+                if not self._closed:
+                    await self._evict_idle()
+
+    async def _health_check(self, entry: _PoolEntry, conn: asyncpg.Connection) -> bool:
+        now = time.monotonic()
+        key = conn.get_server_pid()
+        if now - entry.checked_at.get(key, 0.0) < self.health_check_interval:
+            return True
+        entry.stats.health_checks += 1
+        try:
+            await conn.execute("SELECT 1")
+        except (asyncpg.PostgresError, OSError, asyncpg.InterfaceError):
+            entry.stats.health_check_failures += 1
+            return False
+        if len(entry.checked_at) > 4 * self.max_size:
+            entry.checked_at.clear()
+        entry.checked_at[key] = now
+        return True
+
+    @asynccontextmanager
+    async def acquire(self, dsn: str):
+        """
+        Acquires a health-checked connection from the pool for ``dsn``.
+
+        Usage:
+            async with pg_pools.acquire(dsn) as conn:
+                rows = await conn.fetch(sql)
+        """
+        entry = await self._get_entry(dsn, lease=True)
+        try:
+            started = time.monotonic()
+            conn = await entry.pool.acquire()
+            while not await self._health_check(entry, conn):
+                entry.stats.connections_discarded += 1
+                conn.terminate()
+                await entry.pool.release(conn)
+                conn = await entry.pool.acquire()
+            entry.stats.record_acquire(time.monotonic() - started)
+            entry.stats.in_use += 1
+            try:
+                yield conn
+            except (asyncpg.InvalidCachedStatementError, asyncpg.FeatureNotSupportedError):
+                # A schema change invalidated the connection's prepared statements
+                conn.statements.clear()
+                raise
+            finally:
+                entry.stats.in_use -= 1
+                entry.last_used = time.monotonic()
+                await entry.pool.release(conn)
+        finally:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+
+    def in_use(self, dsn: str) -> int:
+        """Connections to ``dsn`` currently handed out."""
+        entry = self._pools.get(dsn)
+        return entry.stats.in_use if entry is not None else 0
+
+    def statement_stats(self) -> Dict[str, Any]:
+        """Prepared statement cache hits and misses across all pools."""
+        hits = sum(entry.stats.statement_hits for entry in self._pools.values())
+        misses = sum(entry.stats.statement_misses for entry in self._pools.values())
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            "max_size_per_connection": POOL_STATEMENT_CACHE_SIZE,
+        }
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Returns per-pool statistics keyed by DSN with credentials masked."""
+        result = {}
+        for dsn, entry in self._pools.items():
+            pool_stats = entry.stats.as_dict()
+            pool_stats["size"] = entry.pool.get_size()
+            pool_stats["idle"] = entry.pool.get_idle_size()
+            result[_mask_dsn(dsn)] = pool_stats
+        return result
+
+    async def close(self, timeout: Optional[float] = 30) -> None:
+        """Drains every pool, waiting up to ``timeout`` seconds for queries in flight."""
+        self._closed = True
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        entries = list(self._pools.values())
+        self._pools.clear()
+        for entry in entries:
+            try:
+                await asyncio.wait_for(entry.pool.close(), timeout=timeout)
+            except asyncio.TimeoutError:
+                entry.pool.terminate()
+
+
+def _mask_dsn(dsn: str) -> str:
+    scheme, sep, rest = dsn.partition("://")
+    if not sep or "@" not in rest:
+        return dsn
+    credentials, _, host = rest.rpartition("@")
+    user = credentials.split(":", 1)[0]
+    return f"{scheme}://{user}:***@{host}"
+
+
+pg_pools = PoolRegistry()
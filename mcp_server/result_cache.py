@@ -0,0 +1,128 @@
+import hashlib
+import os
+import re
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from cache import DiskCache, SingleFlight, TTLCache
+from pg_pool import resolve_dsn
+
+
+RESULT_CACHE_TTL = float(os.getenv("GOLDEN_SAPPHIRE_RESULT_CACHE_TTL", "900"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("GOLDEN_SAPPHIRE_RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.getenv("GOLDEN_SAPPHIRE_RESULT_CACHE_DISK_MAX_ENTRIES", "10000"))
+
+# Literals and quoted identifiers are kept verbatim; everything else is normalized
+_SQL_LITERAL = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|(\$[A-Za-z_]*\$).*?\1""", re.DOTALL)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Canonical form of a query for cache lookups.
+
+    Whitespace is collapsed, trailing semicolons are dropped and everything
+    outside literals and quoted identifiers is lower-cased (Postgres folds
+    unquoted identifiers and keywords anyway).
+    """
+    parts = []
+    position = 0
+    for match in _SQL_LITERAL.finditer(sql):
+        parts.append(re.sub(r"\s+", " ", sql[position:match.start()]).lower())
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(re.sub(r"\s+", " ", sql[position:]).lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def db_fingerprint(db_config: Any) -> str:
+    """Hex SHA-256 of the resolved DSN, so the cache never holds credentials."""
+    return hashlib.sha256(resolve_dsn(db_config).encode("utf-8")).hexdigest()
+
+
+def result_key(db_config: Any, sql: str, output_format: str) -> str:
+    """
+    Builds the cache key for an export.
+
+    Args:
+        db_config: Database connection string or parsed DB config.
+        sql: Generated SQL query.
+        output_format: Export format.
+
+    Returns:
+        str: Hex SHA-256 digest over the DB fingerprint, the normalized SQL and the format.
+    """
+    digest = hashlib.sha256()
+    for part in (db_fingerprint(db_config), normalize_sql(sql), output_format.lower()):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Maps an export (DB, normalized SQL, format) to the file it was uploaded as.
+
+    Entries are dicts with at least ``file_id`` and ``filename``, kept in
+    memory and on disk for ``ttl`` seconds so a repeated export only needs a
+    new signed link. Concurrent identical exports share one run.
+    """
+
+    def __init__(
+        self,
+        ttl: float = RESULT_CACHE_TTL,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        disk_max_entries: int = RESULT_CACHE_DISK_MAX_ENTRIES,
+    ) -> None:
+        self.memory = TTLCache(maxsize=max_entries, ttl=ttl)
+        self.disk = DiskCache("export_results", max_entries=disk_max_entries, ttl=ttl)
+        self.single_flight = SingleFlight()
+        self.disk_hits = 0
+        self.exports = 0
+
+    async def get_or_export(self, key: str, export: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """
+        Returns the cached export for ``key`` or runs ``export`` and caches its result.
+
+        Exceptions from ``export`` propagate and nothing is cached.
+
+        Returns:
+            Tuple[Dict[str, Any], bool]: The export entry and whether it came from the cache.
+        """
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry, True
+
+        async def _load() -> Tuple[Dict[str, Any], bool]:
+            cached = await self.disk.get(key)
+            if cached is not None:
+                self.disk_hits += 1
+                self.memory.set(key, cached)
+                return cached, True
+            self.exports += 1
+            result = await export()
+            self.memory.set(key, result)
+            await self.disk.set(key, result)
+            return result, False
+
+        return await self.single_flight.do(key, _load)
+
+    async def invalidate(self, key: str) -> None:
+        self.memory.invalidate(key)
+        await self.disk.invalidate(key)
+
+    async def clear(self) -> None:
+        self.memory.clear()
+        await self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        return {
+            "memory": memory,
+            "disk_hits": self.disk_hits,
+            "exports": self.exports,
+            "coalesced": self.single_flight.coalesced,
+            "hits": memory["hits"] + self.disk_hits,
+            "misses": self.exports,
+        }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,160 @@
+import datetime
+import decimal
+import json
+import os
+import uuid
+from operator import methodcaller
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import asyncpg
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# "orjson" when it is installed, "json" otherwise; set to "json" to force the stdlib
+JSON_BACKEND = os.getenv("GOLDEN_SAPPHIRE_JSON_BACKEND", "orjson" if orjson is not None else "json")
+
+Converter = Callable[[Any], Any]
+
+
+def json_default(obj: Any) -> Any:
+    """``json.dumps`` fallback for the non-JSON types asyncpg returns."""
+    if isinstance(obj, (uuid.UUID, decimal.Decimal)):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).hex()
+    return str(obj)
+
+
+def json_safe(value: Any) -> Any:
+    """Converter for columns of unknown type (enums, ranges, composites...)."""
+    if isinstance(value, (str, int, float, bool, dict, list)):
+        return value
+    return json_default(value)
+
+
+def _hex(value: Any) -> str:
+    return bytes(value).hex()
+
+
+def _total_seconds(value: datetime.timedelta) -> float:
+    return value.total_seconds()
+
+
+_isoformat = methodcaller("isoformat")
+
+# Postgres type name -> converter to a JSON value; None means asyncpg already returns one
+PG_CONVERTERS: Dict[str, Optional[Converter]] = {
+    "uuid": str,
+    "numeric": str,
+    "timestamp": _isoformat,
+    "timestamptz": _isoformat,
+    "date": _isoformat,
+    "time": _isoformat,
+    "timetz": _isoformat,
+    "interval": _total_seconds,
+    "bytea": _hex,
+    "bool": None,
+    "int2": None,
+    "int4": None,
+    "int8": None,
+    "oid": None,
+    "float4": None,
+    "float8": None,
+    "text": None,
+    "varchar": None,
+    "bpchar": None,
+    "name": None,
+    "char": None,
+    "json": None,
+    "jsonb": None,
+}
+
+
+# Types orjson already writes exactly like their isoformat(); no conversion needed for it
+ORJSON_NATIVE_TYPES = frozenset({"timestamp", "timestamptz", "date", "time"})
+
+
+def column_converter(pg_type: asyncpg.types.Type) -> Optional[Converter]:
+    """Returns the converter for a result column type, or None if values pass through unchanged."""
+    if pg_type.kind == "array":
+        # Array type names are the element name with a leading underscore
+        element = PG_CONVERTERS.get(pg_type.name[1:], json_safe)
+        if element is None:
+            return None
+
+        def convert_array(values: list) -> list:
+            return [
+                None if v is None else convert_array(v) if isinstance(v, list) else element(v)
+                for v in values
+            ]
+        return convert_array
+    return PG_CONVERTERS.get(pg_type.name, json_safe)
+
+
+class RowEncoder:
+    """
+    Turns asyncpg records into JSON-ready dicts with one converter per column.
+
+    Converters are chosen once from the statement's attribute types and then
+    applied column by column to every batch, so the cost depends on the
+    number of columns that need converting rather than on a type check per
+    value. Columns whose values are already JSON types are not touched.
+
+    Rows meant for ``dumps`` can pass ``backend``: with orjson, date and time
+    columns are left for orjson to write natively.
+    """
+
+    def __init__(self, columns: Sequence[asyncpg.Attribute], backend: Optional[str] = None) -> None:
+        self.columns = tuple(columns)
+        self.backend = backend
+        self.names = [column.name for column in columns]
+        self._converters = []
+        for index, column in enumerate(columns):
+            if backend == "orjson" and orjson is not None and column.type.name in ORJSON_NATIVE_TYPES:
+                continue
+            converter = column_converter(column.type)
+            if converter is not None:
+                self._converters.append((index, converter))
+
+    def encode(self, records: Sequence[asyncpg.Record]) -> List[Dict[str, Any]]:
+        """
+        Converts a batch of records.
+
+        Args:
+            records: Rows of the statement this encoder was built for.
+
+        Returns:
+            List[Dict[str, Any]]: One dict per row, ready for ``dumps``.
+        """
+        if not records:
+            return []
+        names = self.names
+        if not self._converters:
+            return [dict(zip(names, record)) for record in records]
+        columns = list(zip(*records))
+        for index, converter in self._converters:
+            columns[index] = [None if v is None else converter(v) for v in columns[index]]
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serializes ``obj`` to UTF-8 JSON with the configured backend.
+
+    orjson only encodes 64-bit integers; objects it rejects (e.g. a 20+
+    digit ID from a CSV) are encoded with the stdlib instead.
+    """
+    if JSON_BACKEND == "orjson" and orjson is not None:
+        try:
+            return orjson.dumps(obj, default=json_default)
+        except TypeError:
+            pass
+    return json.dumps(obj, default=json_default, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,66 @@
+import decimal
+import io
+
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+import pytest
+from asyncpg import Attribute, Type
+
+from arrow_export import ArrowBatchEncoder
+
+D = decimal.Decimal
+
+COLUMNS = [
+    Attribute("id", Type(23, "int4", "scalar", "pg_catalog")),
+    Attribute("amount", Type(1700, "numeric", "scalar", "pg_catalog")),
+]
+
+# The first batch has no numeric values at all, later ones change scale
+BATCHES = [
+    [(1, None), (2, None)],
+    [(3, D("3.1")), (4, D("12.25"))],
+    [(5, D("0.0001")), (6, D("NaN")), (7, D("-Infinity"))],
+    [(8, D("1.23456789012")), (9, D("-12345678901234567890.5"))],
+]
+EXPECTED = [
+    None, None, D("3.1"), D("12.25"), D("0.0001"), None, None,
+    D("1.234567890"), D("-12345678901234567890.5"),
+]
+
+
+def _read(output_format: str, data: bytes):
+    if output_format == "parquet":
+        return pq.read_table(io.BytesIO(data))
+    return ipc.open_file(io.BytesIO(data)).read_all()
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_numeric_scale_changes_across_batches(output_format):
+    out = io.BytesIO()
+    encoder = ArrowBatchEncoder(out, output_format, COLUMNS)
+    for batch in BATCHES:
+        encoder.write_batch(batch)
+    encoder.close()
+
+    table = _read(output_format, out.getvalue())
+    assert table.column("id").to_pylist() == list(range(1, 10))
+    assert table.column("amount").to_pylist() == EXPECTED
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_numeric_at_full_precision(output_format):
+    out = io.BytesIO()
+    encoder = ArrowBatchEncoder(out, output_format, COLUMNS)
+    encoder.write_batch([(1, D("12345678901234567890123456789.1234567894"))])
+    encoder.close()
+
+    table = _read(output_format, out.getvalue())
+    assert table.column("amount").to_pylist() == [D("12345678901234567890123456789.123456789")]
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_numeric_overflow_names_the_column(output_format):
+    encoder = ArrowBatchEncoder(io.BytesIO(), output_format, COLUMNS)
+    encoder.write_batch([(1, D("12.5"))])
+    with pytest.raises(ValueError, match="'amount' has a value with 31 integer digits"):
+        encoder.write_batch([(2, D("1e30"))])
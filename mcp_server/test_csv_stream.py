@@ -0,0 +1,21 @@
+import io
+import json
+
+import pytest
+
+from csv_stream import CsvToJsonConverter
+
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl"])
+def test_integers_wider_than_64_bits(output_format):
+    out = io.BytesIO()
+    converter = CsvToJsonConverter(out, output_format)
+    converter.feed(b"id,name\n12345678901234567890123,x\n-99999999999999999999,y\n")
+    converter.close()
+
+    text = out.getvalue().decode("utf-8")
+    rows = json.loads(text) if output_format == "json" else [json.loads(line) for line in text.splitlines()]
+    assert rows == [
+        {"id": 12345678901234567890123, "name": "x"},
+        {"id": -99999999999999999999, "name": "y"},
+    ]